@@ -0,0 +1,241 @@
+# admission.py
+"""
+Admission control and fair scheduling in front of the predictors.
+
+- A request (one upload, any number of frames) is admitted up front or answered
+  with 429 + Retry-After: at most ADMISSION_MAX_REQUESTS admitted uploads per
+  API process, and ADMISSION_MAX_PER_USER per user.
+- Each frame then waits for a slot of its model's lane. Lanes have a concurrency
+  limit (ADMISSION_MODEL_LIMITS, e.g. "unetpp=1,unet=1,maskrcnn=1,default=2");
+  composite models ("ensemble", "auto") are lanes of their own.
+- Waiters are served round-robin across users, so a 200-frame upload gets one
+  slot in turn with everyone else instead of running ahead. Single-frame
+  (interactive) requests go before bulk frames, but at most
+  ADMISSION_INTERACTIVE_BURST times in a row while bulk work is waiting.
+
+State is per API process (asyncio, no locks). With the inference pool the limits
+bound what each API process sends to it.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+
+import metrics
+
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION", "1") == "1"
+ADMISSION_MAX_REQUESTS = int(os.environ.get("ADMISSION_MAX_REQUESTS", "32"))
+ADMISSION_MAX_PER_USER = int(os.environ.get("ADMISSION_MAX_PER_USER", "2"))
+ADMISSION_MODEL_LIMITS = os.environ.get("ADMISSION_MODEL_LIMITS", "unetpp=1,unet=1,maskrcnn=1,ensemble=1,default=2")
+ADMISSION_INTERACTIVE_BURST = int(os.environ.get("ADMISSION_INTERACTIVE_BURST", "4"))
+RETRY_AFTER_MAX = 120          # seconds
+SERVICE_EWMA_ALPHA = 0.2       # smoothing of per-lane frame service time (Retry-After estimate)
+DEFAULT_SERVICE_S = 1.0        # until a lane has served a frame
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+REJECT_BUSY = "busy"
+REJECT_USER = "user_limit"
+
+
+def parse_limits(raw: str):
+    """"unetpp=1,default=2" -> ({"unetpp": 1}, default)."""
+    limits, default = {}, 2
+    for part in (raw or "").split(","):
+        name, _, value = part.partition("=")
+        if not name.strip() or not value.strip():
+            continue
+        if name.strip() == "default":
+            default = max(1, int(value))
+        else:
+            limits[name.strip()] = max(1, int(value))
+    return limits, default
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Lane:
+    def __init__(self, model: str, limit: int):
+        self.model = model
+        self.limit = limit
+        self.running = 0
+        self.waiting = {INTERACTIVE: OrderedDict(), BULK: OrderedDict()}   # user -> deque[Future]
+        self.queued = 0
+        self.interactive_streak = 0
+        self.service_s = None
+        self.served = 0
+
+    def _pop(self, klass: str):
+        users = self.waiting[klass]
+        while users:
+            user, q = next(iter(users.items()))
+            fut = q.popleft()
+            del users[user]
+            if q:
+                users[user] = q   # back of the rotation
+            self.queued -= 1
+            if not fut.done():
+                return fut
+        return None
+
+    def dispatch(self):
+        while self.running < self.limit and self.queued:
+            has_bulk = bool(self.waiting[BULK])
+            if self.waiting[INTERACTIVE] and (not has_bulk or self.interactive_streak < ADMISSION_INTERACTIVE_BURST):
+                fut = self._pop(INTERACTIVE)
+                self.interactive_streak += 1
+            else:
+                fut = self._pop(BULK)
+                self.interactive_streak = 0
+            if fut is None:
+                continue
+            self.running += 1
+            fut.set_result(None)
+
+    def remove(self, klass: str, user: str, fut):
+        q = self.waiting[klass].get(user)
+        if q is not None and fut in q:
+            q.remove(fut)
+            self.queued -= 1
+            if not q:
+                del self.waiting[klass][user]
+
+    def record(self, seconds: float):
+        self.served += 1
+        self.service_s = seconds if self.service_s is None else (
+            SERVICE_EWMA_ALPHA * seconds + (1 - SERVICE_EWMA_ALPHA) * self.service_s
+        )
+
+    def retry_after(self) -> int:
+        per_frame = self.service_s if self.service_s is not None else DEFAULT_SERVICE_S
+        est = per_frame * (self.queued + self.running + 1) / self.limit
+        return int(min(RETRY_AFTER_MAX, max(1, math.ceil(est))))
+
+
+class AdmissionController:
+    def __init__(self, max_requests: int = ADMISSION_MAX_REQUESTS, max_per_user: int = ADMISSION_MAX_PER_USER,
+                 limits: str = ADMISSION_MODEL_LIMITS, enabled: bool = ADMISSION_ENABLED):
+        self.enabled = enabled
+        self.max_requests = max_requests
+        self.max_per_user = max_per_user
+        self.limits, self.default_limit = parse_limits(limits)
+        self.lanes = {}
+        self.active = Counter()   # user -> admitted requests
+        self.admitted = 0
+        self.rejected = Counter()
+
+    def lane(self, model: str) -> _Lane:
+        if model not in self.lanes:
+            self.lanes[model] = _Lane(model, self.limits.get(model, self.default_limit))
+        return self.lanes[model]
+
+    def admit(self, model: str, user: str, frames: int) -> "Ticket":
+        """Admit one upload of `frames` frames or raise AdmissionRejected."""
+        lane = self.lane(model)
+        reason = None
+        if self.enabled and self.admitted >= self.max_requests:
+            reason = REJECT_BUSY
+        elif self.enabled and self.active[user] >= self.max_per_user:
+            reason = REJECT_USER
+        if reason is not None:
+            self.rejected[reason] += 1
+            metrics.ADMISSION_REJECTED.labels(model=model, reason=reason).inc()
+            raise AdmissionRejected(reason, lane.retry_after())
+        self.admitted += 1
+        self.active[user] += 1
+        return Ticket(self, lane, user, INTERACTIVE if frames <= 1 else BULK)
+
+    def _release(self, user: str):
+        self.admitted -= 1
+        self.active[user] -= 1
+        if self.active[user] <= 0:
+            del self.active[user]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_requests": self.max_requests,
+            "max_per_user": self.max_per_user,
+            "admitted": self.admitted,
+            "users": len(self.active),
+            "rejected": dict(self.rejected),
+            "lanes": {
+                name: {
+                    "limit": lane.limit,
+                    "running": lane.running,
+                    "queued": lane.queued,
+                    "queued_users": {k: len(v) for k, v in lane.waiting.items()},
+                    "service_ms": round(lane.service_s * 1000.0, 1) if lane.service_s is not None else None,
+                    "served": lane.served,
+                }
+                for name, lane in sorted(self.lanes.items())
+            },
+        }
+
+
+class Ticket:
+    """One admitted upload: a context manager around the request, slot() around each frame's inference."""
+
+    def __init__(self, controller: AdmissionController, lane: _Lane, user: str, klass: str):
+        self.controller = controller
+        self.lane = lane
+        self.user = user
+        self.klass = klass
+        self.wait_ms = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.controller._release(self.user)
+
+    @asynccontextmanager
+    async def slot(self, timer=None):
+        """Hold a slot of the lane for one frame; the wait goes to timer stage "admission_wait"."""
+        lane = self.lane
+        if not self.controller.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        if lane.running < lane.limit and not lane.queued:
+            lane.running += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            lane.waiting[self.klass].setdefault(self.user, deque()).append(fut)
+            lane.queued += 1
+            metrics.ADMISSION_QUEUE_DEPTH.labels(model=lane.model).inc()
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    lane.running -= 1   # granted just as we were cancelled: hand it on
+                    lane.dispatch()
+                else:
+                    lane.remove(self.klass, self.user, fut)
+                raise
+            finally:
+                metrics.ADMISSION_QUEUE_DEPTH.labels(model=lane.model).dec()
+        waited = time.perf_counter() - t0
+        self.wait_ms += waited * 1000.0
+        if timer is not None:
+            timer.add("admission_wait", waited * 1000.0)
+        metrics.ADMISSION_WAIT_SECONDS.labels(model=lane.model, klass=self.klass).observe(waited)
+
+        t1 = time.perf_counter()
+        try:
+            yield
+        finally:
+            lane.record(time.perf_counter() - t1)
+            lane.running -= 1
+            lane.dispatch()
+
+
+controller = AdmissionController()
@@ -0,0 +1,534 @@
+# benchmark.py
+"""
+Offline micro-benchmarks for every predictor and post-processing stage.
+
+Runs on synthetic frames (several resolutions x lesion counts), so no images,
+Mongo or S3 are needed. Models whose weights are missing from MODEL_DIR are
+built with random weights (same architecture, same cost).
+
+    python benchmark.py                                   # full grid -> bench_results.json
+    python benchmark.py --models yolo_11n unet --repeat 5
+    python benchmark.py --save-baseline                   # write bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json    # exit 1 on p50 regressions
+    python benchmark.py --cascade --images ./frames        # "auto" vs always-heavy: latency + agreement
+    python benchmark.py --skip-predictors --skip-postprocess   # response serialization / compression only
+    python benchmark.py --yolo-profiles --images ./frames --skip-predictors --skip-postprocess --skip-serialization
+                                                          # default / fast / balanced / thorough: latency + detection deltas
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import cv2
+import torch
+
+import inference
+import http_responses
+from inference import (
+    AVAILABLE_MODELS,
+    CASCADE_FAST_MODEL,
+    CASCADE_HEAVY_CHOICES,
+    CASCADE_HEAVY_MODEL,
+    COMPOSITE_TASKS,
+    TASK_CASCADE,
+    TASK_DETECTION,
+    TASK_ENSEMBLE,
+    YOLO_PROFILES,
+    build_summary,
+    build_untrained,
+    draw_mask_overlay,
+    run_cascade,
+    run_ensemble,
+    run_model,
+    yolo_profile,
+    _box_iou,
+    _det_box_xyxy,
+    yolo_result_to_dict,
+    _mask_to_polygons,
+)
+from frame import BGR, Frame
+
+
+DEFAULT_RESOLUTIONS = "640x480,1280x720,1920x1080"
+DEFAULT_LESIONS = "0,1,4"
+DEFAULT_OUT = "bench_results.json"
+DEFAULT_BASELINE = "bench_baseline.json"
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+AGREEMENT_IOU = 0.3   # a lesion matches a reference lesion (heavy model / reference profile) above this box IoU
+DEFAULT_SCAN_SIZES = "4x256,20x1024,50x4096"   # detections x polygon points
+
+
+# =========================
+# Synthetic inputs
+# =========================
+
+def synthetic_frame(width: int, height: int, lesions: int, seed: int = 0):
+    """Endoscopy-ish frame with `lesions` elliptical blobs -> (BGR pixels as decode produces them, binary mask)."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    r = np.hypot(xx - width / 2, yy - height / 2) / max(width, height)
+    base = np.stack([200 - 120 * r, 80 - 50 * r, 70 - 40 * r], axis=-1)
+    base += rng.normal(0, 6, size=base.shape)
+    rgb = np.clip(base, 0, 255).astype(np.uint8)
+
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for _ in range(lesions):
+        axes = (int(min(width, height) * rng.uniform(0.04, 0.12)), int(min(width, height) * rng.uniform(0.04, 0.12)))
+        center = (int(rng.uniform(0.15, 0.85) * width), int(rng.uniform(0.15, 0.85) * height))
+        angle = float(rng.uniform(0, 180))
+        cv2.ellipse(rgb, center, axes, angle, 0, 360, (235, 150, 140), -1, lineType=cv2.LINE_AA)
+        cv2.ellipse(mask, center, axes, angle, 0, 360, 1, -1)
+    return np.ascontiguousarray(rgb[..., ::-1]), mask
+
+def synthetic_dets(mask):
+    """Per-component detections shaped like predict_unet output."""
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    dets = []
+    for label in range(1, n):
+        comp = (labels == label).astype(np.uint8)
+        dets.append({
+            "detection_id": len(dets),
+            "class_id": 0,
+            "class_name": "polyp",
+            "confidence": 0.9,
+            "mask_area_px": int(stats[label, cv2.CC_STAT_AREA]),
+            "mask_polygons": _mask_to_polygons(comp),
+        })
+    return dets
+
+def synthetic_yolo_result(bgr, mask):
+    """Real ultralytics Results object with one box per lesion."""
+    from ultralytics.engine.results import Results
+
+    boxes = []
+    n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    for label in range(1, n):
+        x, y, w, h = [float(v) for v in stats[label, :4]]
+        boxes.append([x, y, x + w, y + h, 0.9, 0.0])
+    data = torch.tensor(boxes, dtype=torch.float32).reshape(-1, 6)
+    return Results(orig_img=bgr, path="synthetic.jpg", names={0: "polyp"}, boxes=data)
+
+def synthetic_scan_result(detections: int, points: int, seed: int = 0):
+    """Stored-result-shaped dict with `detections` lesions of `points`-vertex polygons (all Python floats)."""
+    rng = np.random.default_rng(seed)
+    w, h = 1920, 1080
+    dets = []
+    for i in range(detections):
+        cx, cy, r = rng.uniform(200, 1700), rng.uniform(200, 900), rng.uniform(20, 150)
+        t = np.linspace(0, 2 * np.pi, points, endpoint=False)
+        poly = np.stack([cx + r * np.cos(t), cy + r * np.sin(t)], axis=1).ravel().tolist()
+        x1, y1, x2, y2 = cx - r, cy - r, cx + r, cy + r
+        dets.append({
+            "detection_id": i,
+            "class_id": 0,
+            "class_name": "polyp",
+            "confidence": float(rng.uniform(0.3, 0.99)),
+            "bbox_xyxy": [x1, y1, x2, y2],
+            "bbox_xywh": [cx, cy, 2 * r, 2 * r],
+            "bbox_xyxy_norm": [x1 / w, y1 / h, x2 / w, y2 / h],
+            "bbox_xywh_norm": [cx / w, cy / h, 2 * r / w, 2 * r / h],
+            "mask_polygons": [poly],
+            "mask_area_px": int(np.pi * r * r),
+        })
+    return {
+        "schema": inference.RESULT_SCHEMA_VERSION,
+        "result_meta": {"task": inference.TASK_SEG_SEMANTIC, "model_name": "unetpp"},
+        "detections": dets,
+        "summary": build_summary(dets, w, h),
+    }
+
+def load_image_dir(path: str, limit: int = 0):
+    """Real frames from a local folder -> [(file name, BGR pixels)], sorted by name."""
+    names = sorted(f for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTS))
+    if limit:
+        names = names[:limit]
+    out = []
+    for name in names:
+        bgr = cv2.imread(os.path.join(path, name), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if bgr is not None:
+            out.append((name, bgr))
+    return out
+
+
+# =========================
+# Timing
+# =========================
+
+def _stats(samples_ms):
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    mean = float(arr.mean())
+    return {
+        "n": int(arr.size),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "mean_ms": mean,
+        "min_ms": float(arr.min()),
+        "throughput_per_s": 1000.0 / mean if mean > 0 else None,
+    }
+
+def measure_allocations(fn):
+    """Run once under tracemalloc (numpy buffers included) -> (fn result, peak traced bytes)."""
+    tracemalloc.start()
+    try:
+        out = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return out, peak
+
+def measure(fn, repeat: int, warmup: int):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return _stats(samples)
+
+
+# =========================
+# Suites
+# =========================
+
+def prepare_models(names, random_weights: bool):
+    """Load real weights when present, else random-init; returns {name: "real"|"random"}."""
+    source = {}
+    for name in names:
+        entry = AVAILABLE_MODELS[name]
+        if entry["task"] in COMPOSITE_TASKS or name in source or entry["model"] is not None:
+            continue
+        if not random_weights and os.path.exists(entry["weights"]):
+            inference._ensure_loaded(name)
+            source[name] = "real"
+        else:
+            entry["model"] = build_untrained(name)
+            source[name] = "random"
+    return source
+
+def bench_predictors(names, frames, repeat, warmup, results):
+    for name in names:
+        entry = AVAILABLE_MODELS[name]
+        for (w, h, n), (bgr, _) in frames.items():
+            key = f"predict/{name}/{w}x{h}/l{n}"
+            # a fresh Frame per call wraps the same pixels (no copy) with clean buffer counters
+            if entry["task"] == TASK_ENSEMBLE:
+                members = [m for m in entry["members"] if m in names]
+                if not members:
+                    continue
+                fn = lambda bgr=bgr, members=members, render=False: asyncio.run(run_ensemble(Frame(bgr, BGR), members))
+            elif entry["task"] == TASK_CASCADE:
+                fn = lambda bgr=bgr, render=False: run_cascade(Frame(bgr, BGR))
+            else:
+                fn = lambda bgr=bgr, name=name, render=False: run_model(name, Frame(bgr, BGR), render=render)
+            results[key] = measure(fn, repeat, warmup)
+            (_, result), peak = measure_allocations(lambda: fn(render=True))
+            results[key]["peak_alloc_mb"] = peak / 2**20
+            results[key]["full_frame_buffers"] = result["result_meta"]["frame"]["full_frame_buffers"]
+            print(f"{key:<48} p50={results[key]['p50_ms']:9.2f} ms  p95={results[key]['p95_ms']:9.2f} ms"
+                  f"  peak={results[key]['peak_alloc_mb']:7.1f} MB  buffers={results[key]['full_frame_buffers']}")
+
+def bench_postprocess(frames, repeat, warmup, results):
+    for (w, h, n), (bgr, mask) in frames.items():
+        dets = synthetic_dets(mask)
+        yolo_res = synthetic_yolo_result(bgr, mask)
+        cases = {
+            "draw_mask_overlay": lambda: draw_mask_overlay(bgr, mask, order=BGR),
+            "_mask_to_polygons": lambda: _mask_to_polygons(mask),
+            "build_summary": lambda: build_summary(dets, w, h),
+            "yolo_result_to_dict": lambda: yolo_result_to_dict(yolo_res, yolo_res.names),
+        }
+        for stage, fn in cases.items():
+            key = f"post/{stage}/{w}x{h}/l{n}"
+            results[key] = measure(fn, repeat, warmup)
+            print(f"{key:<48} p50={results[key]['p50_ms']:9.2f} ms  p95={results[key]['p95_ms']:9.2f} ms")
+
+
+def _lesion_agreement(dets, ref_dets, iou_thr: float = AGREEMENT_IOU):
+    """Greedy one-to-one box matching of `dets` against reference dets -> (matched, n, n_ref)."""
+    boxes = [b for b in (_det_box_xyxy(d) for d in dets) if b is not None]
+    ref = [b for b in (_det_box_xyxy(d) for d in ref_dets) if b is not None]
+    used = set()
+    matched = 0
+    for b in boxes:
+        best, best_iou = None, iou_thr
+        for j, r in enumerate(ref):
+            if j in used:
+                continue
+            iou = _box_iou(b, r)
+            if iou >= best_iou:
+                best, best_iou = j, iou
+        if best is not None:
+            used.add(best)
+            matched += 1
+    return matched, len(boxes), len(ref)
+
+def bench_cascade(samples, heavy, repeat, warmup, results):
+    """
+    "auto" against always running `heavy` on the same frames: latency per frame,
+    escalation rate, and how often the cascade's answer agrees with the heavy model's
+    (frame-level positive/negative and lesion-level F1 at AGREEMENT_IOU).
+    """
+    auto_ms, heavy_ms = [], []
+    escalated = frame_agree = 0
+    matched = n_auto = n_heavy = 0
+    reasons = {}
+    for label, bgr in samples:
+        key = f"cascade/auto/{heavy}/{label}"
+        results[key] = measure(lambda: run_cascade(Frame(bgr, BGR), heavy), repeat, warmup)
+        results[f"cascade/heavy/{heavy}/{label}"] = measure(lambda: run_model(heavy, Frame(bgr, BGR)), repeat, warmup)
+        auto_ms.append(results[key]["p50_ms"])
+        heavy_ms.append(results[f"cascade/heavy/{heavy}/{label}"]["p50_ms"])
+
+        _, auto_res = run_cascade(Frame(bgr, BGR), heavy)
+        _, heavy_res = run_model(heavy, Frame(bgr, BGR), render=False)
+        meta = auto_res["result_meta"]
+        if meta["escalated"]:
+            escalated += 1
+            reasons[meta["escalation_reason"]] = reasons.get(meta["escalation_reason"], 0) + 1
+        frame_agree += bool(auto_res["detections"]) == bool(heavy_res["detections"])
+        m, a, h = _lesion_agreement(auto_res["detections"], heavy_res["detections"])
+        matched, n_auto, n_heavy = matched + m, n_auto + a, n_heavy + h
+        print(f"{label:<40} auto p50={auto_ms[-1]:9.2f} ms  {heavy} p50={heavy_ms[-1]:9.2f} ms"
+              f"  stages={'+'.join(meta['stages'])}")
+
+    n = len(samples)
+    precision = matched / n_auto if n_auto else 1.0
+    recall = matched / n_heavy if n_heavy else 1.0
+    summary = {
+        "fast": CASCADE_FAST_MODEL,
+        "heavy": heavy,
+        "frames": n,
+        "escalation_rate": escalated / n if n else None,
+        "escalation_reasons": reasons,
+        "auto_p50_ms": float(np.median(auto_ms)) if n else None,
+        "heavy_p50_ms": float(np.median(heavy_ms)) if n else None,
+        "speedup": float(np.sum(heavy_ms) / np.sum(auto_ms)) if n and np.sum(auto_ms) > 0 else None,
+        "frame_agreement": frame_agree / n if n else None,
+        "lesion_precision": precision,
+        "lesion_recall": recall,
+        "lesion_f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "agreement_iou": AGREEMENT_IOU,
+    }
+    print(f"cascade vs {heavy}: escalated {summary['escalation_rate']:.0%}, speedup x{summary['speedup'] or 0:.2f}, "
+          f"frame agreement {summary['frame_agreement']:.0%}, lesion F1 {summary['lesion_f1']:.2f}")
+    return summary
+
+
+def bench_yolo_profiles(samples, models, reference, repeat, warmup, results):
+    """
+    Every YOLO_PROFILES entry per YOLO model on the same frames: latency, detections,
+    and agreement with the `reference` profile's detections (lesion precision/recall
+    at AGREEMENT_IOU).
+    """
+    summary = {}
+    for name in models:
+        ref_dets = {label: run_model(name, Frame(bgr, BGR), render=False, profile=reference)[1]["detections"]
+                    for label, bgr in samples}
+        summary[name] = {}
+        for profile in YOLO_PROFILES:
+            p50s, n_dets = [], []
+            matched = n_prof = n_ref = 0
+            for label, bgr in samples:
+                key = f"yolo_profile/{name}/{profile}/{label}"
+                results[key] = measure(lambda: run_model(name, Frame(bgr, BGR), render=False, profile=profile),
+                                       repeat, warmup)
+                p50s.append(results[key]["p50_ms"])
+                dets = run_model(name, Frame(bgr, BGR), render=False, profile=profile)[1]["detections"]
+                n_dets.append(len(dets))
+                m, a, r = _lesion_agreement(dets, ref_dets[label])
+                matched, n_prof, n_ref = matched + m, n_prof + a, n_ref + r
+            summary[name][profile] = {
+                "settings": yolo_profile(name, profile),
+                "frames": len(samples),
+                "p50_ms": float(np.median(p50s)) if samples else None,
+                "total_ms": float(np.sum(p50s)),
+                "detections_mean": float(np.mean(n_dets)) if samples else None,
+                "detections_delta_mean": (float(np.mean(n_dets)) - n_ref / len(samples)) if samples else None,
+                "precision_vs_ref": matched / n_prof if n_prof else 1.0,
+                "recall_vs_ref": matched / n_ref if n_ref else 1.0,
+            }
+        ref_total = summary[name][reference]["total_ms"]
+        for profile, st in summary[name].items():
+            st["speedup_vs_ref"] = ref_total / st["total_ms"] if st["total_ms"] > 0 else None
+            print(f"{name:<10} {profile:<9} p50={st['p50_ms']:9.2f} ms  x{st['speedup_vs_ref'] or 0:5.2f} vs {reference}"
+                  f"  dets={st['detections_mean']:.2f} ({st['detections_delta_mean']:+.2f})"
+                  f"  P={st['precision_vs_ref']:.2f} R={st['recall_vs_ref']:.2f}")
+    return {"reference": reference, "agreement_iou": AGREEMENT_IOU, "models": summary}
+
+
+def bench_serialization(scan_sizes, repeat, warmup, results):
+    """
+    Response path for large-polygon scans: the old jsonable_encoder + json + gzip-9
+    (GZipMiddleware default) against orjson with each available encoding, and the
+    write-time blob (served as-is, or decompressed for clients that don't accept it).
+    """
+    from fastapi.encoders import jsonable_encoder
+
+    def stdlib_json(obj):
+        return json.dumps(jsonable_encoder(obj), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    for n, points in scan_sizes:
+        result = synthetic_scan_result(n, points)
+        raw = http_responses.dumps(result)
+        cases = {
+            "jsonable+json": lambda: stdlib_json(result),
+            "jsonable+json+gzip9": lambda: http_responses.compress(stdlib_json(result), http_responses.GZIP, 9),
+            "orjson": lambda: http_responses.dumps(result),
+        }
+        for enc, ok in http_responses.available_encodings().items():
+            if ok:
+                cases[f"orjson+{enc}{http_responses.COMPRESS_LEVELS[enc]}"] = (
+                    lambda enc=enc: http_responses.compress(http_responses.dumps(result), enc))
+        blob, blob_enc = http_responses.precompress(raw)
+        cases[f"blob_decompress_{blob_enc}"] = lambda: http_responses.decompress(blob, blob_enc)
+
+        for variant, fn in cases.items():
+            key = f"serialize/{variant}/d{n}x{points}"
+            results[key] = measure(fn, repeat, warmup)
+            results[key]["bytes"] = len(fn())
+            print(f"{key:<48} p50={results[key]['p50_ms']:9.2f} ms  size={results[key]['bytes'] / 1024:9.1f} KB")
+        results[f"serialize/blob_{blob_enc}/d{n}x{points}"] = {"bytes": len(blob), "raw_bytes": len(raw)}
+        print(f"{'serialize/blob_' + blob_enc + f'/d{n}x{points}':<48} served as stored  size={len(blob) / 1024:9.1f} KB")
+
+
+# =========================
+# Baseline comparison
+# =========================
+
+def compare(current, baseline, tolerance: float, min_delta_ms: float):
+    """Return keys whose p50 slowed by more than `tolerance` (and `min_delta_ms` absolute)."""
+    regressions = []
+    for key, cur in current.items():
+        base = baseline.get(key)
+        if not base or "p50_ms" not in base or "p50_ms" not in cur:
+            continue
+        delta = cur["p50_ms"] - base["p50_ms"]
+        ratio = cur["p50_ms"] / base["p50_ms"] if base["p50_ms"] > 0 else float("inf")
+        if ratio > 1.0 + tolerance and delta > min_delta_ms:
+            regressions.append({"key": key, "baseline_p50_ms": base["p50_ms"], "p50_ms": cur["p50_ms"], "ratio": ratio})
+    return regressions
+
+
+def _parse_resolutions(raw):
+    out = []
+    for part in raw.split(","):
+        w, h = part.lower().split("x")
+        out.append((int(w), int(h)))
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline predictor / post-processing micro-benchmarks")
+    ap.add_argument("--models", nargs="*", default=list(AVAILABLE_MODELS), help="registry names (default: all)")
+    ap.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS, help="comma list of WxH")
+    ap.add_argument("--lesions", default=DEFAULT_LESIONS, help="comma list of lesion counts")
+    ap.add_argument("--repeat", type=int, default=10)
+    ap.add_argument("--warmup", type=int, default=2)
+    ap.add_argument("--random-weights", action="store_true", help="ignore weights on disk")
+    ap.add_argument("--skip-predictors", action="store_true")
+    ap.add_argument("--skip-postprocess", action="store_true")
+    ap.add_argument("--skip-serialization", action="store_true")
+    ap.add_argument("--scan-sizes", default=DEFAULT_SCAN_SIZES, help="comma list of DETECTIONSxPOINTS")
+    ap.add_argument("--out", default=DEFAULT_OUT)
+    ap.add_argument("--baseline", default=None, help="compare against this JSON, exit 1 on regression")
+    ap.add_argument("--save-baseline", action="store_true", help=f"also write results to {DEFAULT_BASELINE}")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="allowed p50 slowdown ratio")
+    ap.add_argument("--min-delta-ms", type=float, default=0.5, help="ignore slowdowns below this")
+    ap.add_argument("--cascade", action="store_true", help="benchmark \"auto\" against always running --cascade-heavy")
+    ap.add_argument("--cascade-heavy", default=CASCADE_HEAVY_MODEL, choices=CASCADE_HEAVY_CHOICES)
+    ap.add_argument("--yolo-profiles", action="store_true", help="compare YOLO inference profiles (latency, detections)")
+    ap.add_argument("--profile-reference", default="thorough", choices=list(YOLO_PROFILES))
+    ap.add_argument("--images", default=None,
+                    help="folder of real frames for --cascade / --yolo-profiles (default: synthetic grid)")
+    ap.add_argument("--max-images", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    unknown = [m for m in args.models if m not in AVAILABLE_MODELS]
+    if unknown:
+        ap.error(f"unknown models: {unknown}")
+
+    resolutions = _parse_resolutions(args.resolutions)
+    lesion_counts = [int(n) for n in args.lesions.split(",")]
+    frames = {
+        (w, h, n): synthetic_frame(w, h, n, seed=n)
+        for (w, h) in resolutions
+        for n in lesion_counts
+    }
+
+    results = {}
+    weights_source = {}
+    cascade = None
+    profiles = None
+    if args.cascade or ("auto" in args.models and not args.skip_predictors):
+        # cascade stages are ordinary registry models and must be ready too
+        weights_source.update(prepare_models([CASCADE_FAST_MODEL, AVAILABLE_MODELS["auto"]["heavy"], args.cascade_heavy],
+                                             args.random_weights))
+    if not args.skip_predictors:
+        weights_source.update(prepare_models(args.models, args.random_weights))
+        bench_predictors(args.models, frames, args.repeat, args.warmup, results)
+    if not args.skip_postprocess:
+        bench_postprocess(frames, args.repeat, args.warmup, results)
+    if not args.skip_serialization:
+        bench_serialization(_parse_resolutions(args.scan_sizes), args.repeat, args.warmup, results)
+    if args.cascade:
+        if args.images:
+            samples = load_image_dir(args.images, args.max_images)
+        else:
+            samples = [(f"{w}x{h}/l{n}", bgr) for (w, h, n), (bgr, _) in frames.items()]
+        cascade = bench_cascade(samples, args.cascade_heavy, args.repeat, args.warmup, results)
+    if args.yolo_profiles:
+        yolo_models = [m for m in args.models if AVAILABLE_MODELS[m]["task"] == TASK_DETECTION]
+        weights_source.update(prepare_models(yolo_models, args.random_weights))
+        if args.images:
+            samples = load_image_dir(args.images, args.max_images)
+        else:
+            samples = [(f"{w}x{h}/l{n}", bgr) for (w, h, n), (bgr, _) in frames.items()]
+        profiles = bench_yolo_profiles(samples, yolo_models, args.profile_reference, args.repeat, args.warmup, results)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "weights": weights_source,
+        },
+        "results": results,
+    }
+    if cascade is not None:
+        report["cascade"] = cascade
+    if profiles is not None:
+        report["yolo_profiles"] = profiles
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out}")
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {DEFAULT_BASELINE}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        for r in regressions:
+            print(f"REGRESSION {r['key']}: {r['baseline_p50_ms']:.2f} -> {r['p50_ms']:.2f} ms (x{r['ratio']:.2f})")
+        if regressions:
+            return 1
+        print("no regressions vs baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
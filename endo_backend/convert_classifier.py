@@ -0,0 +1,106 @@
+# convert_classifier.py
+"""
+One-off conversion of the bundled Keras frame classifier to ONNX for frame_gate.py.
+
+    pip install tensorflow tf2onnx onnxruntime    # conversion-time only
+    python convert_classifier.py --polyp-index 1 --polyp-images ./samples/polyp
+                                                   # model/polyp_classifier.h5 -> model/polyp_classifier.onnx
+
+The serving side only needs onnxruntime. After converting, the script checks the
+ONNX output against Keras on random inputs, checks --polyp-index against frames
+known to show a polyp (the index must win on most of them), and records it in the
+.onnx metadata, where frame_gate.py reads it.
+"""
+import argparse
+import glob
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from frame_gate import CLASSIFIER_INPUT_SIZE, FRAME_GATE_MODEL, POLYP_INDEX_KEY
+
+
+DEFAULT_SRC = os.path.join(os.environ.get("MODEL_DIR", "./model"), "polyp_classifier.h5")
+POLYP_AGREEMENT_MIN = 0.8   # fraction of known-polyp frames where --polyp-index must be the top class
+
+
+def convert(src: str, dst: str, opset: int = 13):
+    import tensorflow as tf
+    import tf2onnx
+
+    model = tf.keras.models.load_model(src, compile=False)
+    w, h = CLASSIFIER_INPUT_SIZE
+    spec = (tf.TensorSpec((None, h, w, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=dst)
+    return model
+
+def check_parity(model, dst: str, samples: int = 4):
+    import onnxruntime as ort
+
+    sess = ort.InferenceSession(dst, providers=["CPUExecutionProvider"])
+    w, h = CLASSIFIER_INPUT_SIZE
+    x = np.random.default_rng(0).uniform(-1, 1, size=(samples, h, w, 3)).astype(np.float32)
+    ref = model.predict(x, verbose=0)
+    out = sess.run(None, {sess.get_inputs()[0].name: x})[0]
+    return float(np.abs(ref - out).max())
+
+def check_polyp_index(dst: str, index: int, image_dir: str):
+    """Share of the polyp frames in image_dir whose top class is `index` -> (share, frames)."""
+    import onnxruntime as ort
+
+    sess = ort.InferenceSession(dst, providers=["CPUExecutionProvider"])
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(image_dir, f"*.{ext}")))
+    hits = 0
+    for path in paths:
+        rgb = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+        x = cv2.resize(rgb, CLASSIFIER_INPUT_SIZE, interpolation=cv2.INTER_AREA)
+        x = (x.astype(np.float32) / 127.5 - 1.0)[None]   # same preprocessing as frame_gate
+        probs = sess.run(None, {sess.get_inputs()[0].name: x})[0][0]
+        hits += int(np.argmax(probs) == index)
+    return (hits / len(paths) if paths else 0.0), len(paths)
+
+def record_polyp_index(dst: str, index: int):
+    import onnx
+
+    model = onnx.load(dst)
+    for prop in list(model.metadata_props):
+        if prop.key == POLYP_INDEX_KEY:
+            model.metadata_props.remove(prop)
+    entry = model.metadata_props.add()
+    entry.key, entry.value = POLYP_INDEX_KEY, str(index)
+    onnx.save(model, dst)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Convert polyp_classifier.h5 to ONNX")
+    ap.add_argument("--src", default=DEFAULT_SRC)
+    ap.add_argument("--dst", default=FRAME_GATE_MODEL)
+    ap.add_argument("--opset", type=int, default=13)
+    ap.add_argument("--polyp-index", type=int, required=True, choices=(0, 1),
+                    help="classifier output that means 'polyp'")
+    ap.add_argument("--polyp-images", default=None,
+                    help="folder of frames that show a polyp, to check --polyp-index against")
+    ap.add_argument("--skip-index-check", action="store_true",
+                    help="record --polyp-index without checking it on --polyp-images")
+    args = ap.parse_args(argv)
+    if not args.polyp_images and not args.skip_index_check:
+        ap.error("--polyp-images is required to check --polyp-index (or pass --skip-index-check)")
+
+    model = convert(args.src, args.dst, args.opset)
+    print(f"wrote {args.dst} ({os.path.getsize(args.dst) / 2**20:.1f} MB)")
+    print(f"max |keras - onnx| on random inputs: {check_parity(model, args.dst):.2e}")
+    if args.polyp_images:
+        share, n = check_polyp_index(args.dst, args.polyp_index, args.polyp_images)
+        print(f"polyp index {args.polyp_index}: top class on {share:.0%} of {n} polyp frames")
+        if n == 0 or share < POLYP_AGREEMENT_MIN:
+            print(f"not recording the polyp index (needs >= {POLYP_AGREEMENT_MIN:.0%}); the gate will skip the classifier")
+            return 1
+    record_polyp_index(args.dst, args.polyp_index)
+    print(f"recorded {POLYP_INDEX_KEY}={args.polyp_index} in {args.dst}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# frame.py
+"""
+One decoded image shared by predictors, rendering and the JPEG encoder.
+
+The pixels live in a single contiguous HxWx3 uint8 buffer whose channel order
+("BGR" after cv2 decode) is tracked explicitly. Consumers take views in the order
+they need; a conversion is done at most once per order and cached. Every
+full-frame buffer a Frame allocates is counted in `buffers`, which is reported in
+result_meta so regressions in copying show up per scan.
+"""
+import cv2
+import numpy as np
+
+
+BGR = "BGR"
+RGB = "RGB"
+JPEG_QUALITY = 75   # PIL's default, keeps processed images the size they were
+
+
+class Frame:
+    __slots__ = ("data", "order", "buffers", "_views")
+
+    def __init__(self, data: np.ndarray, order: str = BGR, buffers: int = 0):
+        if data.ndim != 3 or data.shape[2] != 3 or data.dtype != np.uint8:
+            raise ValueError(f"Frame needs an HxWx3 uint8 array, got {data.shape} {data.dtype}")
+        if order not in (BGR, RGB):
+            raise ValueError(f"Unknown channel order '{order}'")
+        self.data = data if data.flags.c_contiguous else np.ascontiguousarray(data)
+        self.order = order
+        self.buffers = buffers + (0 if self.data is data else 1)
+        self._views = {order: self.data}
+
+    @classmethod
+    def decode(cls, image_bytes: bytes) -> "Frame":
+        """Single decode into BGR (same orientation/channels PIL's open().convert("RGB") gave)."""
+        raw = np.frombuffer(image_bytes, dtype=np.uint8)
+        data = cv2.imdecode(raw, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if data is None:
+            raise ValueError("Could not decode image")
+        return cls(data, BGR, buffers=1)
+
+    @classmethod
+    def from_pil(cls, img) -> "Frame":
+        return cls(np.asarray(img.convert("RGB")), RGB, buffers=1)
+
+    @property
+    def height(self) -> int:
+        return int(self.data.shape[0])
+
+    @property
+    def width(self) -> int:
+        return int(self.data.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes)
+
+    def view(self, order: str) -> np.ndarray:
+        """Read-only pixels in `order`; converts (and caches) at most once per order."""
+        v = self._views.get(order)
+        if v is None:
+            v = cv2.cvtColor(self.data, cv2.COLOR_BGR2RGB if self.order == BGR else cv2.COLOR_RGB2BGR)
+            v.flags.writeable = False
+            self._views[order] = v
+            self.buffers += 1
+        return v
+
+    def bgr(self) -> np.ndarray:
+        return self.view(BGR)
+
+    def rgb(self) -> np.ndarray:
+        return self.view(RGB)
+
+    def copy(self) -> np.ndarray:
+        """Writable full-frame copy in the frame's own order (e.g. a render target)."""
+        self.buffers += 1
+        return self.data.copy()
+
+    def count_buffer(self, n: int = 1):
+        """Record a full-frame buffer allocated on this frame's behalf outside Frame (e.g. res.plot())."""
+        self.buffers += n
+
+    def color(self, rgb_color):
+        """An (R,G,B) tuple expressed in this frame's channel order."""
+        return tuple(rgb_color) if self.order == RGB else tuple(rgb_color[::-1])
+
+    def stats(self) -> dict:
+        return {"order": self.order, "full_frame_buffers": self.buffers}
+
+
+def encode_jpeg(pixels: np.ndarray, order: str = BGR, quality: int = JPEG_QUALITY) -> bytes:
+    """cv2.imencode wants BGR; RGB input costs one conversion."""
+    if order == RGB:
+        pixels = cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)
+    ok, buf = cv2.imencode(".jpg", pixels, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError("JPEG encode failed")
+    return buf.tobytes()
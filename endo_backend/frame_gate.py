@@ -0,0 +1,183 @@
+# frame_gate.py
+"""
+Cheap pre-inference gate: image-quality checks plus the bundled polyp classifier.
+
+Frames that are blurry, badly exposed or confidently polyp-free are answered with
+an empty result instead of running the segmentation model and rendering an overlay.
+
+    FRAME_GATE=1 uvicorn main:app                   # gate every upload (per-request `gate` overrides)
+    python convert_classifier.py                     # model/polyp_classifier.h5 -> .onnx (once)
+
+The classifier (MobileNetV2 + dense head, Keras 2.4) runs through onnxruntime on
+CPU. Which of its two outputs means "polyp" is not in the export, so the gate only
+uses it once that index is known: recorded by convert_classifier.py
+--polyp-index, or set with FRAME_GATE_POLYP_INDEX (both must agree when both are
+given). Without onnxruntime, the .onnx file or a known index the gate falls back
+to the quality checks alone.
+"""
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    _HAS_ORT = True
+except Exception:
+    _HAS_ORT = False
+
+from frame import BGR, Frame
+
+
+FRAME_GATE_ENABLED = os.environ.get("FRAME_GATE", "0") == "1"
+FRAME_GATE_MODEL = os.environ.get(
+    "FRAME_GATE_MODEL", os.path.join(os.environ.get("MODEL_DIR", "./model"), "polyp_classifier.onnx")
+)
+FRAME_GATE_THREADS = int(os.environ.get("FRAME_GATE_THREADS", "1"))
+
+# Classifier: 224x224 RGB scaled to [-1, 1]; softmax over 2 classes.
+# The export has no labels file: the "polyp" output comes from the .onnx metadata
+# (POLYP_INDEX_KEY, written by convert_classifier.py) or FRAME_GATE_POLYP_INDEX.
+CLASSIFIER_INPUT_SIZE = (224, 224)  # (W,H)
+CLASSIFIER_CLASSES = 2
+POLYP_INDEX_KEY = "polyp_index"
+FRAME_GATE_POLYP_INDEX = os.environ.get("FRAME_GATE_POLYP_INDEX", "").strip() or None
+FRAME_GATE_NEGATIVE_MAX = float(os.environ.get("FRAME_GATE_NEGATIVE_MAX", "0.05"))  # polyp prob below -> negative
+
+# Quality checks run on a grayscale copy downscaled to this width (scale-independent thresholds)
+QUALITY_WIDTH = 512
+FRAME_GATE_BLUR_MIN = float(os.environ.get("FRAME_GATE_BLUR_MIN", "25"))   # variance of Laplacian
+FRAME_GATE_DARK_MEAN = 30.0       # mean gray below -> underexposed
+FRAME_GATE_BRIGHT_MEAN = 225.0    # mean gray above -> overexposed
+FRAME_GATE_CLIPPED_MAX = 0.6      # fraction of pixels at <=8 or >=247 above -> badly exposed
+
+PASS = "pass"
+BLURRY = "blurry"
+UNDEREXPOSED = "underexposed"
+OVEREXPOSED = "overexposed"
+NEGATIVE = "negative"
+
+logger = logging.getLogger(__name__)
+
+
+# =========================
+# Quality checks
+# =========================
+
+def quality_metrics(frame: Frame) -> dict:
+    """Blur (variance of Laplacian) and exposure stats on a small grayscale copy."""
+    pixels = frame.data
+    scale = QUALITY_WIDTH / float(frame.width)
+    if scale < 1.0:
+        pixels = cv2.resize(pixels, (QUALITY_WIDTH, max(1, int(round(frame.height * scale)))),
+                            interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY if frame.order == BGR else cv2.COLOR_RGB2GRAY)
+    n = float(gray.size)
+    return {
+        "blur_var": float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        "mean_gray": float(gray.mean()),
+        "dark_frac": float(np.count_nonzero(gray <= 8) / n),
+        "bright_frac": float(np.count_nonzero(gray >= 247) / n),
+    }
+
+def quality_decision(q: dict):
+    if q["mean_gray"] < FRAME_GATE_DARK_MEAN or q["dark_frac"] > FRAME_GATE_CLIPPED_MAX:
+        return UNDEREXPOSED
+    if q["mean_gray"] > FRAME_GATE_BRIGHT_MEAN or q["bright_frac"] > FRAME_GATE_CLIPPED_MAX:
+        return OVEREXPOSED
+    if q["blur_var"] < FRAME_GATE_BLUR_MIN:
+        return BLURRY
+    return PASS
+
+
+# =========================
+# Classifier (onnxruntime, lazy)
+# =========================
+
+_session = None
+_polyp_index = None      # resolved with the session; None -> classifier unusable
+_index_problem = None    # why _polyp_index is None
+_session_lock = threading.Lock()
+
+def classifier_available() -> bool:
+    return _HAS_ORT and os.path.exists(FRAME_GATE_MODEL)
+
+def resolve_polyp_index(recorded, configured):
+    """
+    (index from the .onnx metadata, FRAME_GATE_POLYP_INDEX) -> (index | None, problem | None).
+    Never guesses: no index, an out-of-range one or a disagreement disables the classifier.
+    """
+    values = {}
+    for source, raw in (("model metadata", recorded), ("FRAME_GATE_POLYP_INDEX", configured)):
+        if raw is None:
+            continue
+        try:
+            values[source] = int(raw)
+        except ValueError:
+            return None, f"{source}: not an integer ({raw!r})"
+    if not values:
+        return None, "polyp output index unknown (convert_classifier.py --polyp-index or FRAME_GATE_POLYP_INDEX)"
+    if len(set(values.values())) > 1:
+        return None, "polyp output index mismatch: " + ", ".join(f"{k}={v}" for k, v in values.items())
+    index = next(iter(values.values()))
+    if not 0 <= index < CLASSIFIER_CLASSES:
+        return None, f"polyp output index {index} out of range"
+    return index, None
+
+def _get_session():
+    global _session, _polyp_index, _index_problem
+    with _session_lock:
+        if _session is None:
+            opts = ort.SessionOptions()
+            opts.intra_op_num_threads = FRAME_GATE_THREADS
+            opts.inter_op_num_threads = 1
+            _session = ort.InferenceSession(FRAME_GATE_MODEL, sess_options=opts, providers=["CPUExecutionProvider"])
+            recorded = _session.get_modelmeta().custom_metadata_map.get(POLYP_INDEX_KEY)
+            _polyp_index, _index_problem = resolve_polyp_index(recorded, FRAME_GATE_POLYP_INDEX)
+            if _index_problem:
+                logger.warning("frame gate: classifier disabled, quality checks only (%s)", _index_problem)
+        return _session
+
+def polyp_probability(frame: Frame):
+    """Classifier polyp probability, or None when the polyp output index is not known."""
+    sess = _get_session()
+    if _polyp_index is None:
+        return None
+    x = cv2.resize(frame.rgb(), CLASSIFIER_INPUT_SIZE, interpolation=cv2.INTER_AREA)
+    x = (x.astype(np.float32) / 127.5 - 1.0)[None]   # NHWC, as the Keras model was trained
+    probs = sess.run(None, {sess.get_inputs()[0].name: x})[0][0]
+    return float(probs[_polyp_index])
+
+
+# =========================
+# Gate
+# =========================
+
+def check(frame: Frame) -> dict:
+    """
+    -> {"decision", "passed", "score", "quality", "classifier", "classifier_skipped", "ms"}
+    `score` is the classifier's polyp probability (None when it did not run);
+    classifier_skipped says why it could not run on a frame that passed quality.
+    """
+    t0 = time.perf_counter()
+    quality = quality_metrics(frame)
+    decision = quality_decision(quality)
+    score, skipped = None, None
+    if decision == PASS and classifier_available():
+        score = polyp_probability(frame)
+        if score is None:
+            skipped = _index_problem
+        elif score < FRAME_GATE_NEGATIVE_MAX:
+            decision = NEGATIVE
+    return {
+        "decision": decision,
+        "passed": decision == PASS,
+        "score": score,
+        "quality": quality,
+        "classifier": os.path.basename(FRAME_GATE_MODEL) if score is not None else None,
+        "classifier_skipped": skipped,
+        "ms": (time.perf_counter() - t0) * 1000.0,
+    }
@@ -0,0 +1,59 @@
+# http_cache.py
+"""
+Validators and Cache-Control for scan responses.
+
+- A scan's result never changes once written: a detail response is identified by
+  (scan id, result schema version) and, when it embeds presigned S3 URLs, the
+  s3.url_window() they were signed in.
+- History pages only change when their owner uploads or deletes. users.history_rev
+  is bumped on both; admin pages use the global counters.scans_rev.
+Clients send If-None-Match; a match is answered with 304 and no body.
+
+ETags are weak: one scan is served gzip/zstd/br-encoded or identity depending on
+Accept-Encoding (http_responses.py), and those bodies are not byte-identical.
+"""
+from fastapi import Request, Response
+
+import s3
+
+
+IMMUTABLE = "private, max-age=31536000, immutable"
+REVALIDATE = "private, no-cache"   # cache, but check the validator on every use
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison, as RFC 9110 requires for If-None-Match
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return etag.removeprefix("W/") in tags
+
+def _window_suffix(private: bool) -> str:
+    return f"-w{s3.url_window()[0]}" if private else ""
+
+def detail_etag(scan_id, schema: int, private: bool) -> str:
+    return f'W/"scan-{scan_id}-v{schema}{_window_suffix(private)}"'
+
+def result_etag(scan_id, schema: int) -> str:
+    return f'W/"result-{scan_id}-v{schema}"'
+
+def detail_cache_control(private: bool) -> str:
+    if not private:
+        return IMMUTABLE
+    return f"private, max-age={int(s3.url_window()[1])}"
+
+def page_etag(scope: str, rev: int) -> str:
+    """`scope` names whose list it is (user id / "admin"); the URL carries cursor + limit."""
+    return f'W/"{scope}-r{rev}{_window_suffix(not s3.S3_PUBLIC_READ)}"'
+
+def set_validators(response: Response, etag: str, cache_control: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    response.headers["Vary"] = "Authorization"
+    return response
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return set_validators(Response(status_code=304), etag, cache_control)
@@ -0,0 +1,282 @@
+# http_responses.py
+"""
+Response path for result-heavy endpoints: orjson serialization, Brotli/zstd/gzip
+negotiation with tunable levels, and pre-compressed result blobs.
+
+- FastJSONResponse / json_response() skip FastAPI's jsonable_encoder pass.
+- CompressionMiddleware replaces GZipMiddleware: it picks the best encoding the
+  client accepts, leaves responses that already carry Content-Encoding alone
+  (pre-compressed blobs) and compresses large bodies off the event loop.
+- precompress() is used at write time (scan_store) with higher levels, since it
+  runs once per scan instead of once per read.
+- splice() wraps a pre-compressed blob in a small JSON envelope without
+  decompressing it: zstd frames may simply be concatenated, and gzip blobs are
+  written so their deflate stream can be re-framed into one gzip member.
+All three codecs are optional: without orjson the stdlib json is used, and
+encodings whose module is missing are never negotiated.
+"""
+import gzip
+import json
+import os
+import struct
+import zlib
+from datetime import date, datetime
+
+import anyio
+from bson import ObjectId
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+try:
+    import orjson
+    _HAS_ORJSON = True
+except Exception:
+    _HAS_ORJSON = False
+
+try:
+    import brotli
+    _HAS_BROTLI = True
+except Exception:
+    _HAS_BROTLI = False
+
+try:
+    import zstandard
+    _HAS_ZSTD = True
+except Exception:
+    _HAS_ZSTD = False
+
+
+BR = "br"
+ZSTD = "zstd"
+GZIP = "gzip"
+
+# Server preference when the client accepts several encodings with equal q
+COMPRESS_PREFERENCE = tuple(
+    e.strip() for e in os.environ.get("COMPRESS_PREFERENCE", "zstd,br,gzip").split(",") if e.strip()
+)
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_THREAD_BYTES = 64 * 1024   # compress bodies above this in a worker thread
+COMPRESS_LEVELS = {                 # per-response (latency matters)
+    BR: int(os.environ.get("COMPRESS_LEVEL_BR", "4")),
+    ZSTD: int(os.environ.get("COMPRESS_LEVEL_ZSTD", "3")),
+    GZIP: int(os.environ.get("COMPRESS_LEVEL_GZIP", "5")),
+}
+PRECOMPRESS_ENCODING = os.environ.get("PRECOMPRESS_ENCODING", GZIP)   # gzip: every client accepts it
+PRECOMPRESS_LEVELS = {BR: 9, ZSTD: 15, GZIP: 9}                        # once per scan, at write time
+# splice()-able gzip: 10-byte header, deflate data ended by a sync flush + an empty final block
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff"
+_SYNC_FLUSH = b"\x00\x00\xff\xff"
+_FINAL_EMPTY_BLOCK = b"\x03\x00"
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+# =========================
+# JSON
+# =========================
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if hasattr(obj, "tolist"):   # numpy scalars / arrays without OPT_SERIALIZE_NUMPY
+        return obj.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps(obj) -> bytes:
+    if _HAS_ORJSON:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def loads(data):
+    return orjson.loads(data) if _HAS_ORJSON else json.loads(data)
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+def json_response(content, response: Response = None, status_code: int = 200) -> FastJSONResponse:
+    """
+    Return this from an endpoint instead of a dict. Headers already set on the
+    injected `response` (validators, X-Profile-Id) are carried over, since FastAPI
+    only merges them into responses it builds itself.
+    """
+    headers = dict(response.headers) if response is not None else None
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
+
+
+# =========================
+# Encodings
+# =========================
+
+def available_encodings():
+    return {BR: _HAS_BROTLI, ZSTD: _HAS_ZSTD, GZIP: True}
+
+def compress(data: bytes, encoding: str, level: int = None) -> bytes:
+    level = COMPRESS_LEVELS[encoding] if level is None else level
+    if encoding == BR:
+        return brotli.compress(data, quality=level)
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if encoding == GZIP:
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    raise ValueError(f"Unsupported encoding '{encoding}'")
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    if encoding == BR:
+        return brotli.decompress(data)
+    if encoding == ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data)
+    if encoding == GZIP:
+        return gzip.decompress(data)
+    raise ValueError(f"Unsupported encoding '{encoding}'")
+
+def precompress(data: bytes):
+    """Write-time compression -> (blob, encoding)."""
+    encoding = PRECOMPRESS_ENCODING if available_encodings().get(PRECOMPRESS_ENCODING) else GZIP
+    if encoding == GZIP:
+        return _gzip_spliceable(data, PRECOMPRESS_LEVELS[GZIP]), encoding
+    return compress(data, encoding, PRECOMPRESS_LEVELS[encoding]), encoding
+
+
+# =========================
+# Splicing pre-compressed blobs
+# =========================
+
+def _deflate(data: bytes, level: int) -> bytes:
+    """Raw deflate of `data`, byte-aligned and not final (can be followed by more blocks)."""
+    z = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return z.compress(data) + z.flush(zlib.Z_SYNC_FLUSH)
+
+def _gzip_member(deflated: bytes, crc: int, size: int) -> bytes:
+    return _GZIP_HEADER + deflated + _FINAL_EMPTY_BLOCK + struct.pack("<II", crc & 0xFFFFFFFF, size & 0xFFFFFFFF)
+
+def _gzip_spliceable(data: bytes, level: int) -> bytes:
+    """A regular gzip member whose deflate stream splice() can reuse."""
+    return _gzip_member(_deflate(data, level), zlib.crc32(data), len(data))
+
+def _crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """CRC-32 of A + B from crc(A), crc(B) and len(B) (zlib's crc32_combine, via zeros)."""
+    zeros = bytes(len2)
+    return zlib.crc32(zeros, crc1) ^ zlib.crc32(zeros, 0) ^ crc2
+
+def splice(prefix: bytes, blob: bytes, suffix: bytes, encoding: str, level: int = None):
+    """
+    Encoded prefix + decoded(blob) + suffix, without decompressing `blob`, or None
+    when this blob/encoding can't be spliced (Brotli, gzip blobs written before
+    _gzip_spliceable): callers then fall back to serializing.
+    """
+    level = COMPRESS_LEVELS.get(encoding, 1) if level is None else level
+    if encoding == ZSTD and _HAS_ZSTD:
+        # a zstd stream is any number of frames
+        return compress(prefix, ZSTD, level) + blob + compress(suffix, ZSTD, level)
+    if encoding != GZIP or not blob.startswith(_GZIP_HEADER) or \
+            blob[-14:-8] != _SYNC_FLUSH + _FINAL_EMPTY_BLOCK:
+        return None
+    crc, size = struct.unpack("<II", blob[-8:])
+    body = _deflate(prefix, level) + blob[len(_GZIP_HEADER):-10] + _deflate(suffix, level)
+    crc = zlib.crc32(suffix, _crc32_combine(zlib.crc32(prefix), crc, size))
+    return _gzip_member(body, crc, len(prefix) + size + len(suffix))
+
+def _accepted(accept_encoding: str) -> dict:
+    """Accept-Encoding -> {coding: q}."""
+    out = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for p in params.split(";"):
+            k, _, v = p.strip().partition("=")
+            if k == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        out[coding] = q
+    return out
+
+def negotiate(accept_encoding: str, preference=COMPRESS_PREFERENCE):
+    """Best available encoding the client accepts (highest q, then server preference) or None."""
+    accepted = _accepted(accept_encoding)
+    available = available_encodings()
+    best, best_q = None, 0.0
+    for coding in preference:
+        if not available.get(coding):
+            continue
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+def accepts(accept_encoding: str, encoding: str) -> bool:
+    accepted = _accepted(accept_encoding)
+    return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+
+# =========================
+# Middleware
+# =========================
+
+class CompressionMiddleware:
+    """
+    Compress complete (non-streaming) response bodies with the negotiated encoding.
+    Skips small bodies, non-text types and anything already Content-Encoded.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES, preference=COMPRESS_PREFERENCE, levels=None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.preference = tuple(preference)
+        self.levels = {**COMPRESS_LEVELS, **(levels or {})}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.preference)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            content_type = headers.get("content-type", "")
+            compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+            if (message.get("more_body", False) or "content-encoding" in headers
+                    or not compressible or len(body) < self.minimum_size):
+                passthrough = True
+                if compressible and "content-encoding" not in headers:
+                    headers.add_vary_header("Accept-Encoding")
+                await send(start)
+                await send(message)
+                return
+
+            level = self.levels[encoding]
+            if len(body) >= COMPRESS_THREAD_BYTES:
+                data = await anyio.to_thread.run_sync(compress, body, encoding, level)
+            else:
+                data = compress(body, encoding, level)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(data))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,1031 @@
+# inference.py
+"""Model registry, loaders, predictors and result rendering (no web/DB deps)."""
+from collections import Counter
+
+import asyncio
+import json
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from fastapi import HTTPException
+from ultralytics import YOLO
+
+# ---- Torch / CV deps ----
+import torch
+import cv2
+from torchvision.models.detection import MaskRCNN, maskrcnn_resnet50_fpn
+from torchvision.models.detection.backbone_utils import resnet_fpn_backbone
+
+try:
+    import segmentation_models_pytorch as smp
+    _HAS_SMP = True
+except Exception:
+    _HAS_SMP = False
+
+import raw_outputs
+from frame import BGR, Frame
+from metrics import StageTimer
+from raw_outputs import RAW_OUTPUTS_ENABLED
+from result_schema import RAW_OUTPUT_KEY, RESULT_SCHEMA_VERSION
+
+
+# =========================
+# Config: weights & params
+# =========================
+
+MODEL_DIR = os.environ.get("MODEL_DIR", "./model")
+
+YOLO_WEIGHTS_9T = os.path.join(MODEL_DIR, "yolo_9t.pt")
+YOLO_WEIGHTS_11N = os.path.join(MODEL_DIR, "yolo_11n.pt")
+YOLO_ARCH_9T  = "yolov9t.yaml"   # ultralytics arch configs, used for untrained builds
+YOLO_ARCH_11N = "yolo11n.yaml"
+YOLO_NMS_IOU  = 0.3
+
+# YOLO inference profiles (ultralytics predict() settings), selected per request.
+# "default" passes nothing, i.e. ultralytics' own predict() defaults (conf 0.25,
+# max_det 300, class-aware NMS, the checkpoint's imgsz): what every scan used
+# before profiles existed. rect letterboxes to the frame's aspect ratio (a
+# 1920x1080 frame at imgsz 960 runs as 960x544 instead of 960x960).
+YOLO_PROFILES = {
+    "default":  {},
+    "fast":     {"imgsz": 416, "rect": True, "conf": 0.35, "max_det": 10,  "agnostic_nms": True},
+    "balanced": {"imgsz": 640, "rect": True, "conf": 0.25, "max_det": 50,  "agnostic_nms": True},
+    "thorough": {"imgsz": 960, "rect": True, "conf": 0.10, "max_det": 100, "agnostic_nms": False},
+}
+YOLO_PREDICT_CONF = 0.25   # ultralytics' predict() conf when a profile doesn't set one
+YOLO_DEFAULT_PROFILE = os.environ.get("YOLO_PROFILE", "default")
+# per-model tweaks on top of a profile, e.g. '{"yolo_9t": {"fast": {"imgsz": 320}}}'
+YOLO_PROFILE_OVERRIDES = json.loads(os.environ.get("YOLO_PROFILE_OVERRIDES", "{}"))
+
+def _check_yolo_profile_env():
+    """Fail at import, not mid-request, on a bad YOLO_PROFILE / YOLO_PROFILE_OVERRIDES."""
+    if YOLO_DEFAULT_PROFILE not in YOLO_PROFILES:
+        raise RuntimeError(f"YOLO_PROFILE={YOLO_DEFAULT_PROFILE!r}: expected one of {sorted(YOLO_PROFILES)}")
+    for model, profiles in YOLO_PROFILE_OVERRIDES.items():
+        unknown = set(profiles) - set(YOLO_PROFILES)
+        if unknown:
+            raise RuntimeError(f"YOLO_PROFILE_OVERRIDES[{model!r}]: unknown profiles {sorted(unknown)}")
+
+_check_yolo_profile_env()
+
+# Mask R-CNN (torchvision)
+MASKRCNN_WEIGHTS = os.path.join(MODEL_DIR, "maskrcnn_best.pth")
+MASKRCNN_BACKBONE = os.environ.get("MASKRCNN_BACKBONE", "resnet50")   # must match the weights
+MASKRCNN_INPUT_SIZE = (256, 256)  # (W,H)
+MASKRCNN_SCORE_THRESH = 0.75
+MASKRCNN_MASK_THRESH = 0.5
+
+# U-Net (SMP)
+UNET_WEIGHTS   = os.path.join(MODEL_DIR, "unet_effb7_adam.pth")
+UNETPP_WEIGHTS = os.path.join(MODEL_DIR, "unetpp_effb7_adam.pth")
+UNET_ENCODER_NAME = os.environ.get("UNET_ENCODER_NAME", "efficientnet-b7")   # must match the weights
+UNET_INPUT_SIZE   = (256, 256)  # (W,H)
+UNET_THRESHOLD    = 0.75
+
+
+TASK_DETECTION     = "detection"
+TASK_SEG_INSTANCE  = "segmentation_instance"
+TASK_SEG_SEMANTIC  = "segmentation_semantic"
+TASK_ENSEMBLE      = "ensemble"
+TASK_CASCADE       = "cascade"
+TASK_GATED         = "gated"   # frame rejected by frame_gate, no model ran
+COMPOSITE_TASKS    = (TASK_ENSEMBLE, TASK_CASCADE)   # run other registry models, nothing to load
+
+# Ensemble (shared decode, concurrent members, fused output)
+ENSEMBLE_DEFAULT_MEMBERS = ("yolo_9t", "yolo_11n", "unetpp")
+ENSEMBLE_WEIGHTS  = {}     # per-member fusion weight, default 1.0
+ENSEMBLE_WBF_IOU  = 0.55   # boxes above this IoU are fused into one lesion
+ENSEMBLE_MASK_VOTE = 0.5   # weighted fraction of mask members that must agree on a pixel
+
+# Cascade ("auto"): fast detector on every frame, heavy segmenter only when needed
+CASCADE_FAST_MODEL  = os.environ.get("CASCADE_FAST_MODEL", "yolo_11n")
+CASCADE_HEAVY_MODEL = os.environ.get("CASCADE_HEAVY_MODEL", "unetpp")
+CASCADE_HEAVY_CHOICES = ("unetpp", "unet", "maskrcnn")
+# fast detections with confidence in [low, high) are "uncertain" and escalate
+CASCADE_UNCERTAIN_LOW  = float(os.environ.get("CASCADE_UNCERTAIN_LOW", "0.25"))
+CASCADE_UNCERTAIN_HIGH = float(os.environ.get("CASCADE_UNCERTAIN_HIGH", "0.60"))
+
+# =========================
+# Model registry (lazy)
+# =========================
+
+AVAILABLE_MODELS = {
+    "yolo_9t":  {"task": TASK_DETECTION, "model": None, "weights": YOLO_WEIGHTS_9T, "arch": YOLO_ARCH_9T},
+    "yolo_11n": {"task": TASK_DETECTION, "model": None, "weights": YOLO_WEIGHTS_11N, "arch": YOLO_ARCH_11N},
+    "maskrcnn": {"task": TASK_SEG_INSTANCE, "model": None, "weights": MASKRCNN_WEIGHTS},
+    "unet":     {"task": TASK_SEG_SEMANTIC, "model": None, "weights": UNET_WEIGHTS},
+    "unetpp":   {"task": TASK_SEG_SEMANTIC, "model": None, "weights": UNETPP_WEIGHTS},
+    "ensemble": {"task": TASK_ENSEMBLE, "model": None, "members": ENSEMBLE_DEFAULT_MEMBERS},
+    "auto":     {"task": TASK_CASCADE, "model": None, "fast": CASCADE_FAST_MODEL, "heavy": CASCADE_HEAVY_MODEL},
+}
+
+# One lock per model: ultralytics predictors and lazy loading are not thread-safe
+_MODEL_LOCKS = {k: threading.Lock() for k in AVAILABLE_MODELS}
+_ENSEMBLE_POOL = ThreadPoolExecutor(max_workers=len(AVAILABLE_MODELS), thread_name_prefix="ensemble")
+
+# ==== CHANGED: helper to force names -> "polyp"
+def _force_polyp_names(names):
+    try:
+        if isinstance(names, dict):
+            return {k: "polyp" for k in names.keys()}
+        if isinstance(names, (list, tuple)):
+            return ["polyp"] * len(names)
+    except Exception:
+        pass
+    return {0: "polyp"}
+
+def _area_pct_from_det(det, img_w, img_h):
+    """Return % of image covered by the lesion (mask preferred, else bbox)."""
+    if not img_w or not img_h:
+        return None
+    a = det.get("mask_area_px")
+    if a is None:
+        a = det.get("bbox_area_px")
+    if not a:
+        return None
+    return 100.0 * float(a) / float(img_w * img_h)
+
+def _size_class_from_area_pct(area_pct):
+    """Map coverage % to clinically meaningful size bins (proxy for diameter)."""
+    if area_pct is None:
+        return "unknown"
+    if area_pct < 2.0:
+        return "diminutive (≤5 mm est.)"
+    if area_pct < 6.0:
+        return "small (6–9 mm est.)"
+    return "large (≥10 mm est.)"
+
+
+
+# =========================
+# Loaders (lazy)
+# =========================
+
+def load_yolo(weights_path: str):
+    model = YOLO(weights_path)
+    # ==== CHANGED: make YOLO models display "polyp" on overlays by default
+    try:
+        model.names = _force_polyp_names(model.names)
+    except Exception:
+        pass
+    model.eval()
+    return model
+
+def _build_maskrcnn():
+    if MASKRCNN_BACKBONE == "resnet50":
+        return maskrcnn_resnet50_fpn(weights=None, weights_backbone=None, num_classes=2)
+    backbone = resnet_fpn_backbone(backbone_name=MASKRCNN_BACKBONE, weights=None, trainable_layers=5)
+    return MaskRCNN(backbone, num_classes=2)
+
+def load_maskrcnn(weights_path: str):
+    model = _build_maskrcnn()
+    sd = torch.load(weights_path, map_location="cpu")
+    model.load_state_dict(sd, strict=False)
+    model.eval()
+    return model
+
+def load_unet(weights_path: str, use_plusplus: bool = False):
+    if not _HAS_SMP:
+        raise RuntimeError("segmentation_models_pytorch is not installed on the server.")
+    if use_plusplus:
+        model = smp.UnetPlusPlus(
+            encoder_name=UNET_ENCODER_NAME,
+            encoder_weights=None,
+            in_channels=3,
+            classes=1,
+            activation=None,
+        )
+    else:
+        model = smp.Unet(
+            encoder_name=UNET_ENCODER_NAME,
+            encoder_weights=None,
+            in_channels=3,
+            classes=1,
+            activation=None,
+        )
+    sd = torch.load(weights_path, map_location="cpu")
+    model.load_state_dict(sd, strict=False)
+    model.eval()
+    return model
+
+
+def _ensure_loaded(name: str):
+    entry = AVAILABLE_MODELS.get(name)
+    if entry is None:
+        raise HTTPException(status_code=400, detail=f"Unknown or unavailable model '{name}'")
+    if entry["model"] is not None or entry["task"] in COMPOSITE_TASKS:
+        return
+    if entry["task"] == TASK_DETECTION:
+        entry["model"] = load_yolo(entry["weights"])
+    elif name == "maskrcnn":
+        entry["model"] = load_maskrcnn(entry["weights"])
+    elif name == "unet":
+        entry["model"] = load_unet(entry["weights"], use_plusplus=False)
+    elif name == "unetpp":
+        entry["model"] = load_unet(entry["weights"], use_plusplus=True)
+    else:
+        raise HTTPException(status_code=500, detail=f"Unknown lazy model '{name}'")
+
+
+def build_untrained(name: str):
+    """Same architecture as the served model, random weights (benchmarks / no weights on disk)."""
+    entry = AVAILABLE_MODELS[name]
+    if entry["task"] == TASK_DETECTION:
+        return load_yolo(entry["arch"])
+    if name == "maskrcnn":
+        return _build_maskrcnn().eval()
+    if name in ("unet", "unetpp"):
+        if not _HAS_SMP:
+            raise RuntimeError("segmentation_models_pytorch is not installed on the server.")
+        arch = smp.UnetPlusPlus if name == "unetpp" else smp.Unet
+        return arch(encoder_name=UNET_ENCODER_NAME, encoder_weights=None, in_channels=3, classes=1, activation=None).eval()
+    raise ValueError(f"No untrained build for '{name}'")
+
+# =========================
+# Rendering & result utils
+# =========================
+
+def draw_mask_overlay(
+    rgb_np,
+    mask_bin,
+    fill_color=(0, 222, 255),
+    fill_alpha=0.35,
+    line_color=(0, 222, 255),
+    line_thickness=3,
+    draw_centroid=True,
+    order="RGB",
+    copy=True,
+):
+    """
+    Tint + outline the mask on an HxWx3 image. Colors are RGB; pass order="BGR" for BGR pixels.
+    copy=False draws into `rgb_np` (caller owns a writable buffer).
+    """
+    if mask_bin is None or not mask_bin.any():
+        return rgb_np
+    if order == BGR:
+        fill_color, line_color = tuple(fill_color[::-1]), tuple(line_color[::-1])
+
+    base = rgb_np.copy() if copy else rgb_np
+    m = mask_bin.astype(bool)
+    px = base[m]   # only masked pixels are blended
+    base[m] = cv2.addWeighted(px, 1.0 - fill_alpha, np.full_like(px, fill_color), fill_alpha, 0)
+
+    cnts, _ = cv2.findContours(mask_bin.astype(np.uint8, copy=False), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if cnts:
+        cv2.drawContours(base, cnts, -1, line_color, thickness=line_thickness, lineType=cv2.LINE_AA)
+        if draw_centroid:
+            for c in cnts:
+                M = cv2.moments(c)
+                if M["m00"] > 0:
+                    cx = int(M["m10"] / M["m00"])
+                    cy = int(M["m01"] / M["m00"])
+                    cv2.circle(base, (cx, cy), 5, (255, 255, 255), -1, lineType=cv2.LINE_AA)
+                    cv2.circle(base, (cx, cy), 8, (0, 0, 0), 1, lineType=cv2.LINE_AA)
+    return base
+
+def _mask_to_polygons(mask_bin, offset=(0, 0)):
+    """Outer contours as flat [x0, y0, x1, y1, ...] lists; `offset` maps a crop back to frame coords."""
+    polys = []
+    cnts, _ = cv2.findContours(mask_bin.astype(np.uint8, copy=False), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=tuple(offset))
+    for c in cnts:
+        if len(c) >= 3:
+            c = c.reshape(-1, 2)
+            polys.append([float(x) for xy in c for x in xy])
+    return polys
+
+def build_summary(dets, img_w, img_h, timing_ms=None):
+    class_counts = Counter([d.get("class_name", "polyp") for d in dets])
+    confs = [d.get("confidence") for d in dets if d.get("confidence") is not None]
+    confs = [c for c in confs if c is not None]
+
+    # ---- Clinical-only distilled view
+    lesions = []
+    area_pcts = []
+    for d in dets:
+        ap = _area_pct_from_det(d, img_w, img_h)
+        area_pcts.append(ap if ap is not None else 0.0)
+        lesions.append({
+            "id": d.get("detection_id"),
+            "confidence": float(d.get("confidence") or 0.0),
+            "size_class": _size_class_from_area_pct(ap),
+            "area_pct": float(ap) if ap is not None else None,
+        })
+    largest_ap = max(area_pcts) if area_pcts else 0.0
+
+    clinical = {
+        "polyp_count": len(dets),
+        "largest_lesion_area_pct": float(largest_ap),
+        "lesions": lesions,
+        # (keep room for future fields like image_quality, NICE-type, etc.)
+    }
+
+    return {
+        "num_detections": len(dets),
+        "class_counts": dict(class_counts),
+        "confidence_mean": float(np.mean(confs)) if confs else 0.0,
+        "confidence_max": float(np.max(confs)) if confs else 0.0,
+        "image_size": {"width": int(img_w or 0), "height": int(img_h or 0)},
+        "time_ms": timing_ms or {},
+        "clinical": clinical,   # ✅ add this
+    }
+
+def gated_result(frame: Frame, gate: dict, model_name: str):
+    """Empty result for a frame the gate rejected; keeps the gate decision and score."""
+    summary = build_summary([], frame.width, frame.height)
+    summary["clinical"]["image_quality"] = gate["quality"]
+    return {
+        "schema": RESULT_SCHEMA_VERSION,
+        "result_meta": {"task": TASK_GATED, "model_name": model_name, "gate": gate, "frame": frame.stats()},
+        "detections": [],
+        "summary": summary,
+    }
+
+
+
+# =========================
+# Predictors (per task)
+# =========================
+
+def _to_model_input(frame: Frame, size, interpolation):
+    """Resize at source order, flip to RGB on the small image, CHW float32 in [0,1]."""
+    small = cv2.resize(frame.data, size, interpolation=interpolation)
+    if frame.order == BGR:
+        small = small[..., ::-1]
+    return torch.from_numpy(np.ascontiguousarray(small.transpose(2, 0, 1))).float().div_(255.0)
+
+
+def forward_maskrcnn(model, frame: Frame, timer: StageTimer = None):
+    """Forward pass only -> (scores [N], labels [N], soft masks [N,h,w]) at MASKRCNN_INPUT_SIZE."""
+    timer = timer or StageTimer()
+    with timer.stage("preprocess"):
+        tensor = _to_model_input(frame, MASKRCNN_INPUT_SIZE, cv2.INTER_AREA)
+
+    with timer.stage("inference"), torch.no_grad():
+        out = model([tensor])[0]
+
+    scores = out.get("scores")
+    masks = out.get("masks")
+    labels = out.get("labels")
+    if scores is None or masks is None:
+        h, w = MASKRCNN_INPUT_SIZE[1], MASKRCNN_INPUT_SIZE[0]
+        return np.zeros(0, np.float32), np.zeros(0, np.int64), np.zeros((0, h, w), np.float32)
+    scores = scores.cpu().numpy()
+    labels = labels.cpu().numpy() if labels is not None else np.zeros(len(scores), np.int64)
+    return scores, labels, masks[:, 0].cpu().numpy()
+
+def decode_maskrcnn(scores, labels, masks_small, orig_w: int, orig_h: int,
+                    score_thresh: float = MASKRCNN_SCORE_THRESH, mask_thresh: float = MASKRCNN_MASK_THRESH):
+    """Low-res instance outputs -> (detections, union mask at frame size). No torch needed."""
+    dets = []
+    union_mask = np.zeros((orig_h, orig_w), dtype=np.uint8)
+
+    keep = [i for i, s in enumerate(scores) if s >= float(score_thresh)]
+    for i in keep:
+        m_bin_small = (masks_small[i] > float(mask_thresh)).astype(np.uint8)
+
+        m_up = cv2.resize(m_bin_small, (orig_w, orig_h), interpolation=cv2.INTER_NEAREST)
+        area_px = int(cv2.countNonZero(m_up))
+        if area_px == 0:
+            continue
+
+        np.maximum(union_mask, m_up, out=union_mask)
+        polys = _mask_to_polygons(m_up)
+        conf = float(scores[i])
+
+        dets.append({
+            "detection_id": len(dets),
+            "class_id": int(labels[i]),
+            "class_name": "polyp",
+            "confidence": conf,
+            "mask_area_px": area_px,
+            "mask_polygons": polys
+        })
+    return dets, union_mask
+
+def predict_maskrcnn(model, frame: Frame, score_thresh: float = MASKRCNN_SCORE_THRESH, mask_thresh: float = MASKRCNN_MASK_THRESH, render: bool = True, timer: StageTimer = None, keep_raw: bool = False):
+    timer = timer or StageTimer()
+    orig_h, orig_w = frame.height, frame.width
+
+    scores, labels, masks_small = forward_maskrcnn(model, frame, timer=timer)
+
+    with timer.stage("postprocess"):
+        dets, union_mask = decode_maskrcnn(scores, labels, masks_small, orig_w, orig_h, score_thresh, mask_thresh)
+
+    overlay = None
+    if render:
+        with timer.stage("render"):
+            overlay = draw_mask_overlay(frame.copy(), union_mask, order=frame.order, copy=False)
+
+    summary = build_summary(dets, orig_w, orig_h, timing_ms=timer.ms)
+    result = {
+        "schema": RESULT_SCHEMA_VERSION,
+        "result_meta": {"task": TASK_SEG_INSTANCE, "thresholds": {"score": float(score_thresh), "mask": float(mask_thresh)}},
+        "detections": dets,
+        "summary": summary
+    }
+    if keep_raw:
+        with timer.stage("raw_encode"):
+            result[RAW_OUTPUT_KEY] = raw_outputs.encode_instances(scores, labels, masks_small)
+    return overlay, result
+
+
+def forward_unet(model, frame: Frame, class_idx: int = 0, timer: StageTimer = None):
+    """Forward pass only -> class probability map at UNET_INPUT_SIZE (float32)."""
+    timer = timer or StageTimer()
+
+    # ----- resize & normalize
+    with timer.stage("preprocess"):
+        x_t = _to_model_input(frame, UNET_INPUT_SIZE, cv2.INTER_LINEAR)[None, ...]
+
+    # ----- forward pass on resized image
+    with timer.stage("inference"), torch.no_grad():
+        out = model(x_t)
+        if isinstance(out, (list, tuple)):
+            out = out[0]
+        if out.shape[1] == 1:
+            return torch.sigmoid(out)[0, 0].cpu().numpy()
+        return torch.softmax(out, dim=1)[0].cpu().numpy()[class_idx]
+
+def decode_unet(probs_small, W: int, H: int, thresh: float = UNET_THRESHOLD):
+    """
+    Low-res probability map -> (per-lesion detections, binary mask at frame size). No torch needed.
+    - Confidence per lesion = mean(prob) within that component
+    - Area uses pixel count of the component at original resolution
+    """
+    # ----- upsample probabilities & binarize
+    probs = cv2.resize(probs_small, (W, H), interpolation=cv2.INTER_LINEAR)
+    mask_bin = (probs >= float(thresh)).astype(np.uint8)
+
+    # ----- split into connected components (each = 1 polyp)
+    dets = []
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(mask_bin, connectivity=8)
+
+    # label 0 is background; work on each component's bbox crop, not the full frame
+    for label in range(1, num_labels):
+        x, y, w, h, area_px = (int(v) for v in stats[label, :5])
+        if area_px <= 0:
+            continue
+
+        comp = labels[y:y + h, x:x + w] == label
+
+        # per-component confidence = mean prob inside the component
+        comp_probs = probs[y:y + h, x:x + w][comp]
+        conf = float(comp_probs.mean()) if comp_probs.size > 0 else 0.0
+
+        # polygons for the component
+        polys = _mask_to_polygons(comp, offset=(x, y))
+
+        dets.append({
+            "detection_id": len(dets),
+            "class_id": 0,
+            "class_name": "polyp",
+            "confidence": conf,
+            "mask_area_px": area_px,
+            "mask_polygons": polys
+        })
+    return dets, mask_bin
+
+def predict_unet(model, frame: Frame, thresh: float = UNET_THRESHOLD, class_idx: int = 0, render: bool = True, timer: StageTimer = None, keep_raw: bool = False):
+    """Per-lesion (component) detections for semantic segmentation: forward_unet + decode_unet."""
+    timer = timer or StageTimer()
+    H, W = frame.height, frame.width
+
+    probs_small = forward_unet(model, frame, class_idx, timer=timer)
+
+    with timer.stage("postprocess"):
+        dets, mask_bin = decode_unet(probs_small, W, H, thresh)
+
+    # overlay still shows the union (nice & simple); keep as-is
+    overlay = None
+    if render:
+        with timer.stage("render"):
+            overlay = draw_mask_overlay(frame.copy(), mask_bin, order=frame.order, copy=False)
+
+    summary = build_summary(dets, W, H, timing_ms=timer.ms)
+    result = {
+        "schema": RESULT_SCHEMA_VERSION,
+        "result_meta": {"task": TASK_SEG_SEMANTIC, "thresholds": {"prob": float(thresh)}},
+        "detections": dets,
+        "summary": summary
+    }
+    if keep_raw:
+        with timer.stage("raw_encode"):
+            result[RAW_OUTPUT_KEY] = raw_outputs.encode_prob_map(probs_small)
+    return overlay, result
+
+
+# ==== Re-threshold from stored raw outputs ====================================
+
+def rethreshold(raw: dict, img_w: int, img_h: int, threshold: float, mask_threshold: float = None):
+    """
+    Detections + summary for one threshold from decoded raw outputs (raw_outputs.decode)
+    -> (result dict, union mask at frame size). `threshold` is the probability
+    threshold for prob maps and the score threshold for instances.
+    """
+    t0 = time.perf_counter()
+    if raw["kind"] == raw_outputs.KIND_PROB_MAP:
+        dets, mask = decode_unet(raw["probs"], img_w, img_h, threshold)
+        task, thresholds = TASK_SEG_SEMANTIC, {"prob": float(threshold)}
+    else:
+        mask_threshold = MASKRCNN_MASK_THRESH if mask_threshold is None else mask_threshold
+        dets, mask = decode_maskrcnn(raw["scores"], raw["labels"], raw["masks"], img_w, img_h, threshold, mask_threshold)
+        task, thresholds = TASK_SEG_INSTANCE, {"score": float(threshold), "mask": float(mask_threshold)}
+    summary = build_summary(dets, img_w, img_h, timing_ms={"postprocess": (time.perf_counter() - t0) * 1000.0})
+    result = {
+        "schema": RESULT_SCHEMA_VERSION,
+        "result_meta": {"task": task, "thresholds": thresholds, "rethresholded": True},
+        "detections": dets,
+        "summary": summary,
+    }
+    return result, mask
+
+
+# ==== YOLO -> result dict =====================================================
+
+def _safe_class_name(class_names, cls_id: int):
+    try:
+        if isinstance(class_names, dict):
+            return class_names.get(cls_id, str(cls_id))
+        return class_names[cls_id]
+    except Exception:
+        return str(cls_id)
+
+def _norm_xy_list(xy_list, w: int, h: int):
+    out = []
+    for i, v in enumerate(xy_list):
+        out.append(float(v) / (w if i % 2 == 0 else h))
+    return out
+
+def yolo_result_to_dict(res, class_names):
+    orig_h, orig_w = res.orig_shape[:2] if hasattr(res, "orig_shape") else (None, None)
+    if orig_h is None or orig_w is None:
+        try:
+            orig_h, orig_w = res.orig_img.shape[:2]
+        except Exception:
+            orig_w = orig_w or 0
+            orig_h = orig_h or 0
+
+    dets = []
+
+    boxes = getattr(res, "boxes", None)
+    if boxes is not None and len(boxes) > 0:
+        xyxy = boxes.xyxy.cpu().numpy() if hasattr(boxes.xyxy, "cpu") else boxes.xyxy
+        xywh = boxes.xywh.cpu().numpy() if hasattr(boxes.xywh, "cpu") else boxes.xywh
+        conf = boxes.conf.cpu().numpy() if hasattr(boxes.conf, "cpu") else boxes.conf
+        cls  = boxes.cls.cpu().numpy()  if hasattr(boxes.cls, "cpu")  else boxes.cls
+
+        for i in range(len(xyxy)):
+            x1, y1, x2, y2 = [float(v) for v in xyxy[i].tolist()]
+            cx, cy, bw, bh  = [float(v) for v in xywh[i].tolist()]
+            c  = float(conf[i])
+            ci = int(cls[i])
+
+            # ==== CHANGED: force name to "polyp" (JSON output)
+            # name = _safe_class_name(class_names, ci)
+            name = "polyp"
+
+            bbox_area_px = int(max(bw, 0.0) * max(bh, 0.0))
+            aspect_ratio = float(bw / bh) if bh > 0 else None
+
+            dets.append({
+                "detection_id": i,
+                "class_id": ci,
+                "class_name": name,
+                "confidence": c,
+                "bbox_xyxy": [x1, y1, x2, y2],
+                "bbox_xywh": [cx, cy, bw, bh],
+                "bbox_xyxy_norm": _norm_xy_list([x1, y1, x2, y2], orig_w, orig_h) if orig_w and orig_h else None,
+                "bbox_xywh_norm": [
+                    cx / orig_w if orig_w else None,
+                    cy / orig_h if orig_h else None,
+                    bw / orig_w if orig_w else None,
+                    bh / orig_h if orig_h else None,
+                ],
+                "bbox_area_px": bbox_area_px,
+                "aspect_ratio": aspect_ratio,
+            })
+
+    masks = getattr(res, "masks", None)
+    if masks is not None and getattr(masks, "xy", None):
+        polys_per_det = masks.xy
+        for i, polys in enumerate(polys_per_det):
+            if i >= len(dets):
+                continue
+            flat_polys = []
+            total_area = 0.0
+            for poly in polys:
+                pts = np.asarray(poly, dtype=np.float32).reshape(-1, 2)
+                if pts.shape[0] >= 3:
+                    total_area += float(cv2.contourArea(pts))
+                    flat_polys.append([float(x) for xy in pts for x in xy])
+            if flat_polys:
+                dets[i]["mask_polygons"] = flat_polys
+                dets[i]["mask_area_px"] = int(round(total_area))
+
+    summary = build_summary(dets, orig_w or 0, orig_h or 0)
+    result = {
+        "schema": RESULT_SCHEMA_VERSION,
+        "result_meta": {"task": TASK_DETECTION},
+        "detections": dets,
+        "summary": summary,
+    }
+    return result
+
+
+# ==== YOLO inference profiles =================================================
+
+def _parse_yolo_profile(raw: str):
+    profile = (raw or "").strip() or YOLO_DEFAULT_PROFILE
+    if profile not in YOLO_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Invalid inference profile '{profile}'")
+    return profile
+
+def yolo_profile(name: str, profile: str = None) -> dict:
+    """predict() settings for a YOLO registry model under `profile` (per-model overrides applied)."""
+    profile = profile or YOLO_DEFAULT_PROFILE
+    return {**YOLO_PROFILES[profile], **YOLO_PROFILE_OVERRIDES.get(name, {}).get(profile, {})}
+
+def yolo_profile_meta(profile: str = None, settings: dict = None) -> dict:
+    """result_meta["profile"]: {"name", "iou", **predict() settings} (the profile's own without `settings`)."""
+    profile = profile or YOLO_DEFAULT_PROFILE
+    return {"name": profile, "iou": YOLO_NMS_IOU, **(YOLO_PROFILES[profile] if settings is None else settings)}
+
+
+def predict_yolo(model, frame: Frame, name: str, profile: str = None, timer: StageTimer = None, conf: float = None):
+    """
+    YOLO predict() under an inference profile -> (ultralytics Results, result dict).
+    conf overrides the profile's confidence floor. render_yolo() draws the Results.
+    """
+    timer = timer or StageTimer()
+    # ==== CHANGED: ensure model + result names are "polyp" so res.plot() uses it
+    if hasattr(model, "names"):
+        try:
+            model.names = _force_polyp_names(model.names)
+        except Exception:
+            pass
+
+    profile = profile or YOLO_DEFAULT_PROFILE
+    settings = yolo_profile(name, profile)
+    if conf is not None:
+        settings["conf"] = conf
+    # ultralytics reads numpy input as BGR: no conversion for decoded frames
+    preds = model.predict(frame.bgr(), verbose=False, iou=YOLO_NMS_IOU, **settings)
+    res = preds[0]
+    # ultralytics times its own preprocess / inference / NMS (ms)
+    for stage, ms in (getattr(res, "speed", None) or {}).items():
+        if ms is not None:
+            timer.add(stage, ms)
+
+    with timer.stage("postprocess"):
+        try:
+            res.names = _force_polyp_names(getattr(res, "names", getattr(model, "names", {})))
+        except Exception:
+            pass
+
+        result_dict = yolo_result_to_dict(res, res.names)
+        result_dict["result_meta"]["profile"] = yolo_profile_meta(profile, settings)
+    return res, result_dict
+
+def render_yolo(res, frame: Frame, timer: StageTimer = None) -> Frame:
+    timer = timer or StageTimer()
+    with timer.stage("render"):
+        processed = Frame(res.plot(), BGR)  # BGR, encoded as-is
+        frame.count_buffer()
+    return processed
+
+
+# ==== Single model dispatch ===================================================
+
+def run_model(name: str, frame: Frame, render: bool = True, timer: StageTimer = None, keep_raw: bool = False,
+              profile: str = None):
+    """
+    Run one registry model on a decoded frame -> (processed Frame | None, result dict).
+    Stage times (preprocess/inference/postprocess/render) accumulate into `timer` and summary.time_ms.
+    keep_raw: segmenters also return their encoded low-res output under result[RAW_OUTPUT_KEY].
+    profile: YOLO_PROFILES name for detectors (default YOLO_DEFAULT_PROFILE), recorded in result_meta.
+    """
+    timer = timer or StageTimer()
+    with _MODEL_LOCKS[name]:
+        _ensure_loaded(name)
+        entry = AVAILABLE_MODELS[name]
+        task = entry["task"]
+        model = entry["model"]
+
+        if task == TASK_DETECTION:
+            res, result_dict = predict_yolo(model, frame, name, profile=profile, timer=timer)
+            processed = render_yolo(res, frame, timer=timer) if render else None
+            result_dict["summary"]["time_ms"] = timer.ms
+
+        elif task == TASK_SEG_INSTANCE:
+            overlay_np, result_dict = predict_maskrcnn(model, frame, render=render, timer=timer, keep_raw=keep_raw)
+            processed = Frame(overlay_np, frame.order) if render else None
+
+        elif task == TASK_SEG_SEMANTIC:
+            overlay_np, result_dict = predict_unet(model, frame, render=render, timer=timer, keep_raw=keep_raw)
+            processed = Frame(overlay_np, frame.order) if render else None
+
+        else:
+            raise HTTPException(status_code=500, detail=f"Unsupported task: {task}")
+
+    result_dict["result_meta"]["model_name"] = name
+    result_dict["result_meta"]["frame"] = frame.stats()
+    return processed, result_dict
+
+
+# ==== Ensemble: fusion ========================================================
+
+def _det_box_xyxy(det):
+    """Pixel xyxy box of a detection (YOLO box, else bounds of its mask polygons)."""
+    if det.get("bbox_xyxy"):
+        return [float(v) for v in det["bbox_xyxy"]]
+    pts = [np.asarray(p, dtype=np.float32).reshape(-1, 2) for p in det.get("mask_polygons") or [] if len(p) >= 6]
+    if not pts:
+        return None
+    pts = np.concatenate(pts, axis=0)
+    x1, y1 = pts.min(axis=0)
+    x2, y2 = pts.max(axis=0)
+    return [float(x1), float(y1), float(x2), float(y2)]
+
+def _box_iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(ix2 - ix1, 0.0) * max(iy2 - iy1, 0.0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+def weighted_box_fusion(boxes_per_member, weights, iou_thr: float = ENSEMBLE_WBF_IOU):
+    """
+    Weighted box fusion across members.
+    - boxes_per_member: {member: [(xyxy, conf), ...]}
+    - Fused box = confidence*weight weighted mean of its cluster
+    - Fused confidence = sum over members of (best conf in cluster * weight) / total weight,
+      so a lesion only one member sees is down-weighted
+    Returns [(xyxy, conf, [members...]), ...] sorted by confidence.
+    """
+    total_w = float(sum(weights.get(m, 1.0) for m in boxes_per_member)) or 1.0
+    entries = [
+        (box, float(conf), float(weights.get(m, 1.0)), m)
+        for m, boxes in boxes_per_member.items()
+        for box, conf in boxes
+    ]
+    entries.sort(key=lambda e: e[1] * e[2], reverse=True)
+
+    clusters = []
+    for box, conf, w, m in entries:
+        best, best_iou = None, iou_thr
+        for c in clusters:
+            iou = _box_iou(c["fused"], box)
+            if iou > best_iou:
+                best, best_iou = c, iou
+        if best is None:
+            clusters.append({"items": [(box, conf, w, m)], "fused": list(box)})
+            continue
+        best["items"].append((box, conf, w, m))
+        cw = np.array([c_ * w_ for _, c_, w_, _ in best["items"]], dtype=np.float64)
+        bx = np.array([b_ for b_, _, _, _ in best["items"]], dtype=np.float64)
+        best["fused"] = (cw[:, None] * bx).sum(axis=0) / max(cw.sum(), 1e-9)
+        best["fused"] = [float(v) for v in best["fused"]]
+
+    fused = []
+    for c in clusters:
+        per_member = {}
+        for _, conf, w, m in c["items"]:
+            per_member[m] = max(per_member.get(m, 0.0), conf * w)
+        fused.append((c["fused"], float(sum(per_member.values()) / total_w), sorted(per_member)))
+    fused.sort(key=lambda f: f[1], reverse=True)
+    return fused
+
+def _rasterize_polygons(dets, img_w, img_h):
+    mask = np.zeros((img_h, img_w), dtype=np.uint8)
+    for d in dets:
+        for p in d.get("mask_polygons") or []:
+            pts = np.asarray(p, dtype=np.float32).reshape(-1, 2)
+            if pts.shape[0] >= 3:
+                cv2.fillPoly(mask, [np.round(pts).astype(np.int32)], 1)
+    return mask
+
+def fuse_member_results(member_results, img_w, img_h, weights=None):
+    """Fuse per-member result dicts -> (fused detections, fused union mask | None)."""
+    weights = weights or {}
+
+    boxes_per_member = {}
+    for m, r in member_results.items():
+        boxes = []
+        for d in r.get("detections", []):
+            b = _det_box_xyxy(d)
+            if b is not None:
+                boxes.append((b, d.get("confidence") or 0.0))
+        boxes_per_member[m] = boxes
+    fused_boxes = weighted_box_fusion(boxes_per_member, weights)
+
+    # Pixel vote over members that produce masks
+    mask_members = [
+        m for m, r in member_results.items()
+        if r.get("result_meta", {}).get("task") in (TASK_SEG_INSTANCE, TASK_SEG_SEMANTIC)
+    ]
+    fused_mask = None
+    if mask_members:
+        vote = np.zeros((img_h, img_w), dtype=np.float32)
+        for m in mask_members:
+            vote += float(weights.get(m, 1.0)) * _rasterize_polygons(member_results[m].get("detections", []), img_w, img_h)
+        vote /= float(sum(weights.get(m, 1.0) for m in mask_members)) or 1.0
+        fused_mask = (vote >= ENSEMBLE_MASK_VOTE).astype(np.uint8)
+
+    dets = []
+    for box, conf, members in fused_boxes:
+        x1, y1, x2, y2 = box
+        bw, bh = max(x2 - x1, 0.0), max(y2 - y1, 0.0)
+        det = {
+            "detection_id": len(dets),
+            "class_id": 0,
+            "class_name": "polyp",
+            "confidence": conf,
+            "bbox_xyxy": [x1, y1, x2, y2],
+            "bbox_xywh": [x1 + bw / 2.0, y1 + bh / 2.0, bw, bh],
+            "bbox_xyxy_norm": _norm_xy_list([x1, y1, x2, y2], img_w, img_h) if img_w and img_h else None,
+            "bbox_area_px": int(bw * bh),
+            "aspect_ratio": float(bw / bh) if bh > 0 else None,
+            "members": members,
+        }
+        if fused_mask is not None:
+            xi1, yi1 = max(int(x1), 0), max(int(y1), 0)
+            xi2, yi2 = min(int(np.ceil(x2)), img_w), min(int(np.ceil(y2)), img_h)
+            box_mask = np.zeros_like(fused_mask)
+            box_mask[yi1:yi2, xi1:xi2] = fused_mask[yi1:yi2, xi1:xi2]
+            if box_mask.any():
+                det["mask_area_px"] = int(box_mask.sum())
+                det["mask_polygons"] = _mask_to_polygons(box_mask)
+        dets.append(det)
+    return dets, fused_mask
+
+def draw_fused_overlay(frame: Frame, dets, fused_mask, box_color=(0, 222, 255)):
+    base = frame.copy()
+    if fused_mask is not None:
+        base = draw_mask_overlay(base, fused_mask, order=frame.order, copy=False)
+    box_color = frame.color(box_color)
+    for d in dets:
+        x1, y1, x2, y2 = [int(round(v)) for v in d["bbox_xyxy"]]
+        cv2.rectangle(base, (x1, y1), (x2, y2), box_color, 2, lineType=cv2.LINE_AA)
+        label = f"polyp {d['confidence']:.2f} ({len(d['members'])})"
+        cv2.putText(base, label, (x1, max(y1 - 6, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, box_color, 1, cv2.LINE_AA)
+    return base
+
+
+# ==== Ensemble: execution =====================================================
+
+def _parse_ensemble_members(raw: str):
+    members = [m.strip() for m in (raw or "").split(",") if m.strip()] or list(ENSEMBLE_DEFAULT_MEMBERS)
+    for m in members:
+        entry = AVAILABLE_MODELS.get(m)
+        if entry is None or entry["task"] in COMPOSITE_TASKS:
+            raise HTTPException(status_code=400, detail=f"Invalid ensemble member '{m}'")
+    return list(dict.fromkeys(members))
+
+def _timed_member(name, frame, profile=None):
+    t0 = time.perf_counter()
+    _, result = run_model(name, frame, render=False, profile=profile)
+    return result, (time.perf_counter() - t0) * 1000.0
+
+async def run_ensemble(frame: Frame, members, timer: StageTimer = None, profile: str = None):
+    """
+    Decode once, run members concurrently on the shared (read-only) frame, fuse.
+    Total latency ~= slowest member + fusion.
+    """
+    timer = timer or StageTimer()
+    loop = asyncio.get_running_loop()
+    with timer.stage("inference"):
+        outs = await asyncio.gather(*[
+            loop.run_in_executor(_ENSEMBLE_POOL, _timed_member, m, frame, profile) for m in members
+        ])
+    member_results = {m: r for m, (r, _) in zip(members, outs)}
+    member_ms = {m: ms for m, (_, ms) in zip(members, outs)}
+
+    img_w, img_h = frame.width, frame.height
+    weights = {m: ENSEMBLE_WEIGHTS.get(m, 1.0) for m in members}
+    with timer.stage("postprocess"):
+        dets, fused_mask = fuse_member_results(member_results, img_w, img_h, weights)
+    with timer.stage("render"):
+        overlay = draw_fused_overlay(frame, dets, fused_mask)
+
+    result = {
+        "schema": RESULT_SCHEMA_VERSION,
+        "result_meta": {
+            "task": TASK_ENSEMBLE,
+            "members": members,
+            "member_ms": member_ms,
+            "profile": yolo_profile_meta(profile),   # YOLO members (their own meta has per-model overrides)
+            "frame": frame.stats(),
+            "fusion": {"method": "wbf", "iou_thr": ENSEMBLE_WBF_IOU, "mask_vote": ENSEMBLE_MASK_VOTE, "weights": weights},
+        },
+        "detections": dets,
+        "summary": build_summary(dets, img_w, img_h, timing_ms=timer.ms),
+        "members": member_results,
+    }
+    return Frame(overlay, frame.order), result
+
+
+# ==== Cascade ("auto") ========================================================
+
+def _parse_cascade_heavy(raw: str):
+    heavy = (raw or "").strip() or CASCADE_HEAVY_MODEL
+    if heavy not in CASCADE_HEAVY_CHOICES:
+        raise HTTPException(status_code=400, detail=f"Invalid cascade model '{heavy}'")
+    return heavy
+
+def cascade_decision(fast_result: dict, want_masks: bool = False,
+                     band=(CASCADE_UNCERTAIN_LOW, CASCADE_UNCERTAIN_HIGH)):
+    """
+    Why the fast result is not enough -> "uncertain" | "masks", or None to keep it.
+    - any fast detection inside the uncertain band escalates;
+    - confident positives escalate only when the caller asked for masks;
+    - frames with nothing above `low` are accepted as negative.
+    """
+    low, high = band
+    confs = [float(d.get("confidence") or 0.0) for d in fast_result.get("detections", [])]
+    if any(low <= c < high for c in confs):
+        return "uncertain"
+    if want_masks and any(c >= high for c in confs):
+        return "masks"
+    return None
+
+def run_cascade(frame: Frame, heavy: str = None, want_masks: bool = False, band=None, timer: StageTimer = None,
+                keep_raw: bool = False, profile: str = None):
+    """
+    Fast detector first; the heavy segmenter runs on the same frame only when
+    cascade_decision() says so. Stage times of both models accumulate into `timer`.
+    The fast overlay is only drawn when its result is kept, and the fast model's
+    confidence floor is capped at the band's low end so no uncertain detection
+    is dropped before the decision.
+    """
+    timer = timer or StageTimer()
+    heavy = heavy or CASCADE_HEAVY_MODEL
+    band = tuple(band or (CASCADE_UNCERTAIN_LOW, CASCADE_UNCERTAIN_HIGH))
+
+    fast_timer = StageTimer()
+    conf = min(yolo_profile(CASCADE_FAST_MODEL, profile).get("conf", YOLO_PREDICT_CONF), band[0])
+    with _MODEL_LOCKS[CASCADE_FAST_MODEL]:
+        _ensure_loaded(CASCADE_FAST_MODEL)
+        res, fast_result = predict_yolo(AVAILABLE_MODELS[CASCADE_FAST_MODEL]["model"], frame, CASCADE_FAST_MODEL,
+                                        profile=profile, timer=fast_timer, conf=conf)
+    fast_result["result_meta"]["model_name"] = CASCADE_FAST_MODEL
+    reason = cascade_decision(fast_result, want_masks, band)
+    stage_timers = {CASCADE_FAST_MODEL: fast_timer}
+
+    result = fast_result
+    if reason is None:
+        processed = render_yolo(res, frame, timer=fast_timer)
+    else:
+        heavy_timer = StageTimer()
+        processed, result = run_model(heavy, frame, timer=heavy_timer, keep_raw=keep_raw)
+        stage_timers[heavy] = heavy_timer
+
+    for t in stage_timers.values():
+        for stage, ms in t.ms.items():
+            timer.add(stage, ms)
+
+    fast_confs = [d["confidence"] for d in fast_result["detections"]]
+    final_model = heavy if reason is not None else CASCADE_FAST_MODEL
+    result["result_meta"] = {
+        **result["result_meta"],
+        "task": TASK_CASCADE,
+        "final_model": final_model,
+        "final_task": AVAILABLE_MODELS[final_model]["task"],
+        "stages": list(stage_timers),
+        "escalated": reason is not None,
+        "escalation_reason": reason,
+        "uncertain_band": list(band),
+        "want_masks": bool(want_masks),
+        "fast": {"num_detections": len(fast_confs), "max_confidence": max(fast_confs) if fast_confs else None,
+                 "profile": fast_result["result_meta"].get("profile")},
+        "stage_ms": {m: sum(t.ms.values()) for m, t in stage_timers.items()},
+        "frame": frame.stats(),
+    }
+    result["summary"]["time_ms"] = timer.ms
+    return processed, result
+
+
+# ==== Dispatch by registry name ===============================================
+
+async def infer(name: str, frame: Frame, options: dict = None, timer: StageTimer = None):
+    """
+    Any registry entry -> (processed Frame, result dict). `options` comes from the
+    request: {"members": [...]} for the ensemble, {"heavy", "want_masks"} for auto,
+    {"profile"} (YOLO_PROFILES) for anything that runs a YOLO model.
+    Segmenter results carry their raw output (result[RAW_OUTPUT_KEY]) unless
+    options["keep_raw"] is False; fused ensemble results never do.
+    """
+    options = options or {}
+    task = AVAILABLE_MODELS[name]["task"]
+    keep_raw = bool(options.get("keep_raw", RAW_OUTPUTS_ENABLED))
+    profile = options.get("profile")
+    if task == TASK_ENSEMBLE:
+        return await run_ensemble(frame, options.get("members") or list(ENSEMBLE_DEFAULT_MEMBERS), timer=timer,
+                                  profile=profile)
+    if task == TASK_CASCADE:
+        return run_cascade(frame, options.get("heavy"), bool(options.get("want_masks")), timer=timer, keep_raw=keep_raw,
+                           profile=profile)
+    return run_model(name, frame, timer=timer, keep_raw=keep_raw, profile=profile)
@@ -0,0 +1,463 @@
+# inference_pool.py
+"""
+Dedicated inference worker pool shared by all API processes.
+
+    export INFERENCE_POOL_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))")
+    python inference_pool.py --workers 4            # start the pool (one per host)
+    APP_ROLE=api uvicorn main:app --workers 8       # same INFERENCE_POOL_AUTHKEY
+
+- The socket unpickles whatever an authenticated peer sends, so the pool and its
+  clients share a secret INFERENCE_POOL_AUTHKEY (required, no default; generate one
+  per deployment). The default socket lives in a private 0700 directory
+  (INFERENCE_POOL_DIR) and is created 0600.
+
+- The pool process loads the heavy Mask R-CNN / U-Net state dicts once and moves
+  them to shared memory; every worker builds the architecture and *assigns* those
+  tensors (read-only, no per-worker copy). YOLO weights are a few MB and are
+  loaded per worker.
+- Each worker is pinned to its own slice of cores with a matching
+  torch.set_num_threads, so workers don't oversubscribe the box.
+- The server hands each worker one task at a time over its own pipes and watches
+  the worker processes: a worker that dies (OOM, segfault, kill) is restarted and
+  the request it was running fails with an error instead of never being answered.
+  Clients also give up after INFERENCE_POOL_TIMEOUT_S.
+- This is the "inference" process role. API processes never decode or import
+  the ML stack: they send the encoded upload over a local socket ("scan") and get
+  the result + overlay JPEG back (pipeline.py), and ask the pool to validate
+  model options ("check") and list models ("models"). Only encoded images cross
+  the socket, a fraction of the decoded frame's size.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, wait
+
+
+INFERENCE_POOL_DIR = os.environ.get("INFERENCE_POOL_DIR") or os.path.join(
+    tempfile.gettempdir(), f"polyp-inference-{os.getuid()}"
+)
+INFERENCE_POOL_ADDRESS = os.environ.get("INFERENCE_POOL_ADDRESS") or os.path.join(INFERENCE_POOL_DIR, "pool.sock")
+INFERENCE_POOL_AUTHKEY = os.environ.get("INFERENCE_POOL_AUTHKEY", "")
+SHARED_WEIGHT_MODELS = ("maskrcnn", "unet", "unetpp")
+INLINE_OPS = ("models", "check")   # answered by the pool server itself, not queued to a worker
+INFERENCE_POOL_TIMEOUT_S = float(os.environ.get("INFERENCE_POOL_TIMEOUT_S", "120"))   # client side, per request
+WORKER_MIN_UPTIME_S = 10.0       # a worker dying sooner is restarted after WORKER_RESTART_BACKOFF_S
+WORKER_RESTART_BACKOFF_S = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+def pool_authkey() -> bytes:
+    if not INFERENCE_POOL_AUTHKEY:
+        raise RuntimeError("INFERENCE_POOL_AUTHKEY is not set: generate a secret per deployment "
+                           "(e.g. `python -c \"import secrets; print(secrets.token_hex(32))\"`) "
+                           "and give the same value to the pool and the API processes.")
+    return INFERENCE_POOL_AUTHKEY.encode()
+
+def private_socket_dir(address: str):
+    """Create the socket's directory 0700, or refuse one another user could write to."""
+    path = os.path.dirname(os.path.abspath(address))
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise RuntimeError(f"{path} must be owned by this user and not group/world-writable "
+                           f"(owner uid {st.st_uid}, mode {st.st_mode & 0o777:o})")
+
+
+# =========================
+# Worker process
+# =========================
+
+def core_plan(workers: int, threads_per_worker: int = 0):
+    """Split the CPUs this process may use into one contiguous slice per worker."""
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    per = threads_per_worker or max(1, len(cpus) // workers)
+    return [[cpus[(i * per + j) % len(cpus)] for j in range(per)] for i in range(workers)]
+
+def load_shared_weights(models):
+    """torch.load each heavy state dict once and move its tensors to shared memory."""
+    import torch
+    import inference
+
+    shared = {}
+    for name in models:
+        entry = inference.AVAILABLE_MODELS[name]
+        if name not in SHARED_WEIGHT_MODELS or not os.path.exists(entry["weights"]):
+            continue
+        sd = torch.load(entry["weights"], map_location="cpu")
+        for t in sd.values():
+            if isinstance(t, torch.Tensor):
+                t.share_memory_()
+        shared[name] = sd
+    return shared
+
+def _worker_main(worker_id, cores, shared_weights, tasks, results):
+    import torch
+    import inference
+    import pipeline
+    from metrics import StageTimer
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    torch.set_num_interop_threads(1)
+
+    for name, sd in shared_weights.items():
+        model = inference.build_untrained(name)
+        model.load_state_dict(sd, strict=False, assign=True)
+        inference.AVAILABLE_MODELS[name]["model"] = model.eval()
+
+    results.send({"ready": worker_id})
+    while True:
+        try:
+            msg = tasks.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        reply = {"id": msg["id"], "worker": worker_id}
+        try:
+            op = msg.get("op")
+            timer = StageTimer()
+            t0 = time.perf_counter()
+            if op == "scan":
+                jpeg, result, task = pipeline.scan_image_sync(msg["image"], msg["model"], msg.get("options") or {}, timer)
+                reply.update(result=result, task=task, jpeg=jpeg)
+            elif op == "rethreshold":
+                reply.update(result=pipeline.rethreshold_sweep(**msg["args"]))
+            else:
+                raise ValueError(f"Unknown pool op '{op}'")
+            reply.update(stage_ms=timer.ms, worker_ms=(time.perf_counter() - t0) * 1000.0)
+        except Exception as e:
+            reply.update(error=getattr(e, "detail", None) or str(e), status=getattr(e, "status_code", 500))
+        results.send(reply)
+
+
+# =========================
+# Pool server (one per host)
+# =========================
+
+class _Worker:
+    """One worker process of the pool, with its task / result pipes and the task it is running."""
+
+    def __init__(self, worker_id: int, cores):
+        self.id = worker_id
+        self.cores = cores
+        self.proc = None        # None while waiting to be restarted
+        self.tasks = None       # server -> worker
+        self.results = None     # worker -> server
+        self.ready = False      # models assigned, waiting for a task
+        self.current = None     # {"id", "client"} of the task it is running
+        self.started_at = 0.0
+        self.restart_at = 0.0
+
+
+class PoolServer:
+    def __init__(self, address: str, workers: int, threads_per_worker: int = 0, models=None, authkey: bytes = None):
+        self.address = address
+        self.authkey = authkey or pool_authkey()
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.models = list(models or SHARED_WEIGHT_MODELS)
+        self._conns = {}
+        self._conn_ids = itertools.count()
+        self._lock = threading.Lock()   # _backlog + the workers' ready / current
+        self._backlog = deque()         # tasks waiting for an idle worker
+        self._workers = []
+        self._ctx = None
+        self._shared = None
+        self._stopping = False
+
+    def serve_forever(self):
+        import torch.multiprocessing as tmp
+        # file_system sharing avoids one open fd per shared tensor
+        tmp.set_sharing_strategy("file_system")
+        self._ctx = tmp.get_context("spawn")
+
+        self._shared = load_shared_weights(self.models)
+        self._workers = [_Worker(i, cores) for i, cores in enumerate(core_plan(self.workers, self.threads_per_worker))]
+        for w in self._workers:
+            self._start_worker(w)
+
+        threading.Thread(target=self._supervise, daemon=True).start()
+
+        private_socket_dir(self.address)
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        umask = os.umask(0o177)   # the socket file is created 0600
+        try:
+            listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        logger.info("inference pool listening on %s (shared weights: %s)", self.address, sorted(self._shared))
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, ConnectionError) as e:
+                    # a failed handshake must not take the pool down
+                    logger.warning("rejected inference pool connection: %r", e)
+                    continue
+                cid = next(self._conn_ids)
+                self._conns[cid] = (conn, threading.Lock())
+                threading.Thread(target=self._client_loop, args=(cid, conn), daemon=True).start()
+        finally:
+            self._stopping = True
+            for w in self._workers:
+                if w.proc is not None:
+                    try:
+                        w.tasks.send(None)
+                    except OSError:
+                        pass
+            listener.close()
+
+    # --- workers ---
+
+    def _start_worker(self, w: _Worker):
+        tasks_r, tasks_w = self._ctx.Pipe(duplex=False)
+        results_r, results_w = self._ctx.Pipe(duplex=False)
+        proc = self._ctx.Process(target=_worker_main, args=(w.id, w.cores, self._shared, tasks_r, results_w),
+                                 daemon=True)
+        proc.start()
+        # the child holds its own ends; closing ours lets a dead worker show up as EOF
+        tasks_r.close()
+        results_w.close()
+        w.proc, w.tasks, w.results = proc, tasks_w, results_r
+        w.started_at = time.monotonic()
+        logger.info("inference worker %d: pid=%d cores=%s", w.id, proc.pid, w.cores)
+
+    def _supervise(self):
+        """Read worker results, restart workers that exit and fail the task they were running."""
+        while True:
+            now = time.monotonic()
+            for w in self._workers:
+                if w.proc is None and now >= w.restart_at and not self._stopping:
+                    self._start_worker(w)
+            waits = [w.restart_at - now for w in self._workers if w.proc is None]
+            waitables = {}
+            for w in self._workers:
+                if w.proc is not None:
+                    waitables[w.results] = (w, w.results)
+                    waitables[w.proc.sentinel] = (w, None)
+            for obj in wait(list(waitables), timeout=max(0.0, min(waits)) if waits else None):
+                w, conn = waitables[obj]
+                if conn is None:
+                    if w.proc is not None and obj == w.proc.sentinel:
+                        self._worker_exited(w)
+                elif conn is w.results:
+                    try:
+                        self._on_result(w, conn.recv())
+                    except (EOFError, OSError):
+                        self._worker_exited(w)
+
+    def _on_result(self, w: _Worker, msg):
+        with self._lock:
+            task = w.current
+            w.current = None
+            w.ready = True
+            self._dispatch()
+        if task is not None and "ready" not in msg:
+            self._reply(task["client"], msg)
+
+    def _worker_exited(self, w: _Worker):
+        # a reply sent just before the exit is still delivered
+        try:
+            while w.results.poll():
+                self._on_result(w, w.results.recv())
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            task = w.current
+            w.current = None
+            w.ready = False
+        w.proc.join(timeout=5)
+        exitcode = w.proc.exitcode
+        for conn in (w.tasks, w.results):
+            conn.close()
+        w.proc = w.tasks = w.results = None
+        lived = time.monotonic() - w.started_at
+        w.restart_at = time.monotonic() + (0.0 if lived >= WORKER_MIN_UPTIME_S else WORKER_RESTART_BACKOFF_S)
+        if not self._stopping:
+            logger.error("inference worker %d exited (code %s) after %.0fs; restarting", w.id, exitcode, lived)
+        if task is not None:
+            self._reply(task["client"], {"id": task["id"], "status": 503,
+                                         "error": f"inference worker died (exit code {exitcode}) during this request"})
+
+    def _dispatch(self):
+        """Hand queued tasks to idle workers (caller holds self._lock)."""
+        for w in self._workers:
+            if not self._backlog:
+                return
+            if w.proc is None or not w.ready or w.current is not None:
+                continue
+            msg = self._backlog.popleft()
+            try:
+                w.tasks.send(msg)
+            except OSError:
+                # exited meanwhile: the supervisor restarts it, the task waits for the next worker
+                self._backlog.appendleft(msg)
+                w.ready = False
+                continue
+            w.current = {"id": msg["id"], "client": msg.pop("client")}
+
+    # --- clients ---
+
+    def _client_loop(self, cid, conn):
+        try:
+            while True:
+                msg = conn.recv()
+                if msg.get("op") in INLINE_OPS:
+                    self._reply(cid, self._answer_inline(msg))
+                    continue
+                msg["client"] = cid
+                with self._lock:
+                    self._backlog.append(msg)
+                    self._dispatch()
+        except (EOFError, OSError):
+            self._conns.pop(cid, None)
+
+    def _answer_inline(self, msg):
+        import pipeline
+
+        reply = {"id": msg["id"]}
+        try:
+            if msg["op"] == "models":
+                reply["result"] = pipeline.model_tasks()
+            else:
+                # workers load models lazily; only validate here
+                reply["result"] = pipeline.check_model(**msg["args"], load=False)
+        except Exception as e:
+            reply.update(error=getattr(e, "detail", None) or str(e), status=getattr(e, "status_code", 500))
+        return reply
+
+    def _reply(self, cid, msg):
+        entry = self._conns.get(cid)
+        if entry is None:
+            return
+        conn, lock = entry
+        try:
+            with lock:
+                conn.send(msg)
+        except (EOFError, OSError):
+            pass
+
+
+# =========================
+# Client (inside each API process)
+# =========================
+
+class PoolError(RuntimeError):
+    """Inference failed in (or could not reach) the pool; `status` is the HTTP status to surface."""
+
+    def __init__(self, detail: str, status: int = 503):
+        super().__init__(detail)
+        self.status = status
+
+class PoolClient:
+    def __init__(self, address: str = INFERENCE_POOL_ADDRESS, authkey: bytes = None,
+                 timeout: float = INFERENCE_POOL_TIMEOUT_S):
+        self.address = address
+        self.authkey = authkey or pool_authkey()
+        self.timeout = timeout
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def _connect(self):
+        if self._conn is not None:
+            return self._conn
+        try:
+            self._conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        except (OSError, AuthenticationError) as e:
+            raise PoolError(f"inference pool not reachable at {self.address}: {e!r}")
+        threading.Thread(target=self._read_loop, args=(self._conn,), daemon=True).start()
+        return self._conn
+
+    def _read_loop(self, conn):
+        try:
+            while True:
+                msg = conn.recv()
+                entry = self._pending.pop(msg["id"], None)
+                if entry is None:
+                    continue   # the caller timed out
+                fut, on_reply = entry
+                try:
+                    if msg.get("error"):
+                        fut.set_exception(PoolError(msg["error"], msg.get("status", 500)))
+                    else:
+                        fut.set_result(on_reply(msg))
+                except InvalidStateError:
+                    pass       # the caller was cancelled
+        except (EOFError, OSError):
+            with self._lock:
+                self._conn = None
+            for req_id in list(self._pending):
+                fut, _ = self._pending.pop(req_id)
+                if not fut.done():
+                    fut.set_exception(PoolError("inference pool connection lost"))
+
+    async def _request(self, msg: dict, on_reply):
+        """Send msg and wait for on_reply(reply), at most self.timeout seconds."""
+        msg["id"] = uuid.uuid4().hex
+        fut = Future()
+        self._pending[msg["id"]] = (fut, on_reply)
+        try:
+            with self._lock:
+                self._connect().send(msg)
+        except Exception:
+            self._pending.pop(msg["id"], None)
+            raise
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), self.timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(msg["id"], None)
+            raise PoolError(f"no reply from the inference pool within {self.timeout:g}s", 504)
+
+    @staticmethod
+    def _merge_timer(timer, stage_ms: dict, queue_ms: float):
+        if timer is not None:
+            timer.add("pool_queue", queue_ms)
+            for stage, ms in stage_ms.items():
+                timer.add(stage, ms)
+
+    async def scan(self, image_bytes: bytes, model_name: str, options: dict = None, timer=None):
+        """Same contract as pipeline.scan_image, executed in the pool (no decode in this process)."""
+        t0 = time.perf_counter()
+
+        def on_reply(msg):
+            queue_ms = (time.perf_counter() - t0) * 1000.0 - msg["worker_ms"]
+            return msg["jpeg"], msg["result"], msg["task"], msg["stage_ms"], queue_ms
+
+        msg = {"op": "scan", "model": model_name, "options": options, "image": image_bytes}
+        jpeg, result, task, stage_ms, queue_ms = await self._request(msg, on_reply)
+        self._merge_timer(timer, stage_ms, queue_ms)
+        return jpeg, result, task
+
+    async def call(self, op: str, **args):
+        """"models" / "check" / "rethreshold" -> the op's result."""
+        return await self._request({"op": op, "args": args}, lambda msg: msg["result"])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Shared-memory inference worker pool")
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("INFERENCE_WORKERS", "2")))
+    ap.add_argument("--threads-per-worker", type=int, default=int(os.environ.get("INFERENCE_THREADS_PER_WORKER", "0")),
+                    help="cores (and torch threads) per worker; default splits all cores evenly")
+    ap.add_argument("--models", nargs="*", default=list(SHARED_WEIGHT_MODELS), help="heavy models to share")
+    ap.add_argument("--address", default=INFERENCE_POOL_ADDRESS)
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    PoolServer(args.address, args.workers, args.threads_per_worker, args.models).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+# loadtest.py
+"""
+End-to-end load test of the API against local stand-ins (never production S3 / Atlas).
+
+    pip install "moto[server]" mongomock-motor httpx
+    python loadtest.py --concurrency 8 --duration 60                     # moto S3 + in-memory Mongo
+    python loadtest.py --mongo-uri mongodb://localhost:27017 --models yolo_11n unetpp
+    python loadtest.py --target http://127.0.0.1:8000 --duration 30     # app already running
+
+- S3: a moto server on localhost; the app's boto3 client is pointed at it through
+  AWS_ENDPOINT_URL_S3.
+- Mongo: mongomock-motor inside the app process, or a local mongod via --mongo-uri.
+- Weights: the real ones from MODEL_DIR when all are present, otherwise tiny random
+  ones are generated once into --dummy-dir (U-Nets built with UNET_ENCODER_NAME=resnet18,
+  Mask R-CNN with MASKRCNN_BACKBONE=resnet18).
+- The app runs as a uvicorn subprocess (`python loadtest.py serve`), so inference
+  doesn't share the load generator's event loop.
+
+Traffic is a weighted mix of /login, /upload (cycling through --models),
+/history_paged and /history/bulk_delete from --users seeded accounts. The report
+(per endpoint: throughput, latency percentiles, status counts, error rate) is
+printed and written to --out.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+DEFAULT_OUT = "loadtest_results.json"
+DEFAULT_DUMMY_DIR = "./loadtest_weights"
+DUMMY_UNET_ENCODER = "resnet18"
+DUMMY_MASKRCNN_BACKBONE = "resnet18"
+DEFAULT_MIX = "login=1,upload=3,history=5,delete=1"
+BUCKET = "polyp-loadtest"
+PASSWORD = "loadtest-password"
+
+
+# =========================
+# Stand-ins + app process
+# =========================
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_s3(port: int):
+    """moto S3 server in a thread + the test bucket -> (server, endpoint url)."""
+    import boto3
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    endpoint = f"http://127.0.0.1:{port}"
+    boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1",
+                 aws_access_key_id="testing", aws_secret_access_key="testing").create_bucket(Bucket=BUCKET)
+    return server, endpoint
+
+def generate_dummy_weights(check_only: bool = False):
+    """
+    Subprocess entry (`loadtest.py weights`): random-init weights for every registry
+    model missing from MODEL_DIR, cached between runs. Exit status 1 = some are missing.
+    """
+    import inference   # reads MODEL_DIR / UNET_ENCODER_NAME / MASKRCNN_BACKBONE at import
+
+    missing = [n for n, e in inference.AVAILABLE_MODELS.items() if e.get("weights") and not os.path.exists(e["weights"])]
+    if check_only or not missing:
+        return 1 if missing else 0
+    import torch
+    os.makedirs(inference.MODEL_DIR, exist_ok=True)
+    for name in missing:
+        entry = inference.AVAILABLE_MODELS[name]
+        model = inference.build_untrained(name)
+        if entry["task"] == inference.TASK_DETECTION:
+            model.save(entry["weights"])
+        else:
+            torch.save(model.state_dict(), entry["weights"])
+        print(f"dummy weights: {entry['weights']} ({os.path.getsize(entry['weights']) / 2**20:.1f} MB)")
+    return 0
+
+def _weights_cmd(env: dict, *flags) -> int:
+    return subprocess.call([sys.executable, os.path.abspath(__file__), "weights", *flags],
+                           env={**os.environ, **env}, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+def weights_env(mode: str, dummy_dir: str):
+    """-> (env overrides for the app, "real"|"dummy"). Torch is only imported in subprocesses."""
+    real = {"MODEL_DIR": os.environ.get("MODEL_DIR", "./model")}
+    if mode == "real" or (mode == "auto" and _weights_cmd(real, "--check") == 0):
+        return real, "real"
+    # one subfolder per architecture, so weights cached by another setup are never loaded
+    arch = f"unet-{DUMMY_UNET_ENCODER}_maskrcnn-{DUMMY_MASKRCNN_BACKBONE}"
+    dummy = {"MODEL_DIR": os.path.join(os.path.abspath(dummy_dir), arch), "UNET_ENCODER_NAME": DUMMY_UNET_ENCODER,
+             "MASKRCNN_BACKBONE": DUMMY_MASKRCNN_BACKBONE}
+    if _weights_cmd(dummy) != 0:
+        raise RuntimeError("could not generate dummy weights")
+    return dummy, "dummy"
+
+def start_app(port: int, s3_endpoint: str, mongo_uri: str, extra_env: dict):
+    env = {
+        **os.environ,
+        **extra_env,
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_ENDPOINT_URL_S3": s3_endpoint,
+        "AWS_BUCKET_NAME": BUCKET,
+        "S3_BUCKET": BUCKET,
+        "MONGODB_URI": mongo_uri or "mongodb://mongomock",
+        "LOADTEST_MONGOMOCK": "0" if mongo_uri else "1",
+        "JWT_SECRET_KEY": "loadtest",
+    }
+    env.pop("INFERENCE_POOL_ADDRESS", None)
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", "--port", str(port)],
+                            env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+def serve(port: int):
+    """Subprocess entry: the real app, with Mongo swapped for mongomock when requested."""
+    if os.environ.get("LOADTEST_MONGOMOCK") == "1":
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+    import uvicorn
+    uvicorn.run("main:app", host="127.0.0.1", port=port, log_level="warning")
+
+async def wait_ready(client, proc=None, timeout: float = 300.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"app exited with {proc.returncode}")
+        try:
+            if (await client.get("/models")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("app did not become ready")
+
+
+# =========================
+# Load generator
+# =========================
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)   # endpoint -> [(latency ms, status)]
+
+    async def call(self, label: str, request):
+        t0 = time.perf_counter()
+        status = 0   # transport error
+        try:
+            resp = await request
+            status = resp.status_code
+            return resp
+        except Exception:
+            return None
+        finally:
+            self.samples[label].append(((time.perf_counter() - t0) * 1000.0, status))
+
+def synthetic_jpeg(width: int, height: int, seed: int) -> bytes:
+    """Pinkish noisy frame with a couple of darker blobs (no torch import, unlike benchmark.synthetic_frame)."""
+    import cv2
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), np.uint8)
+    img[...] = (90, 110, 190)   # BGR
+    for _ in range(seed % 3 + 1):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        axes = (int(rng.integers(20, width // 6)), int(rng.integers(20, height // 6)))
+        cv2.ellipse(img, center, axes, float(rng.integers(180)), 0, 360, (60, 80, 160), -1)
+    img = cv2.add(img, rng.integers(0, 25, img.shape, dtype=np.uint8))
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+async def seed_users(client, rec: Recorder, n: int):
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    users = []
+    for i in range(n):
+        email = f"load{i}-{run_id}@example.com"
+        await rec.call("register", client.post("/register", json={"email": email, "password": PASSWORD}))
+        resp = await rec.call("login", client.post("/login", json={"email": email, "password": PASSWORD}))
+        if resp is None or resp.status_code != 200:
+            raise RuntimeError(f"could not seed {email}: {getattr(resp, 'text', 'no response')}")
+        users.append({"email": email, "headers": {"Authorization": f"Bearer {resp.json()['access_token']}"}})
+    return users
+
+async def op_login(client, rec, user, ctx):
+    resp = await rec.call("login", client.post("/login", json={"email": user["email"], "password": PASSWORD}))
+    if resp is not None and resp.status_code == 200:
+        user["headers"] = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+async def op_upload(client, rec, user, ctx):
+    model = next(ctx["models"])
+    files = [("files", (f"frame{i}.jpg", random.choice(ctx["images"]), "image/jpeg"))
+             for i in range(ctx["files_per_upload"])]
+    data = {"patient_name": "Load Test", "patient_id": "LT-0001", "notes": "loadtest", "model_name": model}
+    await rec.call(f"upload[{model}]", client.post("/upload", headers=user["headers"], files=files, data=data))
+
+async def op_history(client, rec, user, ctx):
+    resp = await rec.call("history_paged", client.get("/history_paged", headers=user["headers"], params={"limit": 20}))
+    if resp is not None and resp.status_code == 200 and resp.json().get("next_cursor") and random.random() < 0.3:
+        await rec.call("history_paged", client.get("/history_paged", headers=user["headers"],
+                                                   params={"limit": 20, "cursor": resp.json()["next_cursor"]}))
+
+async def op_delete(client, rec, user, ctx):
+    resp = await rec.call("history_paged", client.get("/history_paged", headers=user["headers"], params={"limit": 20}))
+    if resp is None or resp.status_code != 200:
+        return
+    ids = [it["id"] for it in resp.json().get("items", [])]
+    if ids:
+        ids = random.sample(ids, min(len(ids), ctx["delete_batch"]))
+        await rec.call("bulk_delete", client.post("/history/bulk_delete", headers=user["headers"], json={"ids": ids}))
+
+OPS = {"login": op_login, "upload": op_upload, "history": op_history, "delete": op_delete}
+
+def _parse_mix(raw: str):
+    mix = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPS:
+            raise ValueError(f"unknown op '{name}' (choose from {sorted(OPS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+async def run_load(client, users, mix, ctx, concurrency: int, duration: float, max_requests: int, rec: Recorder):
+    names, weights = list(mix), list(mix.values())
+    deadline = time.monotonic() + duration
+    issued = itertools.count()
+
+    async def worker(i):
+        while time.monotonic() < deadline and next(issued) < max_requests:
+            op = OPS[random.choices(names, weights)[0]]
+            await op(client, rec, users[i % len(users)], ctx)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    return time.perf_counter() - t0
+
+
+# =========================
+# Report
+# =========================
+
+def summarize(samples, elapsed_s: float):
+    out = {}
+    for label, rows in sorted(samples.items()):
+        lat = np.asarray([ms for ms, _ in rows], dtype=np.float64)
+        statuses = Counter(str(st) for _, st in rows)
+        errors = sum(1 for _, st in rows if st == 0 or st >= 400)
+        out[label] = {
+            "n": len(rows),
+            "throughput_per_s": len(rows) / elapsed_s if elapsed_s > 0 else None,
+            "error_rate": errors / len(rows),
+            "status": dict(statuses),
+            "p50_ms": float(np.percentile(lat, 50)),
+            "p90_ms": float(np.percentile(lat, 90)),
+            "p95_ms": float(np.percentile(lat, 95)),
+            "p99_ms": float(np.percentile(lat, 99)),
+            "max_ms": float(lat.max()),
+            "mean_ms": float(lat.mean()),
+        }
+    return out
+
+
+async def main_async(args):
+    import httpx
+
+    procs, s3_server, meta = [], None, {}
+    target = args.target
+    try:
+        if target is None:
+            s3_server, s3_endpoint = start_s3(args.s3_port or _free_port())
+            env, weights = weights_env(args.weights, args.dummy_dir)
+            port = args.port or _free_port()
+            procs.append(start_app(port, s3_endpoint, args.mongo_uri, env))
+            target = f"http://127.0.0.1:{port}"
+            meta.update(s3=s3_endpoint, mongo=args.mongo_uri or "mongomock", weights=weights)
+
+        rec = Recorder()
+        limits = httpx.Limits(max_connections=args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=target, timeout=args.timeout, limits=limits) as client:
+            await wait_ready(client, procs[0] if procs else None)
+            models = args.models or (await client.get("/models")).json()["models"]
+            users = await seed_users(client, rec, args.users)
+            w, h = (int(v) for v in args.resolution.lower().split("x"))
+            ctx = {
+                "models": itertools.cycle(models),
+                "images": [synthetic_jpeg(w, h, seed) for seed in range(4)],
+                "files_per_upload": args.files_per_upload,
+                "delete_batch": args.delete_batch,
+            }
+            # seeding is not part of the measured run
+            rec.samples.clear()
+            elapsed = await run_load(client, users, _parse_mix(args.mix), ctx,
+                                     args.concurrency, args.duration, args.requests or sys.maxsize, rec)
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait(timeout=30)
+        if s3_server is not None:
+            s3_server.stop()
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "target": args.target or "local",
+            "concurrency": args.concurrency,
+            "duration_s": elapsed,
+            "users": args.users,
+            "mix": args.mix,
+            "models": models,
+            "resolution": args.resolution,
+            "files_per_upload": args.files_per_upload,
+            **meta,
+        },
+        "endpoints": summarize(rec.samples, elapsed),
+        "total": summarize({"all": [s for rows in rec.samples.values() for s in rows]}, elapsed).get("all"),
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    for label, st in report["endpoints"].items():
+        print(f"{label:<28} n={st['n']:6d}  {st['throughput_per_s']:7.2f}/s  p50={st['p50_ms']:8.1f}  "
+              f"p95={st['p95_ms']:8.1f}  p99={st['p99_ms']:8.1f} ms  errors={st['error_rate']:.1%}")
+    print(f"wrote {args.out}")
+    return report
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="End-to-end API load test against local S3/Mongo stand-ins")
+    sub = ap.add_subparsers(dest="cmd")
+    sp = sub.add_parser("serve", help="(internal) run the app for the harness")
+    sp.add_argument("--port", type=int, required=True)
+    wp = sub.add_parser("weights", help="(internal) check / generate dummy weights in MODEL_DIR")
+    wp.add_argument("--check", action="store_true")
+
+    ap.add_argument("--target", default=None, help="base URL of an already running app (skips stand-ins)")
+    ap.add_argument("--mongo-uri", default=None, help="local mongod; default: in-memory mongomock")
+    ap.add_argument("--weights", choices=("auto", "real", "dummy"), default="auto")
+    ap.add_argument("--dummy-dir", default=DEFAULT_DUMMY_DIR)
+    ap.add_argument("--port", type=int, default=0)
+    ap.add_argument("--s3-port", type=int, default=0)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds")
+    ap.add_argument("--requests", type=int, default=0, help="stop after this many operations (0: duration only)")
+    ap.add_argument("--users", type=int, default=4)
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="weighted ops: login, upload, history, delete")
+    ap.add_argument("--models", nargs="*", default=None, help="models to upload with (default: all from /models)")
+    ap.add_argument("--resolution", default="640x480")
+    ap.add_argument("--files-per-upload", type=int, default=1)
+    ap.add_argument("--delete-batch", type=int, default=3)
+    ap.add_argument("--timeout", type=float, default=300.0)
+    ap.add_argument("--out", default=DEFAULT_OUT)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "serve":
+        serve(args.port)
+        return 0
+    if args.cmd == "weights":
+        return generate_dummy_weights(args.check)
+    report = asyncio.run(main_async(args))
+    return 1 if report["total"] and report["total"]["error_rate"] > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
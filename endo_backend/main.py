@@ -1,69 +1,44 @@
 # main.py
+import time
+_T_IMPORT = time.perf_counter()   # import/startup time per APP_ROLE (see /healthz)
+
+from contextlib import nullcontext
 from datetime import datetime, timedelta, timezone
-from collections import Counter
-from typing import List
+from typing import List, Optional
 
+import asyncio
+import importlib
 import io
+import logging
 import os
+import sys
 import uuid
-import time
 
-import numpy as np
-from PIL import Image
-
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, Form, File, Query, Body
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, Form, File, Query, Body, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
-from fastapi.middleware.gzip import GZipMiddleware
 
 from dotenv import load_dotenv
 from jose import jwt, JWTError
 from motor.motor_asyncio import AsyncIOMotorClient
 from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr, constr
-from ultralytics import YOLO
-
-# ---- Torch / CV deps ----
-import torch
-import cv2
-from torchvision.transforms import functional as TF
-from torchvision.models.detection import maskrcnn_resnet50_fpn
 from bson import ObjectId
-
-try:
-    import segmentation_models_pytorch as smp
-    _HAS_SMP = True
-except Exception:
-    _HAS_SMP = False
+from pymongo.errors import BulkWriteError
 
 import s3  # project S3 helper module
+import admission
+import metrics
+import profiling
+import inference_pool
+import http_cache
+import http_responses
+from metrics import StageTimer
+from result_schema import RAW_OUTPUT_KEY, RESULT_SCHEMA_VERSION
+from scan_store import ScanStore
 
 
-# =========================
-# Config: weights & params
-# =========================
-
-YOLO_WEIGHTS_9T = "./model/yolo_9t.pt"
-YOLO_WEIGHTS_11N = "./model/yolo_11n.pt"
-
-# Mask R-CNN (torchvision)
-MASKRCNN_WEIGHTS = "./model/maskrcnn_best.pth"
-MASKRCNN_INPUT_SIZE = (256, 256)  # (W,H)
-MASKRCNN_SCORE_THRESH = 0.75
-MASKRCNN_MASK_THRESH = 0.5
-
-# U-Net (SMP)
-UNET_WEIGHTS   = "./model/unet_effb7_adam.pth"
-UNETPP_WEIGHTS = "./model/unetpp_effb7_adam.pth"
-UNET_ENCODER_NAME = "efficientnet-b7"
-UNET_INPUT_SIZE   = (256, 256)  # (W,H)
-UNET_THRESHOLD    = 0.75
-
-
-TASK_DETECTION     = "detection"
-TASK_SEG_INSTANCE  = "segmentation_instance"
-TASK_SEG_SEMANTIC  = "segmentation_semantic"
-RESULT_SCHEMA_VERSION = 2
+logger = logging.getLogger(__name__)
 
 # Datetime UTC+7
 TZ_UTC7 = timezone(timedelta(hours=7))
@@ -71,423 +46,6 @@ def now_utc7():
     return datetime.now(TZ_UTC7)
 
 
-# =========================
-# Model registry (lazy)
-# =========================
-
-AVAILABLE_MODELS = {
-    "yolo_9t":  {"task": TASK_DETECTION, "model": YOLO(YOLO_WEIGHTS_9T)},
-    "yolo_11n": {"task": TASK_DETECTION, "model": YOLO(YOLO_WEIGHTS_11N)},
-    "maskrcnn": {"task": TASK_SEG_INSTANCE, "model": None, "weights": MASKRCNN_WEIGHTS},
-    "unet":     {"task": TASK_SEG_SEMANTIC, "model": None, "weights": UNET_WEIGHTS},
-    "unetpp":   {"task": TASK_SEG_SEMANTIC, "model": None, "weights": UNETPP_WEIGHTS},
-}
-
-# ==== CHANGED: helper to force names -> "polyp"
-def _force_polyp_names(names):
-    try:
-        if isinstance(names, dict):
-            return {k: "polyp" for k in names.keys()}
-        if isinstance(names, (list, tuple)):
-            return ["polyp"] * len(names)
-    except Exception:
-        pass
-    return {0: "polyp"}
-
-for k, v in AVAILABLE_MODELS.items():
-    m = v.get("model")
-    if m is not None and hasattr(m, "eval"):
-        # ==== CHANGED: make YOLO models display "polyp" on overlays by default
-        if v.get("task") == TASK_DETECTION and hasattr(m, "names"):
-            try:
-                m.names = _force_polyp_names(m.names)
-            except Exception:
-                pass
-        m.eval()
-
-def _area_pct_from_det(det, img_w, img_h):
-    """Return % of image covered by the lesion (mask preferred, else bbox)."""
-    if not img_w or not img_h:
-        return None
-    a = det.get("mask_area_px")
-    if a is None:
-        a = det.get("bbox_area_px")
-    if not a:
-        return None
-    return 100.0 * float(a) / float(img_w * img_h)
-
-def _size_class_from_area_pct(area_pct):
-    """Map coverage % to clinically meaningful size bins (proxy for diameter)."""
-    if area_pct is None:
-        return "unknown"
-    if area_pct < 2.0:
-        return "diminutive (≤5 mm est.)"
-    if area_pct < 6.0:
-        return "small (6–9 mm est.)"
-    return "large (≥10 mm est.)"
-
-
-
-# =========================
-# Loaders (lazy)
-# =========================
-
-def load_maskrcnn(weights_path: str):
-    model = maskrcnn_resnet50_fpn(weights=None, num_classes=2)
-    sd = torch.load(weights_path, map_location="cpu")
-    model.load_state_dict(sd, strict=False)
-    model.eval()
-    return model
-
-def load_unet(weights_path: str, use_plusplus: bool = False):
-    if not _HAS_SMP:
-        raise RuntimeError("segmentation_models_pytorch is not installed on the server.")
-    if use_plusplus:
-        model = smp.UnetPlusPlus(
-            encoder_name=UNET_ENCODER_NAME,
-            encoder_weights=None,
-            in_channels=3,
-            classes=1,
-            activation=None,
-        )
-    else:
-        model = smp.Unet(
-            encoder_name=UNET_ENCODER_NAME,
-            encoder_weights=None,
-            in_channels=3,
-            classes=1,
-            activation=None,
-        )
-    sd = torch.load(weights_path, map_location="cpu")
-    model.load_state_dict(sd, strict=False)
-    model.eval()
-    return model
-
-
-def _ensure_loaded(name: str):
-    entry = AVAILABLE_MODELS.get(name)
-    if entry is None:
-        raise HTTPException(status_code=400, detail=f"Unknown or unavailable model '{name}'")
-    if entry["model"] is not None:
-        return
-    if name == "maskrcnn":
-        entry["model"] = load_maskrcnn(entry["weights"])
-    elif name == "unet":
-        entry["model"] = load_unet(entry["weights"], use_plusplus=False)
-    elif name == "unetpp":
-        entry["model"] = load_unet(entry["weights"], use_plusplus=True)
-    else:
-        raise HTTPException(status_code=500, detail=f"Unknown lazy model '{name}'")
-    
-
-# =========================
-# Rendering & result utils
-# =========================
-
-def draw_mask_overlay(
-    rgb_np,
-    mask_bin,
-    fill_color=(0, 222, 255),
-    fill_alpha=0.35,
-    line_color=(0, 222, 255),
-    line_thickness=3,
-    draw_centroid=True,
-):
-    if mask_bin is None or mask_bin.sum() == 0:
-        return rgb_np
-
-    base = rgb_np.copy()
-    color_img = np.zeros_like(base, dtype=np.uint8)
-    color_img[:] = np.array(fill_color, dtype=np.uint8)
-    filled = cv2.addWeighted(base, 1.0 - fill_alpha, color_img, fill_alpha, 0)
-    m3 = mask_bin.astype(bool)[..., None]
-    base = np.where(m3, filled, base)
-
-    cnts, _ = cv2.findContours(mask_bin.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if cnts:
-        cv2.drawContours(base, cnts, -1, line_color, thickness=line_thickness, lineType=cv2.LINE_AA)
-        if draw_centroid:
-            for c in cnts:
-                M = cv2.moments(c)
-                if M["m00"] > 0:
-                    cx = int(M["m10"] / M["m00"])
-                    cy = int(M["m01"] / M["m00"])
-                    cv2.circle(base, (cx, cy), 5, (255, 255, 255), -1, lineType=cv2.LINE_AA)
-                    cv2.circle(base, (cx, cy), 8, (0, 0, 0), 1, lineType=cv2.LINE_AA)
-    return base
-
-def _mask_to_polygons(mask_bin):
-    polys = []
-    cnts, _ = cv2.findContours(mask_bin.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    for c in cnts:
-        if len(c) >= 3:
-            c = c.reshape(-1, 2)
-            polys.append([float(x) for xy in c for x in xy])
-    return polys
-
-def build_summary(dets, img_w, img_h, timing_ms=None):
-    class_counts = Counter([d.get("class_name", "polyp") for d in dets])
-    confs = [d.get("confidence") for d in dets if d.get("confidence") is not None]
-    confs = [c for c in confs if c is not None]
-
-    # ---- Clinical-only distilled view
-    lesions = []
-    area_pcts = []
-    for d in dets:
-        ap = _area_pct_from_det(d, img_w, img_h)
-        area_pcts.append(ap if ap is not None else 0.0)
-        lesions.append({
-            "id": d.get("detection_id"),
-            "confidence": float(d.get("confidence") or 0.0),
-            "size_class": _size_class_from_area_pct(ap),
-            "area_pct": float(ap) if ap is not None else None,
-        })
-    largest_ap = max(area_pcts) if area_pcts else 0.0
-
-    clinical = {
-        "polyp_count": len(dets),
-        "largest_lesion_area_pct": float(largest_ap),
-        "lesions": lesions,
-        # (keep room for future fields like image_quality, NICE-type, etc.)
-    }
-
-    return {
-        "num_detections": len(dets),
-        "class_counts": dict(class_counts),
-        "confidence_mean": float(np.mean(confs)) if confs else 0.0,
-        "confidence_max": float(np.max(confs)) if confs else 0.0,
-        "image_size": {"width": int(img_w or 0), "height": int(img_h or 0)},
-        "time_ms": timing_ms or {},
-        "clinical": clinical,   # ✅ add this
-    }
-
-
-
-# =========================
-# Predictors (per task)
-# =========================
-
-def predict_maskrcnn(model, pil_img, score_thresh: float = MASKRCNN_SCORE_THRESH, mask_thresh: float = MASKRCNN_MASK_THRESH):
-    img = pil_img.convert("RGB")
-    orig_h, orig_w = img.height, img.width
-
-    resized = img.resize(MASKRCNN_INPUT_SIZE, Image.BILINEAR)
-    tensor = TF.to_tensor(resized)
-
-    t0 = time.time()
-    with torch.no_grad():
-        out = model([tensor])[0]
-    infer_ms = {"inference": (time.time() - t0) * 1000.0}
-
-    dets = []
-    union_mask = np.zeros((orig_h, orig_w), dtype=np.uint8)
-
-    scores = out.get("scores")
-    masks  = out.get("masks")
-    labels = out.get("labels")
-
-    if scores is not None and masks is not None:
-        scores = scores.cpu().numpy()
-        masks  = masks.cpu().numpy()
-        labels = labels.cpu().numpy() if labels is not None else np.zeros_like(scores)
-
-        keep = [i for i, s in enumerate(scores) if s >= float(score_thresh)]
-        for i in keep:
-            m_small = masks[i, 0]
-            m_bin_small = (m_small > float(mask_thresh)).astype(np.uint8)
-
-            m_up = cv2.resize(m_bin_small, (orig_w, orig_h), interpolation=cv2.INTER_NEAREST).astype(np.uint8)
-            if m_up.sum() == 0:
-                continue
-
-            union_mask = np.maximum(union_mask, m_up)
-            polys = _mask_to_polygons(m_up)
-            conf = float(scores[i])
-
-            dets.append({
-                "detection_id": len(dets),
-                "class_id": int(labels[i]) if labels is not None else 0,
-                "class_name": "polyp",
-                "confidence": conf,
-                "mask_area_px": int(m_up.sum()),
-                "mask_polygons": polys
-            })
-
-    overlay = draw_mask_overlay(np.array(img), union_mask)
-    summary = build_summary(dets, orig_w, orig_h, timing_ms=infer_ms)
-    result = {
-        "schema": RESULT_SCHEMA_VERSION,
-        "result_meta": {"task": TASK_SEG_INSTANCE},
-        "detections": dets,
-        "summary": summary
-    }
-    return overlay, result
-
-
-def predict_unet(model, pil_img, thresh: float = UNET_THRESHOLD, class_idx: int = 0):
-    """
-    Returns per-lesion (component) detections for semantic segmentation.
-    - Confidence per lesion = mean(prob) within that component
-    - Area uses pixel count of the component at original resolution
-    """
-    img = pil_img.convert("RGB")
-    H, W = img.height, img.width
-    rgb = np.array(img)
-
-    # ----- forward pass on resized image
-    resized = cv2.resize(rgb, UNET_INPUT_SIZE, interpolation=cv2.INTER_LINEAR)
-    x = resized.astype(np.float32) / 255.0
-    x = np.transpose(x, (2, 0, 1))[None, ...]
-    x_t = torch.from_numpy(x)
-
-    with torch.no_grad():
-        out = model(x_t)
-        if isinstance(out, (list, tuple)):
-            out = out[0]
-        if out.shape[1] == 1:
-            probs_small = torch.sigmoid(out)[0, 0].cpu().numpy()
-        else:
-            probs_all = torch.softmax(out, dim=1)[0].cpu().numpy()
-            probs_small = probs_all[class_idx]
-
-    # ----- upsample probabilities & binarize
-    probs = cv2.resize(probs_small, (W, H), interpolation=cv2.INTER_LINEAR)
-    mask_bin = (probs >= float(thresh)).astype(np.uint8)
-
-    # ----- split into connected components (each = 1 polyp)
-    dets = []
-    component_mask = mask_bin.copy()
-    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(component_mask, connectivity=8)
-
-    # label 0 is background
-    for label in range(1, num_labels):
-        area_px = int(stats[label, cv2.CC_STAT_AREA])
-        if area_px <= 0:
-            continue
-
-        comp_bin = (labels == label).astype(np.uint8)
-
-        # per-component confidence = mean prob inside the component
-        comp_probs = probs[labels == label]
-        conf = float(comp_probs.mean()) if comp_probs.size > 0 else 0.0
-
-        # polygons for the component
-        polys = _mask_to_polygons(comp_bin)
-
-        dets.append({
-            "detection_id": len(dets),
-            "class_id": 0,
-            "class_name": "polyp",
-            "confidence": conf,
-            "mask_area_px": area_px,
-            "mask_polygons": polys
-        })
-
-    # overlay still shows the union (nice & simple); keep as-is
-    overlay = draw_mask_overlay(np.array(img), mask_bin)
-
-    summary = build_summary(dets, W, H)
-    result = {
-        "schema": RESULT_SCHEMA_VERSION,
-        "result_meta": {"task": TASK_SEG_SEMANTIC},
-        "detections": dets,
-        "summary": summary
-    }
-    return overlay, result
-
-
-# ==== YOLO -> result dict =====================================================
-
-def _safe_class_name(class_names, cls_id: int):
-    try:
-        if isinstance(class_names, dict):
-            return class_names.get(cls_id, str(cls_id))
-        return class_names[cls_id]
-    except Exception:
-        return str(cls_id)
-
-def _norm_xy_list(xy_list, w: int, h: int):
-    out = []
-    for i, v in enumerate(xy_list):
-        out.append(float(v) / (w if i % 2 == 0 else h))
-    return out
-
-def yolo_result_to_dict(res, class_names):
-    orig_h, orig_w = res.orig_shape[:2] if hasattr(res, "orig_shape") else (None, None)
-    if orig_h is None or orig_w is None:
-        try:
-            orig_h, orig_w = res.orig_img.shape[:2]
-        except Exception:
-            orig_w = orig_w or 0
-            orig_h = orig_h or 0
-
-    dets = []
-
-    boxes = getattr(res, "boxes", None)
-    if boxes is not None and len(boxes) > 0:
-        xyxy = boxes.xyxy.cpu().numpy() if hasattr(boxes.xyxy, "cpu") else boxes.xyxy
-        xywh = boxes.xywh.cpu().numpy() if hasattr(boxes.xywh, "cpu") else boxes.xywh
-        conf = boxes.conf.cpu().numpy() if hasattr(boxes.conf, "cpu") else boxes.conf
-        cls  = boxes.cls.cpu().numpy()  if hasattr(boxes.cls, "cpu")  else boxes.cls
-
-        for i in range(len(xyxy)):
-            x1, y1, x2, y2 = [float(v) for v in xyxy[i].tolist()]
-            cx, cy, bw, bh  = [float(v) for v in xywh[i].tolist()]
-            c  = float(conf[i])
-            ci = int(cls[i])
-
-            # ==== CHANGED: force name to "polyp" (JSON output)
-            # name = _safe_class_name(class_names, ci)
-            name = "polyp"
-
-            bbox_area_px = int(max(bw, 0.0) * max(bh, 0.0))
-            aspect_ratio = float(bw / bh) if bh > 0 else None
-
-            dets.append({
-                "detection_id": i,
-                "class_id": ci,
-                "class_name": name,
-                "confidence": c,
-                "bbox_xyxy": [x1, y1, x2, y2],
-                "bbox_xywh": [cx, cy, bw, bh],
-                "bbox_xyxy_norm": _norm_xy_list([x1, y1, x2, y2], orig_w, orig_h) if orig_w and orig_h else None,
-                "bbox_xywh_norm": [
-                    cx / orig_w if orig_w else None,
-                    cy / orig_h if orig_h else None,
-                    bw / orig_w if orig_w else None,
-                    bh / orig_h if orig_h else None,
-                ],
-                "bbox_area_px": bbox_area_px,
-                "aspect_ratio": aspect_ratio,
-            })
-
-    masks = getattr(res, "masks", None)
-    if masks is not None and getattr(masks, "xy", None):
-        polys_per_det = masks.xy
-        for i, polys in enumerate(polys_per_det):
-            if i >= len(dets):
-                continue
-            flat_polys = []
-            total_area = 0.0
-            for poly in polys:
-                pts = np.asarray(poly, dtype=np.float32).reshape(-1, 2)
-                if pts.shape[0] >= 3:
-                    total_area += float(cv2.contourArea(pts))
-                    flat_polys.append([float(x) for xy in pts for x in xy])
-            if flat_polys:
-                dets[i]["mask_polygons"] = flat_polys
-                dets[i]["mask_area_px"] = int(round(total_area))
-
-    summary = build_summary(dets, orig_w or 0, orig_h or 0)
-    result = {
-        "schema": RESULT_SCHEMA_VERSION,
-        "result_meta": {"task": TASK_DETECTION},
-        "detections": dets,
-        "summary": summary,
-    }
-    return result
-
-
 # ======================
 # FastAPI app + auth/db
 # ======================
@@ -496,10 +54,34 @@ load_dotenv()
 MONGODB_URI = os.environ.get("MONGODB_URI")
 if not MONGODB_URI:
     raise RuntimeError("MONGODB_URI not set in environment.")
-client = AsyncIOMotorClient(MONGODB_URI)
+client = AsyncIOMotorClient(MONGODB_URI, event_listeners=[metrics.MongoCommandTimer()])
 db = client["polyp_detection"]
 scans_collection = db["scans"]
 users_collection = db["users"]
+profiles_collection = db["profiles"]
+counters_collection = db["counters"]
+# one document per finalized S3 key (_id = key): claimed atomically before inference
+upload_claims_collection = db["upload_claims"]
+# scans keep the summary; detections live in scan_details / GridFS (see scan_store.py)
+scan_store = ScanStore(db)
+
+# Process roles:
+#   api        - HTTP only. Never imports torch / cv2 / ultralytics; every frame goes to the
+#                inference pool (INFERENCE_POOL_ADDRESS, default inference_pool.INFERENCE_POOL_ADDRESS;
+#                INFERENCE_POOL_AUTHKEY required).
+#   all        - HTTP + in-process inference (pipeline.py), or the pool when INFERENCE_POOL_ADDRESS is set.
+#   inference  - `python inference_pool.py`, not this app.
+APP_ROLE = os.environ.get("APP_ROLE", "all")
+if APP_ROLE not in ("api", "all"):
+    raise RuntimeError(f"APP_ROLE={APP_ROLE!r}: the web app runs as 'api' or 'all'; "
+                       "the inference role is `python inference_pool.py`.")
+HEAVY_MODULES = ("torch", "torchvision", "cv2", "ultralytics", "segmentation_models_pytorch")
+INFERENCE_POOL_ADDRESS = os.environ.get("INFERENCE_POOL_ADDRESS") or (
+    inference_pool.INFERENCE_POOL_ADDRESS if APP_ROLE == "api" else None
+)
+inference_client = inference_pool.PoolClient(INFERENCE_POOL_ADDRESS) if INFERENCE_POOL_ADDRESS else None
+# the ML stack is only imported when this process runs inference itself
+pipeline = importlib.import_module("pipeline") if inference_client is None else None
 
 app = FastAPI()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
@@ -518,8 +100,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# GZip for smaller JSON payloads
-app.add_middleware(GZipMiddleware, minimum_size=1024)
+# br / zstd / gzip negotiation for JSON payloads; pre-compressed blobs pass through (see http_responses.py)
+app.add_middleware(http_responses.CompressionMiddleware)
+
+# Request count / latency per route template
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        labels = {"method": request.method, "route": metrics.route_label(request), "status": str(status)}
+        metrics.HTTP_REQUESTS_TOTAL.labels(**labels).inc()
+        metrics.HTTP_REQUEST_SECONDS.labels(**labels).observe(time.perf_counter() - t0)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 def hash_password(password: str) -> str:
@@ -558,11 +154,22 @@ class AdminCreateUser(BaseModel):
     is_admin: bool = False
 
 
+@app.on_event("startup")
+async def record_startup():
+    STARTUP["startup_ms"] = (time.perf_counter() - _T_IMPORT) * 1000.0
+    STARTUP["ml_stack_loaded"] = [m for m in HEAVY_MODULES if m in sys.modules]
+    for phase in ("import_ms", "startup_ms"):
+        metrics.PROCESS_STARTUP_SECONDS.labels(role=APP_ROLE, phase=phase[:-3]).set(STARTUP[phase] / 1000.0)
+    logger.info("role=%s import=%.0fms startup=%.0fms ml_stack=%s", APP_ROLE, STARTUP["import_ms"],
+                STARTUP["startup_ms"], STARTUP["ml_stack_loaded"] or "not loaded")
+
 @app.on_event("startup")
 async def setup_indexes():
     # DO NOT create {_id:-1}; Mongo requires _id:1 and creates it automatically.
     # This compound index makes user-scoped, cursor-based pagination fast.
     await scans_collection.create_index([("user_id", 1), ("_id", -1)])
+    # finalize_upload: is this S3 object already a scan? (scans from before upload_claims)
+    await scans_collection.create_index("s3_url")
 
 
 @app.post("/register")
@@ -648,37 +255,62 @@ async def read_profile(current_user: dict = Depends(get_current_user)):
 # ==================
 # History Endpoints
 # ==================
+# Page validators (see http_cache.py): users.history_rev per owner, counters.scans_rev for admin lists
+SCANS_REV_ID = "scans_rev"
+
+async def _bump_history_revs(user_ids):
+    """Call after scans were written/deleted: invalidates these users' pages and all admin pages."""
+    oids = [ObjectId(u) for u in set(user_ids) if ObjectId.is_valid(u)]
+    if oids:
+        await users_collection.update_many({"_id": {"$in": oids}}, {"$inc": {"history_rev": 1}})
+    await counters_collection.update_one({"_id": SCANS_REV_ID}, {"$inc": {"rev": 1}}, upsert=True)
+
+async def _scans_rev() -> int:
+    doc = await counters_collection.find_one({"_id": SCANS_REV_ID})
+    return (doc or {}).get("rev", 0)
+
 # Legacy (heavy) — kept for compatibility
 @app.get("/history")
-async def get_upload_history(current_user: dict = Depends(get_current_user)):
+async def get_upload_history(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    etag = http_cache.page_etag(f"history-all-{current_user['_id']}", current_user.get("history_rev", 0))
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag, http_cache.REVALIDATE)
+    http_cache.set_validators(response, etag, http_cache.REVALIDATE)
     cursor = (
         scans_collection
         .find({"user_id": str(current_user["_id"])})
         .sort("datetime", -1)
     )
     docs = await cursor.to_list(length=1000)
-    return [
+    await scan_store.attach_details_many(docs)
+    return http_responses.json_response([
         {
             "patient_name": d.get("patient_name"),
             "patient_id": d.get("patient_id"),
             "datetime": d.get("datetime"),
-            "s3_url": d.get("s3_url"),
-            "processed_s3_url": d.get("processed_s3_url"),
+            **_browser_urls(d),
             "result": d.get("result"),
             "notes": d.get("notes"),
             "model_used": d.get("model_used"),
             "id": str(d.get("_id")),
         }
         for d in docs
-    ]
+    ], response)
 
 # Paged + summary-only (fast)
 @app.get("/history_paged")
 async def get_upload_history_paged(
+    request: Request,
+    response: Response,
     limit: int = Query(20, ge=1, le=100),
     cursor: str | None = None,
     current_user: dict = Depends(get_current_user),
 ):
+    etag = http_cache.page_etag(f"history-{current_user['_id']}", current_user.get("history_rev", 0))
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag, http_cache.REVALIDATE)
+    http_cache.set_validators(response, etag, http_cache.REVALIDATE)
+
     q = {"user_id": str(current_user["_id"])}
     if cursor:
         try:
@@ -692,6 +324,7 @@ async def get_upload_history_paged(
         "datetime": 1,
         "s3_url": 1,
         "processed_s3_url": 1,
+        "s3_private": 1,
         "model_used": 1,
         "result.summary": 1,
     }
@@ -711,25 +344,158 @@ async def get_upload_history_paged(
             "patient_name": d.get("patient_name"),
             "patient_id": d.get("patient_id"),
             "datetime": d.get("datetime"),
-            "s3_url": d.get("s3_url"),
-            "processed_s3_url": d.get("processed_s3_url"),
+            **_browser_urls(d),
             "model_used": d.get("model_used") or "default",
             "result": {"summary": d.get("result", {}).get("summary", {})},
         })
-    return {"items": items, "next_cursor": next_cursor}
+    return http_responses.json_response({"items": items, "next_cursor": next_cursor}, response)
 
 # Detail on demand
 @app.get("/history/{upload_id}")
-async def get_upload_detail(upload_id: str, current_user: dict = Depends(get_current_user)):
+async def get_upload_detail(
+    upload_id: str,
+    request: Request,
+    response: Response,
+    current_user: dict = Depends(get_current_user),
+):
     try:
         oid = ObjectId(upload_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid id")
-    d = await scans_collection.find_one({"_id": oid, "user_id": str(current_user["_id"])})
+    q = {"_id": oid, "user_id": str(current_user["_id"])}
+
+    # results are immutable: a conditional GET only needs ownership + the URL mode
+    if request.headers.get("if-none-match"):
+        light = await scans_collection.find_one(q, {"s3_private": 1})
+        if not light:
+            raise HTTPException(status_code=404, detail="Not found")
+        private = bool(light.get("s3_private"))
+        etag = http_cache.detail_etag(upload_id, RESULT_SCHEMA_VERSION, private)
+        if http_cache.etag_matches(request, etag):
+            return http_cache.not_modified(etag, http_cache.detail_cache_control(private))
+
+    d = await scans_collection.find_one(q)
     if not d:
         raise HTTPException(status_code=404, detail="Not found")
+    private = bool(d.get("s3_private"))
+    etag = http_cache.detail_etag(upload_id, RESULT_SCHEMA_VERSION, private)
+    cache_control = http_cache.detail_cache_control(private)
+
+    # split scans: the result comes from the blob written at upload time, spliced
+    # into the (small) scan envelope without decompressing or re-serializing it
+    blob, encoding = await scan_store.load_result_blob(d)
+    if blob is not None and http_responses.accepts(request.headers.get("accept-encoding", ""), encoding):
+        envelope = {k: v for k, v in d.items() if k not in ("result", "details")}
+        envelope["_id"] = str(d["_id"])
+        envelope.update(_browser_urls(d))
+        body = http_responses.splice(http_responses.dumps(envelope)[:-1] + b',"result":', blob, b"}", encoding)
+        if body is not None:
+            resp = Response(body, media_type="application/json", headers={"Content-Encoding": encoding})
+            http_cache.set_validators(resp, etag, cache_control)
+            resp.headers["Vary"] = "Authorization, Accept-Encoding"
+            return resp
+
+    http_cache.set_validators(response, etag, cache_control)
+    if blob is not None:
+        d["result"] = http_responses.loads(http_responses.decompress(blob, encoding))
+    else:
+        await scan_store.attach_details(d)
+    d.pop("details", None)
     d["_id"] = str(d["_id"])
-    return d
+    d.update(_browser_urls(d))
+    return http_responses.json_response(d, response)
+
+# Result only: no URLs, so it is immutable and served from the blob written at upload time
+@app.get("/history/{upload_id}/result")
+async def get_upload_result(
+    upload_id: str,
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+):
+    try:
+        oid = ObjectId(upload_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid id")
+    q = {"_id": oid, "user_id": str(current_user["_id"])}
+    etag = http_cache.result_etag(upload_id, RESULT_SCHEMA_VERSION)
+
+    if http_cache.etag_matches(request, etag):
+        if not await scans_collection.find_one(q, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Not found")
+        return http_cache.not_modified(etag, http_cache.IMMUTABLE)
+
+    d = await scans_collection.find_one(q, {"result": 1, "details": 1})
+    if not d:
+        raise HTTPException(status_code=404, detail="Not found")
+    blob, encoding = await scan_store.load_result_blob(d)
+    if blob is None:
+        # inline / pre-split scans: serialize as usual
+        await scan_store.attach_details(d)
+        resp = http_responses.json_response(d.get("result") or {})
+    elif http_responses.accepts(request.headers.get("accept-encoding", ""), encoding):
+        resp = Response(blob, media_type="application/json", headers={"Content-Encoding": encoding})
+    else:
+        resp = Response(http_responses.decompress(blob, encoding), media_type="application/json")
+    http_cache.set_validators(resp, etag, http_cache.IMMUTABLE)
+    resp.headers["Vary"] = "Authorization, Accept-Encoding"
+    return resp
+
+# Re-threshold from the raw output stored at upload (U-Net prob map / Mask R-CNN instances)
+RETHRESHOLD_MAX = 16
+
+class RethresholdPayload(BaseModel):
+    thresholds: List[float]                 # prob threshold (U-Nets) or score threshold (Mask R-CNN)
+    mask_threshold: Optional[float] = None  # Mask R-CNN only
+    overlay: bool = False                   # render thresholds[0] onto the original
+
+@app.post("/history/{upload_id}/rethreshold")
+async def rethreshold_upload(
+    upload_id: str,
+    payload: RethresholdPayload,
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Detections + summary for one or more other thresholds without re-running the
+    model. Not saved: the scan keeps its original result.
+    """
+    try:
+        oid = ObjectId(upload_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid id")
+    thresholds = list(payload.thresholds)
+    checked = thresholds + ([payload.mask_threshold] if payload.mask_threshold is not None else [])
+    if not thresholds or len(thresholds) > RETHRESHOLD_MAX or not all(0.0 < t < 1.0 for t in checked):
+        raise HTTPException(status_code=400, detail=f"Give 1-{RETHRESHOLD_MAX} thresholds, each in (0, 1).")
+
+    q = {"_id": oid, "user_id": str(current_user["_id"])}
+    d = await scans_collection.find_one(q, {"raw_output": 1, "result.summary.image_size": 1, "s3_url": 1, "model_used": 1})
+    if not d:
+        raise HTTPException(status_code=404, detail="Not found")
+    row = await scan_store.load_raw(d)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"No stored model output for this scan ({d.get('model_used')}).")
+
+    size = d["result"]["summary"]["image_size"]
+    t0 = time.perf_counter()
+    args = dict(row=row, img_w=size["width"], img_h=size["height"], thresholds=thresholds,
+                mask_threshold=payload.mask_threshold, image_bytes=None)
+    if payload.overlay:
+        args["image_bytes"] = await asyncio.to_thread(s3.get_object_bytes, s3.key_from_url(d.get("s3_url")))
+    if pipeline is not None:
+        results, overlay = await asyncio.to_thread(pipeline.rethreshold_sweep, **args)
+    else:
+        try:
+            results, overlay = await inference_client.call("rethreshold", **args)
+        except inference_pool.PoolError as e:
+            raise HTTPException(status_code=e.status, detail=str(e))
+    return http_responses.json_response({
+        "id": upload_id,
+        "model": d.get("model_used"),
+        "kind": row["kind"],
+        "results": results,
+        "overlay": overlay,
+        "time_ms": (time.perf_counter() - t0) * 1000.0,
+    })
 
 # User bulk delete (Mongo + S3) — deletes only the caller’s docs
 class BulkDeletePayload(BaseModel):
@@ -779,11 +545,14 @@ async def user_bulk_delete_uploads(
 
     # Load only caller-owned docs to enforce ownership and to collect S3 urls
     q = {"_id": {"$in": oid_list}, "user_id": str(current_user["_id"])}
-    cursor = scans_collection.find(q, {"s3_url": 1, "processed_s3_url": 1})
+    cursor = scans_collection.find(q, {"s3_url": 1, "processed_s3_url": 1, "details": 1})
     urls = []
+    found = []
     async for d in cursor:
+        found.append(d)
         if d.get("s3_url"): urls.append(d["s3_url"])
-        if d.get("processed_s3_url"): urls.append(d["processed_s3_url"])
+        # gated scans point processed_s3_url at the original
+        if d.get("processed_s3_url") and d["processed_s3_url"] != d.get("s3_url"): urls.append(d["processed_s3_url"])
 
     s3_deleted = 0
     for url in urls:
@@ -791,113 +560,335 @@ async def user_bulk_delete_uploads(
             s3_deleted += 1
 
     res = await scans_collection.delete_many(q)
+    await scan_store.delete_details(found)
+    await scan_store.delete_raw(found)
+    if res.deleted_count:
+        await _bump_history_revs([str(current_user["_id"])])
     return {"deleted_count": res.deleted_count, "s3_deleted": s3_deleted}
 
 
 # ==============================
 # Upload (with model selection)
 # ==============================
+# frames per /upload or /upload/finalize call (one admission ticket); the frontend
+# finalizes larger selections in batches of this size (presign returns it)
+MAX_FILES_PER_UPLOAD = int(os.environ.get("MAX_FILES_PER_UPLOAD", "10"))
+MAX_PRESIGN_FILES = int(os.environ.get("MAX_PRESIGN_FILES", "500"))   # signing is cheap; just bounded
+
+def _processed_key(key: str) -> str:
+    head, _, name = key.rpartition("/")
+    return f"{head}/processed_{name}" if head else f"processed_{name}"
+
+def _browser_urls(d: dict) -> dict:
+    """Loadable image URLs: cached presigned GETs for private objects, stored URLs for legacy public ones."""
+    urls = {"s3_url": d.get("s3_url"), "processed_s3_url": d.get("processed_s3_url")}
+    if d.get("s3_private"):
+        for field, url in urls.items():
+            key = s3.key_from_url(url)
+            if key:
+                urls[field] = s3.object_url(key)
+    return urls
+
+async def _check_model(model_name: str, ensemble_members: str = "", cascade_heavy: str = "", want_masks: bool = False,
+                       gate: Optional[bool] = None, profile: str = ""):
+    """Validate the model choice up front -> inference options (see pipeline.check_model)."""
+    args = dict(model_name=model_name, ensemble_members=ensemble_members, cascade_heavy=cascade_heavy,
+                want_masks=want_masks, gate=gate, profile=profile)
+    if pipeline is not None:
+        return pipeline.check_model(**args)
+    try:
+        return await inference_client.call("check", **args)
+    except inference_pool.PoolError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
+
+async def _scan_frame(image_bytes: bytes, s3_key: str, scan_meta: dict, model_name: str,
+                      options: dict, current_user: dict, timer: StageTimer, ticket: admission.Ticket,
+                      profile: Optional[profiling.RequestProfile] = None):
+    """
+    decode -> inference -> render/encode -> S3 put, for one frame already stored at s3_key
+    -> (scan doc to insert, result dict, task). _scan_batch inserts the docs in one batch.
+    Everything up to the overlay JPEG runs in pipeline.scan_image, here or in the pool.
+    """
+    # fair share of the model's inference slots (see admission.py); in-process
+    # inference runs in a worker thread so other frames can hold the other slots
+    async with ticket.slot(timer):
+        if pipeline is not None:
+            # the request profile samples the worker thread too (profiling.py)
+            scan = pipeline.scan_image_sync if profile is None else profile.in_thread(pipeline.scan_image_sync)
+            jpeg, result_dict, task = await asyncio.to_thread(scan, image_bytes, model_name, options, timer)
+        else:
+            try:
+                jpeg, result_dict, task = await inference_client.scan(image_bytes, model_name, options, timer=timer)
+            except inference_pool.PoolError as e:
+                raise HTTPException(status_code=e.status, detail=str(e))
+    gate = result_dict["result_meta"].get("gate")
+    if gate is not None:
+        metrics.GATE_DECISIONS.labels(decision=gate["decision"]).inc()
+    # low-res model output for /rethreshold: stored apart from the result (scan_store)
+    raw_output = result_dict.pop(RAW_OUTPUT_KEY, None)
+
+    if jpeg is None:
+        # gated: the original doubles as the "processed" image
+        processed_s3_url = s3.public_url(s3_key)
+    else:
+        with timer.stage("s3_put"):
+            processed_s3_url = await asyncio.to_thread(s3.upload_to_s3, io.BytesIO(jpeg), _processed_key(s3_key))
+
+    now = now_utc7()
+    result_dict["summary"]["time_ms"] = dict(timer.ms)
+
+    doc = {
+        "user_id": str(current_user["_id"]),
+        "user_email": current_user["email"],
+        "patient_name": scan_meta["patient_name"],
+        "patient_id": scan_meta["patient_id"],
+        "datetime":  now.isoformat(timespec="seconds"),
+        "filename": s3_key.rpartition("/")[2],
+        "s3_url": s3.public_url(s3_key),
+        "processed_s3_url": processed_s3_url,
+        "s3_private": not s3.S3_PUBLIC_READ,
+        "result": result_dict,
+        "notes": scan_meta["notes"],
+        "model_used": model_name
+    }
+    if raw_output is not None:
+        doc[RAW_OUTPUT_KEY] = raw_output
+    return doc, result_dict, task
+
+async def _store_scans(scanned, model_name: str, user_id: str):
+    """One insert_many (scans + details) for every frame of an upload."""
+    t0 = time.perf_counter()
+    await scan_store.insert_many([doc for doc, _, _, _ in scanned])
+    insert_ms = (time.perf_counter() - t0) * 1000.0
+    await _bump_history_revs([user_id])
+    # db_insert can't be stored in the doc it times; it is reported in the response + metrics
+    for _, result_dict, task, timer in scanned:
+        timer.add("db_insert", insert_ms)
+        result_dict["summary"]["time_ms"] = timer.ms
+        timer.observe(model_name, task)
+
+async def _scan_batch(request: Request, response: Response, loaders, scan_meta: dict,
+                      model_name: str, options: dict, current_user: dict):
+    """
+    Run _scan_frame for each loader (async timer -> (image_bytes, s3_key)) and store
+    the scans in one batch, under the optional request profile. Uploads over the
+    admission limits get 429 + Retry-After before any frame is read.
+    """
+    # may 403: decided before anything is admitted
+    profile = profiling.for_request(request, current_user)
+    try:
+        ticket = admission.controller.admit(model_name, str(current_user["_id"]), len(loaders))
+    except admission.AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy ({e.reason}), retry in {e.retry_after}s.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    scanned = []
+
+    # the ticket and the queue gauge are released on every exit path
+    with ticket, profile or nullcontext():
+        pending = len(loaders)
+        metrics.UPLOAD_QUEUE_DEPTH.inc(pending)
+        try:
+            for load in loaders:
+                timer = StageTimer()
+                image_bytes, s3_key = await load(timer)
+                doc, result_dict, task = await _scan_frame(
+                    image_bytes, s3_key, scan_meta, model_name, options, current_user, timer, ticket, profile
+                )
+                scanned.append((doc, result_dict, task, timer))
+                pending -= 1
+                metrics.UPLOAD_QUEUE_DEPTH.dec()
+        finally:
+            metrics.UPLOAD_QUEUE_DEPTH.dec(pending)
+            # frames finished before a failure are still stored, as before batching
+            if scanned:
+                await _store_scans(scanned, model_name, str(current_user["_id"]))
+
+    upload_results = [
+        {**_browser_urls(doc), "result": result_dict, "model": model_name}
+        for doc, result_dict, _, _ in scanned
+    ]
+
+    if profile is not None:
+        profile.meta = {"model_name": model_name, "files": len(loaders)}
+        profile_id = await profiling.save(profile, profiles_collection)
+        if profile_id:
+            response.headers["X-Profile-Id"] = profile_id
+
+    return http_responses.json_response({
+        "message": f"{len(upload_results)} files uploaded and scanned successfully with {model_name} model.",
+        "results": upload_results
+    }, response)
+
+
 @app.post("/upload")
 async def upload(
+    request: Request,
+    response: Response,
     files: List[UploadFile] = File(...),
     patient_name: str = Form(...),
     patient_id: str = Form(...),
     notes: str = Form(""),
     model_name: str = Form("yolo_9t"),
+    ensemble_members: str = Form(""),
+    cascade_heavy: str = Form(""),
+    want_masks: bool = Form(False),
+    gate: Optional[bool] = Form(None),
+    profile: str = Form(""),
     current_user: dict = Depends(get_current_user)
 ):
-    if model_name not in AVAILABLE_MODELS:
-        raise HTTPException(status_code=400, detail="Unknown model selected")
-
-    _ensure_loaded(model_name)
-    task = AVAILABLE_MODELS[model_name]["task"]
-    model = AVAILABLE_MODELS[model_name]["model"]
-
-    upload_results = []
-
-    for file in files:
-        unique_filename = f"{uuid.uuid4()}_{file.filename}"
-        image_bytes = await file.read()
-
-        s3_url = s3.upload_to_s3(io.BytesIO(image_bytes), unique_filename)
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-
-        if task == TASK_DETECTION:
-            # ==== CHANGED: ensure model + result names are "polyp" so res.plot() uses it
-            if hasattr(model, "names"):
+    if not files or len(files) > MAX_FILES_PER_UPLOAD:
+        raise HTTPException(status_code=400, detail=f"Between 1 and {MAX_FILES_PER_UPLOAD} files per upload")
+    options = await _check_model(model_name, ensemble_members, cascade_heavy, want_masks, gate, profile)
+
+    def loader(file):
+        async def load(timer):
+            unique_filename = f"{uuid.uuid4()}_{file.filename}"
+            with timer.stage("read"):
+                image_bytes = await file.read()
+            with timer.stage("s3_put"):
+                await asyncio.to_thread(s3.upload_to_s3, io.BytesIO(image_bytes), unique_filename)
+            return image_bytes, unique_filename
+        return load
+
+    scan_meta = {"patient_name": patient_name, "patient_id": patient_id, "notes": notes}
+    return await _scan_batch(request, response, [loader(f) for f in files], scan_meta, model_name, options, current_user)
+
+
+# Direct-to-S3: presign -> browser POSTs to S3 -> finalize (backend pulls + infers)
+class PresignFile(BaseModel):
+    filename: constr(min_length=1, max_length=200)
+    content_type: str = "image/jpeg"
+
+class PresignPayload(BaseModel):
+    files: list[PresignFile]
+
+class FinalizePayload(BaseModel):
+    keys: list[str]
+    patient_name: str
+    patient_id: str
+    notes: str = ""
+    model_name: str = "yolo_9t"
+    ensemble_members: str = ""
+    cascade_heavy: str = ""
+    want_masks: bool = False
+    gate: Optional[bool] = None   # None -> FRAME_GATE default
+    profile: str = ""             # YOLO inference profile, "" -> YOLO_PROFILE default
+
+def _user_upload_prefix(current_user: dict) -> str:
+    return f"uploads/{current_user['_id']}/"
+
+async def _claim_keys(keys: list, user_id: str):
+    """
+    Insert one upload_claims doc per key (_id = key), or 409 if any key was already
+    claimed by an earlier or concurrent finalize, in any process. Atomic per key via
+    the _id index; claims inserted before the duplicate are removed again.
+    """
+    claims = [{"_id": k, "user_id": user_id, "created_at": datetime.utcnow()} for k in keys]
+    try:
+        await upload_claims_collection.insert_many(claims, ordered=True)
+    except BulkWriteError as e:
+        inserted = e.details.get("nInserted", 0)
+        if inserted:
+            await upload_claims_collection.delete_many({"_id": {"$in": keys[:inserted]}})
+        if all(err.get("code") == 11000 for err in e.details.get("writeErrors", [])):
+            raise HTTPException(status_code=409, detail="Upload already finalized")
+        raise
+
+async def _release_unscanned_claims(keys: list):
+    """After a failed finalize: keys that did not become a scan can be finalized again."""
+    scanned = set(await scans_collection.distinct("s3_url", {"s3_url": {"$in": [s3.public_url(k) for k in keys]}}))
+    retry = [k for k in keys if s3.public_url(k) not in scanned]
+    if retry:
+        await upload_claims_collection.delete_many({"_id": {"$in": retry}})
+
+@app.post("/upload/presign")
+async def presign_upload(payload: PresignPayload, current_user: dict = Depends(get_current_user)):
+    if not payload.files or len(payload.files) > MAX_PRESIGN_FILES:
+        raise HTTPException(status_code=400, detail=f"Between 1 and {MAX_PRESIGN_FILES} files per presign")
+    uploads = []
+    for f in payload.files:
+        if not f.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail=f"Not an image: {f.filename}")
+        name = os.path.basename(f.filename.replace("\\", "/"))
+        key = f"{_user_upload_prefix(current_user)}{uuid.uuid4()}_{name}"
+        post = s3.generate_presigned_post(key, f.content_type)
+        uploads.append({"key": key, "url": post["url"], "fields": post["fields"]})
+    return {"uploads": uploads, "expires_in": s3.PRESIGNED_POST_TTL, "max_bytes": s3.UPLOAD_MAX_BYTES,
+            "max_files": MAX_FILES_PER_UPLOAD}
+
+@app.post("/upload/finalize")
+async def finalize_upload(
+    request: Request,
+    response: Response,
+    payload: FinalizePayload,
+    current_user: dict = Depends(get_current_user),
+):
+    options = await _check_model(payload.model_name, payload.ensemble_members, payload.cascade_heavy, payload.want_masks,
+                                 payload.gate, payload.profile)
+    if not payload.keys or len(payload.keys) > MAX_FILES_PER_UPLOAD:
+        raise HTTPException(status_code=400, detail=f"Between 1 and {MAX_FILES_PER_UPLOAD} files per upload")
+    prefix = _user_upload_prefix(current_user)
+    for key in payload.keys:
+        if not key.startswith(prefix) or "/processed_" in key:
+            raise HTTPException(status_code=403, detail="Not your upload")
+    # one S3 object per scan: deleting a scan deletes its objects
+    if len(set(payload.keys)) != len(payload.keys):
+        raise HTTPException(status_code=409, detail="Upload already finalized")
+    if await scans_collection.find_one({"s3_url": {"$in": [s3.public_url(k) for k in payload.keys]}}, {"_id": 1}):
+        raise HTTPException(status_code=409, detail="Upload already finalized")
+
+    def loader(key):
+        async def load(timer):
+            with timer.stage("s3_get"):
                 try:
-                    model.names = _force_polyp_names(model.names)
-                except Exception:
-                    pass
-
-            preds = model.predict(image, verbose=False, iou=0.3)
-            res = preds[0]
-
-            try:
-                res.names = _force_polyp_names(getattr(res, "names", getattr(model, "names", {})))
-            except Exception:
-                pass
-
-            result_dict = yolo_result_to_dict(res, res.names)
-
-            rendered_bgr = res.plot()  # BGR
-            rendered_rgb = cv2.cvtColor(rendered_bgr, cv2.COLOR_BGR2RGB)
-            processed_img = Image.fromarray(rendered_rgb)
-
-        elif task == TASK_SEG_INSTANCE:
-            overlay_np, result_dict = predict_maskrcnn(model, image)
-            processed_img = Image.fromarray(overlay_np)
-
-        elif task == TASK_SEG_SEMANTIC:
-            overlay_np, result_dict = predict_unet(model, image)
-            processed_img = Image.fromarray(overlay_np)
-
-        else:
-            raise HTTPException(status_code=500, detail=f"Unsupported task: {task}")
-
-        result_dict["result_meta"]["model_name"] = model_name
-
-        buffer = io.BytesIO()
-        processed_img.save(buffer, format="JPEG")
-        buffer.seek(0)
-        processed_s3_url = s3.upload_to_s3(buffer, "processed_" + unique_filename)
-
-        now = now_utc7()
-
-        doc = {
-            "user_id": str(current_user["_id"]),
-            "user_email": current_user["email"],
-            "patient_name": patient_name,
-            "patient_id": patient_id,
-            "datetime":  now.isoformat(timespec="seconds"),
-            "filename": unique_filename,
-            "s3_url": s3_url,
-            "processed_s3_url": processed_s3_url,
-            "result": result_dict,
-            "notes": notes,
-            "model_used": model_name
-        }
-        await scans_collection.insert_one(doc)
-
-        upload_results.append({
-            "s3_url": s3_url,
-            "processed_s3_url": processed_s3_url,
-            "result": result_dict,
-            "model": model_name
-        })
-
-    return {
-        "message": f"{len(upload_results)} files uploaded and scanned successfully with {model_name} model.",
-        "results": upload_results
-    }
+                    image_bytes = await asyncio.to_thread(s3.get_object_bytes, key)
+                except s3.client().exceptions.NoSuchKey:
+                    raise HTTPException(status_code=404, detail=f"Upload not found: {key}")
+                except ValueError as e:
+                    raise HTTPException(status_code=413, detail=str(e))
+            return image_bytes, key
+        return load
+
+    scan_meta = {"patient_name": payload.patient_name, "patient_id": payload.patient_id, "notes": payload.notes}
+    await _claim_keys(payload.keys, str(current_user["_id"]))
+    try:
+        return await _scan_batch(request, response, [loader(k) for k in payload.keys], scan_meta,
+                                 payload.model_name, options, current_user)
+    except Exception:
+        await _release_unscanned_claims(payload.keys)
+        raise
 
 
 # ===============
 # Models/meta
 # ===============
+_model_tasks = None
+
 @app.get("/models")
 async def get_models():
-    return {"models": list(AVAILABLE_MODELS.keys())}
+    global _model_tasks
+    if _model_tasks is None:
+        if pipeline is not None:
+            _model_tasks = pipeline.model_tasks()
+        else:
+            try:
+                _model_tasks = await inference_client.call("models")
+            except inference_pool.PoolError as e:
+                raise HTTPException(status_code=e.status, detail=str(e))
+    return {"models": list(_model_tasks)}
+
+@app.get("/healthz")
+async def healthz():
+    """Process role and how long it took to import / start (no DB or pool round trip)."""
+    return {"role": APP_ROLE, "inference": "pool" if pipeline is None else "in-process", **STARTUP}
+
+@app.get("/metrics")
+async def get_metrics():
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
 
 
 # ======================
@@ -915,6 +906,11 @@ async def get_admin_stats(current_user: dict = Depends(admin_required)):
     total_uploads = await scans_collection.count_documents({})
     return {"total_users": total_users, "total_uploads": total_uploads}
 
+@app.get("/admin/admission")
+async def get_admission_stats(current_user: dict = Depends(admin_required)):
+    """Admission lanes of this API process: limits, running / queued frames, 429s so far."""
+    return admission.controller.stats()
+
 @app.get("/admin/users")
 async def get_all_users(current_user: dict = Depends(admin_required)):
     cursor = users_collection.find({}, {"hashed_password": 0})
@@ -957,21 +953,33 @@ async def delete_user(user_id: str, current_user: dict = Depends(admin_required)
 
 # Legacy (heavy) — kept for existing UI
 @app.get("/admin/uploads")
-async def admin_get_all_uploads(current_user: dict = Depends(admin_required)):
-    cursor = scans_collection.find()
-    uploads = []
-    async for upload in cursor:
+async def admin_get_all_uploads(request: Request, response: Response, current_user: dict = Depends(admin_required)):
+    etag = http_cache.page_etag("admin-all", await _scans_rev())
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag, http_cache.REVALIDATE)
+    http_cache.set_validators(response, etag, http_cache.REVALIDATE)
+    uploads = await scans_collection.find().to_list(length=None)
+    await scan_store.attach_details_many(uploads)
+    for upload in uploads:
+        upload.pop("details", None)
         upload["_id"] = str(upload["_id"])
-        uploads.append(upload)
-    return uploads
+        upload.update(_browser_urls(upload))
+    return http_responses.json_response(uploads, response)
 
 # Paged + summary-only for dashboard
 @app.get("/admin/uploads_paged")
 async def admin_get_uploads_paged(
+    request: Request,
+    response: Response,
     limit: int = Query(50, ge=1, le=200),
     cursor: str | None = None,
     _admin = Depends(admin_required),
 ):
+    etag = http_cache.page_etag("admin", await _scans_rev())
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag, http_cache.REVALIDATE)
+    http_cache.set_validators(response, etag, http_cache.REVALIDATE)
+
     q = {}
     if cursor:
         try:
@@ -985,6 +993,7 @@ async def admin_get_uploads_paged(
         "datetime": 1,
         "s3_url": 1,
         "processed_s3_url": 1,
+        "s3_private": 1,
         "result.summary": 1,
     }
     cur = scans_collection.find(q, proj).sort("_id", -1).limit(limit + 1)
@@ -1002,11 +1011,10 @@ async def admin_get_uploads_paged(
             "patient_name": d.get("patient_name"),
             "user_email": d.get("user_email"),
             "datetime": d.get("datetime"),
-            "s3_url": d.get("s3_url"),
-            "processed_s3_url": d.get("processed_s3_url"),
+            **_browser_urls(d),
             "result": {"summary": d.get("result", {}).get("summary", {})},
         })
-    return {"items": items, "next_cursor": next_cursor}
+    return http_responses.json_response({"items": items, "next_cursor": next_cursor}, response)
 
 @app.post("/admin/uploads/bulk_delete")
 async def admin_bulk_delete_uploads(
@@ -1026,11 +1034,14 @@ async def admin_bulk_delete_uploads(
         return {"deleted_count": 0, "s3_deleted": 0}
 
     # fetch docs to get S3 URLs
-    docs = scans_collection.find({"_id": {"$in": oid_list}}, {"s3_url": 1, "processed_s3_url": 1})
+    docs = scans_collection.find({"_id": {"$in": oid_list}}, {"s3_url": 1, "processed_s3_url": 1, "details": 1, "user_id": 1})
     urls = []
+    found = []
     async for d in docs:
+        found.append(d)
         if d.get("s3_url"): urls.append(d["s3_url"])
-        if d.get("processed_s3_url"): urls.append(d["processed_s3_url"])
+        # gated scans point processed_s3_url at the original
+        if d.get("processed_s3_url") and d["processed_s3_url"] != d.get("s3_url"): urls.append(d["processed_s3_url"])
 
     s3_deleted = 0
     for url in urls:
@@ -1038,4 +1049,56 @@ async def admin_bulk_delete_uploads(
             s3_deleted += 1
 
     res = await scans_collection.delete_many({"_id": {"$in": oid_list}})
+    await scan_store.delete_details(found)
+    await scan_store.delete_raw(found)
+    if res.deleted_count:
+        await _bump_history_revs([d.get("user_id") for d in found if d.get("user_id")])
     return {"deleted_count": res.deleted_count, "s3_deleted": s3_deleted}
+
+
+# Request profiles (see profiling.py)
+@app.get("/admin/profiles")
+async def admin_list_profiles(
+    limit: int = Query(50, ge=1, le=200),
+    _admin = Depends(admin_required),
+):
+    proj = {"text": 0, "speedscope_gz": 0, "top_ops": 0}
+    cur = profiles_collection.find({}, proj).sort("_id", -1).limit(limit)
+    items = []
+    async for d in cur:
+        d["_id"] = str(d["_id"])
+        items.append(d)
+    return {"items": items}
+
+@app.get("/admin/profiles/{profile_id}")
+async def admin_get_profile(profile_id: str, _admin = Depends(admin_required)):
+    try:
+        oid = ObjectId(profile_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid id")
+    d = await profiles_collection.find_one({"_id": oid}, {"speedscope_gz": 0})
+    if not d:
+        raise HTTPException(status_code=404, detail="Not found")
+    d["_id"] = str(d["_id"])
+    return d
+
+@app.get("/admin/profiles/{profile_id}/speedscope")
+async def admin_get_profile_speedscope(profile_id: str, _admin = Depends(admin_required)):
+    """Open the downloaded file at https://www.speedscope.app for a flamegraph."""
+    try:
+        oid = ObjectId(profile_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid id")
+    d = await profiles_collection.find_one({"_id": oid}, {"speedscope_gz": 1})
+    body = profiling.speedscope_json(d) if d else None
+    if not body:
+        raise HTTPException(status_code=404, detail="Not found")
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.speedscope.json"'},
+    )
+
+
+# module fully imported: every route and dependency above is loaded
+STARTUP = {"import_ms": (time.perf_counter() - _T_IMPORT) * 1000.0}
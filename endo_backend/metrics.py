@@ -0,0 +1,138 @@
+# metrics.py
+"""Per-stage timers for the upload pipeline and Prometheus metrics (/metrics)."""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from pymongo import monitoring
+
+
+# Stage latencies range from sub-ms (summary) to seconds (EfficientNet-B7 on CPU)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram(
+    "polyp_stage_seconds",
+    "Upload pipeline stage latency",
+    ["model", "task", "stage"],
+    buckets=STAGE_BUCKETS,
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "polyp_http_request_seconds",
+    "HTTP request latency",
+    ["method", "route", "status"],
+    buckets=STAGE_BUCKETS,
+)
+HTTP_REQUESTS_TOTAL = Counter(
+    "polyp_http_requests_total",
+    "HTTP requests",
+    ["method", "route", "status"],
+)
+UPLOAD_QUEUE_DEPTH = Gauge(
+    "polyp_upload_queue_depth",
+    "Frames accepted by upload endpoints and not yet finished",
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "polyp_admission_queue_depth",
+    "Frames waiting for an inference slot",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "polyp_admission_wait_seconds",
+    "Time a frame waited for an inference slot",
+    ["model", "klass"],
+    buckets=STAGE_BUCKETS,
+)
+ADMISSION_REJECTED = Counter(
+    "polyp_admission_rejected_total",
+    "Uploads answered with 429 (busy / user_limit)",
+    ["model", "reason"],
+)
+GATE_DECISIONS = Counter(
+    "polyp_frame_gate_decisions_total",
+    "Frame gate outcomes (pass / blurry / underexposed / overexposed / negative)",
+    ["decision"],
+)
+PROCESS_STARTUP_SECONDS = Gauge(
+    "polyp_process_startup_seconds",
+    "Time from the start of importing main to import done / app started, per APP_ROLE",
+    ["role", "phase"],
+    multiprocess_mode="max",
+)
+MONGO_SECONDS = Histogram(
+    "polyp_mongo_seconds",
+    "MongoDB command latency",
+    ["command", "outcome"],
+    buckets=STAGE_BUCKETS,
+)
+
+
+# =========================
+# Stage timer
+# =========================
+
+class StageTimer:
+    """Accumulates wall time per named stage, in ms (the shape stored in summary.time_ms)."""
+
+    def __init__(self):
+        self.ms = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - t0) * 1000.0)
+
+    def add(self, name: str, ms: float):
+        self.ms[name] = self.ms.get(name, 0.0) + float(ms)
+
+    def observe(self, model: str, task: str):
+        for stage, ms in self.ms.items():
+            STAGE_SECONDS.labels(model=model, task=task, stage=stage).observe(ms / 1000.0)
+
+
+# =========================
+# Mongo command latency
+# =========================
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Pass to the Mongo client via event_listeners=[...] to time every command."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.labels(command=event.command_name, outcome="ok").observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_SECONDS.labels(command=event.command_name, outcome="error").observe(event.duration_micros / 1e6)
+
+
+# =========================
+# HTTP helpers
+# =========================
+
+def route_label(request) -> str:
+    """Route template (e.g. /history/{upload_id}) so ids don't explode label cardinality."""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+def render_latest():
+    """-> (body bytes, content type). Aggregates all workers when PROMETHEUS_MULTIPROC_DIR is set."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
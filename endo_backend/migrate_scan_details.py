@@ -0,0 +1,89 @@
+# migrate_scan_details.py
+"""
+Move the heavy part of existing scan results out of `scans` (layout in scan_store.py).
+
+    python migrate_scan_details.py --dry-run        # count what would move where
+    python migrate_scan_details.py                  # migrate
+    python migrate_scan_details.py --revert         # put details back inline
+
+Only scans without a `details` field are migrated, and a scan is updated only
+after its details are written, so an interrupted run can simply be re-run.
+"""
+import argparse
+import asyncio
+import os
+from collections import Counter
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from scan_store import STORE_INLINE, ScanStore
+
+
+async def migrate(store: ScanStore, batch_size: int, dry_run: bool):
+    stats = Counter()
+    last_id = None
+    while True:
+        q = {"details": {"$exists": False}}
+        if last_id is not None:
+            q["_id"] = {"$gt": last_id}
+        docs = await store.scans.find(q, {"result": 1, "user_id": 1}).sort("_id", 1).limit(batch_size).to_list(None)
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+
+        pending = [store.prepare(d) for d in docs]
+        for d in docs:
+            stats[d["details"]["store"]] += 1
+            stats["bytes_moved"] += 0 if d["details"]["store"] == STORE_INLINE else d["details"]["bytes"]
+        if not dry_run:
+            await store.write_details(pending, replace=True)
+            await store.scans.bulk_write([
+                UpdateOne({"_id": d["_id"], "details": {"$exists": False}},
+                          {"$set": {"result": d["result"], "details": d["details"]}})
+                for d in docs
+            ], ordered=False)
+        print(f"... {sum(stats[k] for k in ('inline', 'collection', 'gridfs'))} scans, last _id {last_id}")
+    return stats
+
+async def revert(store: ScanStore, batch_size: int, dry_run: bool):
+    stats = Counter()
+    q = {"details": {"$exists": True}}
+    if dry_run:
+        async for row in store.scans.aggregate([{"$match": q}, {"$group": {"_id": "$details.store", "n": {"$sum": 1}}}]):
+            stats[row["_id"]] = row["n"]
+        return stats
+    while True:
+        docs = await store.scans.find(q, {"result": 1, "details": 1}).sort("_id", 1).limit(batch_size).to_list(None)
+        if not docs:
+            break
+        for d in docs:
+            stats[d["details"]["store"]] += 1
+        await store.attach_details_many(docs)
+        await store.scans.bulk_write([
+            UpdateOne({"_id": d["_id"]}, {"$set": {"result": d["result"]}, "$unset": {"details": ""}})
+            for d in docs
+        ], ordered=False)
+        await store.delete_details(docs)
+        print(f"... {sum(stats.values())} scans reverted")
+    return stats
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Split scan detections out of the scans collection")
+    ap.add_argument("--batch-size", type=int, default=200)
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--revert", action="store_true", help="move details back inline")
+    args = ap.parse_args(argv)
+
+    load_dotenv()
+    client = AsyncIOMotorClient(os.environ["MONGODB_URI"])
+    store = ScanStore(client["polyp_detection"])
+    run = revert if args.revert else migrate
+    stats = asyncio.run(run(store, args.batch_size, args.dry_run))
+    print(("would " if args.dry_run else "") + ("revert: " if args.revert else "migrate: ") + dict(stats).__repr__())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# pipeline.py
+"""
+The ML half of an upload: encoded image -> decode, optional frame gate, model,
+overlay JPEG. Also model validation and re-thresholding.
+
+Runs in-process for APP_ROLE=all and inside the inference pool workers
+(inference_pool.py, the "inference" role) for APP_ROLE=api. It imports the whole
+ML stack, so the API role never imports it.
+"""
+import asyncio
+import base64
+
+from fastapi import HTTPException
+
+import frame_gate
+from frame import Frame, encode_jpeg
+from inference import (
+    AVAILABLE_MODELS,
+    TASK_CASCADE,
+    TASK_ENSEMBLE,
+    TASK_GATED,
+    _ensure_loaded,
+    _parse_cascade_heavy,
+    _parse_ensemble_members,
+    _parse_yolo_profile,
+    draw_mask_overlay,
+    gated_result,
+    infer,
+    rethreshold,
+)
+import raw_outputs
+
+
+def model_tasks() -> dict:
+    return {name: entry["task"] for name, entry in AVAILABLE_MODELS.items()}
+
+def check_model(model_name: str, ensemble_members: str = "", cascade_heavy: str = "", want_masks: bool = False,
+                gate=None, profile: str = "", load: bool = True):
+    """Validate the model choice up front -> inference options for inference.infer() (+ "gate")."""
+    if model_name not in AVAILABLE_MODELS:
+        raise HTTPException(status_code=400, detail="Unknown model selected")
+    options = {
+        "gate": frame_gate.FRAME_GATE_ENABLED if gate is None else bool(gate),
+        "profile": _parse_yolo_profile(profile),
+    }
+    task = AVAILABLE_MODELS[model_name]["task"]
+    if task == TASK_ENSEMBLE:
+        options["members"] = _parse_ensemble_members(ensemble_members)
+    elif task == TASK_CASCADE:
+        options.update(heavy=_parse_cascade_heavy(cascade_heavy), want_masks=bool(want_masks))
+    elif load:
+        _ensure_loaded(model_name)
+    return options
+
+async def scan_image(image_bytes: bytes, model_name: str, options: dict, timer):
+    """
+    -> (overlay JPEG bytes | None when gated, result dict, task). The result may
+    carry the raw model output under result_schema.RAW_OUTPUT_KEY.
+    """
+    task = AVAILABLE_MODELS[model_name]["task"]
+
+    # single decode; predictors, rendering and the encoder all work off this buffer
+    with timer.stage("decode"):
+        try:
+            frame = Frame.decode(image_bytes)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Could not decode image")
+
+    gate = None
+    if options.get("gate"):
+        with timer.stage("gate"):
+            gate = frame_gate.check(frame)
+
+    if gate is not None and not gate["passed"]:
+        # unusable / confidently negative: no model, no overlay
+        return None, gated_result(frame, gate, model_name), TASK_GATED
+
+    processed, result_dict = await infer(model_name, frame, options, timer=timer)
+    result_dict["result_meta"]["model_name"] = model_name
+    if gate is not None:
+        result_dict["result_meta"]["gate"] = gate
+    with timer.stage("encode"):
+        jpeg = encode_jpeg(processed.data, processed.order)
+    return jpeg, result_dict, task
+
+def scan_image_sync(image_bytes: bytes, model_name: str, options: dict, timer):
+    """scan_image on its own event loop: for worker threads (APP_ROLE=all) and pool workers."""
+    return asyncio.run(scan_image(image_bytes, model_name, options, timer))
+
+def rethreshold_sweep(row: dict, img_w: int, img_h: int, thresholds, mask_threshold=None, image_bytes: bytes = None):
+    """Stored raw output -> ([result per threshold], overlay data URL for thresholds[0] | None)."""
+    raw = raw_outputs.decode(row)
+    results, first_mask = [], None
+    for t in thresholds:
+        result, mask = rethreshold(raw, img_w, img_h, t, mask_threshold)
+        result["result_meta"]["model_name"] = row.get("model")
+        results.append(result)
+        if first_mask is None:
+            first_mask = mask
+    overlay = None
+    if image_bytes is not None:
+        frame = Frame.decode(image_bytes)
+        pixels = draw_mask_overlay(frame.copy(), first_mask, order=frame.order, copy=False)
+        overlay = "data:image/jpeg;base64," + base64.b64encode(encode_jpeg(pixels, frame.order)).decode("ascii")
+    return results, overlay
@@ -0,0 +1,228 @@
+# profiling.py
+"""
+On-demand request profiling: a pyinstrument sampling profile (speedscope /
+flamegraph) plus torch.profiler's top operators, stored in Mongo. The torch part
+only runs where torch is already loaded (in-process inference); an API-role
+process never imports it for this.
+
+What is captured: the event-loop thread (async-aware), plus every function run
+through RequestProfile.in_thread. In-process frames run in worker threads
+(asyncio.to_thread), where the loop's sampler only sees "[await] to_thread", so
+main.py wraps them; their samples are merged into the same report, one branch
+per thread. Inference in the pool process (APP_ROLE=api) is not captured: it
+shows as the await on the pool, and its stage timings are in the result's time_ms.
+
+torch.profiler only records the thread that started it and can run only once per
+process at a time, so each in_thread call starts it when it is free and top_ops
+sums those calls. Frames that ran while another request (or a concurrent frame)
+held it are missing from top_ops; "torch" is "busy" when none got it. A profile
+never fails the request it wraps.
+
+Triggered per request by an admin sending `X-Profile: 1` (or "true"), or for a
+sampled fraction of traffic via PROFILE_SAMPLE_RATE. When neither applies
+nothing is wrapped, so the cost is one header lookup.
+"""
+import functools
+import gzip
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+from bson import Binary
+from fastapi import HTTPException
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import ConsoleRenderer, SpeedscopeRenderer
+    from pyinstrument.session import Session
+    _HAS_PYINSTRUMENT = True
+except Exception:
+    _HAS_PYINSTRUMENT = False
+
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0") or 0)
+PROFILE_INTERVAL_S = 0.001   # pyinstrument sampling interval
+PROFILE_TOP_OPS = 25
+PROFILE_HEADER_VALUES = ("1", "true")
+
+logger = logging.getLogger(__name__)
+_torch_lock = threading.Lock()   # one torch.profiler session per process
+
+
+class RequestProfile:
+    """Context manager sampling the event loop around a block; in_thread() adds worker threads + torch ops."""
+
+    def __init__(self, route: str, trigger: str, user_email: str = None):
+        self.route = route
+        self.trigger = trigger
+        self.user_email = user_email
+        self.meta = {}
+        self._sampler = Profiler(interval=PROFILE_INTERVAL_S, async_mode="enabled") if _HAS_PYINSTRUMENT else None
+        self._thread_sessions = []   # from in_thread()
+        self._ops = {}               # torch op -> [count, self cpu us, total cpu us], from in_thread()
+        self._thread_lock = threading.Lock()
+        self.torch_status = "not_loaded"   # "profiled" | "busy" | "failed" | "not_loaded"
+        self._t0 = None
+        self.duration_ms = None
+
+    def _note_torch(self, status: str):
+        with self._thread_lock:
+            if self.torch_status != "profiled":
+                self.torch_status = status
+
+    def _start_torch(self):
+        """torch.profiler for the calling thread, or None (torch not loaded / busy / failed)."""
+        torch = sys.modules.get("torch")
+        if torch is None:
+            return None
+        if not _torch_lock.acquire(blocking=False):
+            self._note_torch("busy")
+            return None
+        try:
+            prof = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+            prof.__enter__()
+        except Exception:
+            _torch_lock.release()
+            self._note_torch("failed")
+            return None
+        return prof
+
+    def _stop_torch(self, prof):
+        try:
+            prof.__exit__(None, None, None)
+            events = prof.key_averages()
+        except Exception:
+            self._note_torch("failed")
+            return
+        finally:
+            _torch_lock.release()
+        with self._thread_lock:
+            for e in events:
+                row = self._ops.setdefault(e.key, [0, 0.0, 0.0])
+                row[0] += int(e.count)
+                row[1] += e.self_cpu_time_total
+                row[2] += e.cpu_time_total
+            self.torch_status = "profiled"
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        if self._sampler is not None:
+            try:
+                self._sampler.start()
+            except Exception:
+                self._sampler = None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._sampler is not None:
+            try:
+                self._sampler.stop()
+            except Exception:
+                self._sampler = None
+        self.duration_ms = (time.perf_counter() - self._t0) * 1000.0
+        return False
+
+    def in_thread(self, fn):
+        """fn, profiled (sampler + torch) in whichever thread runs it; merged into this profile."""
+        if self._sampler is None and "torch" not in sys.modules:
+            return fn
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            sampler = None
+            if self._sampler is not None:
+                sampler = Profiler(interval=PROFILE_INTERVAL_S, async_mode="disabled")
+                try:
+                    sampler.start()
+                except Exception:
+                    sampler = None
+            prof = self._start_torch()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                # sampler first: torch's key_averages() is profiler overhead, not request time
+                if sampler is not None:
+                    try:
+                        sampler.stop()
+                        with self._thread_lock:
+                            self._thread_sessions.append(sampler.last_session)
+                    except Exception:
+                        pass
+                if prof is not None:
+                    self._stop_torch(prof)
+
+        return run
+
+    def session(self):
+        """The event-loop session merged with the in_thread() ones, or None."""
+        if self._sampler is None or self._sampler.last_session is None:
+            return None
+        session = self._sampler.last_session
+        with self._thread_lock:
+            for other in self._thread_sessions:
+                session = Session.combine(session, other)
+        return session
+
+    def top_ops(self, limit: int = PROFILE_TOP_OPS):
+        with self._thread_lock:
+            rows = sorted(self._ops.items(), key=lambda kv: kv[1][1], reverse=True)[:limit]
+        return [
+            {"name": name, "count": count, "self_cpu_ms": self_us / 1000.0, "cpu_total_ms": total_us / 1000.0}
+            for name, (count, self_us, total_us) in rows
+        ]
+
+    def to_doc(self):
+        doc = {
+            "created_at": datetime.utcnow(),
+            "route": self.route,
+            "trigger": self.trigger,
+            "user_email": self.user_email,
+            "duration_ms": self.duration_ms,
+            "meta": self.meta,
+            "torch": self.torch_status,
+            "top_ops": self.top_ops(),
+            "text": None,
+            "speedscope_gz": None,
+        }
+        session = self.session()
+        if session is not None:
+            doc["text"] = ConsoleRenderer(unicode=True, color=False).render(session)
+            speedscope = SpeedscopeRenderer().render(session)
+            doc["speedscope_gz"] = Binary(gzip.compress(speedscope.encode("utf-8")))
+        return doc
+
+
+def for_request(request, current_user: dict):
+    """RequestProfile if this request should be profiled, else None."""
+    if request.headers.get(PROFILE_HEADER, "").strip().lower() in PROFILE_HEADER_VALUES:
+        if not current_user.get("is_admin", False):
+            raise HTTPException(status_code=403, detail="Profiling is admin-only.")
+        trigger = "header"
+    elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        trigger = "sampled"
+    else:
+        return None
+    route = getattr(request.scope.get("route"), "path", request.url.path)
+    return RequestProfile(route, trigger, current_user.get("email"))
+
+
+async def save(profile: RequestProfile, collection):
+    """Persist a finished profile -> id str, or None if it could not be rendered / stored."""
+    try:
+        res = await collection.insert_one(profile.to_doc())
+    except Exception as e:
+        logger.warning("profile not saved: %r", e)
+        return None
+    return str(res.inserted_id)
+
+
+def speedscope_json(doc) -> bytes:
+    blob = doc.get("speedscope_gz")
+    if not blob:
+        return None
+    return gzip.decompress(bytes(blob))
@@ -0,0 +1,81 @@
+# raw_outputs.py
+"""
+Compact storage of the segmenters' raw low-resolution outputs, so a scan can be
+re-thresholded later without another forward pass (POST /history/{id}/rethreshold).
+
+- U-Net / U-Net++: the 256x256 probability map of the polyp class.
+- Mask R-CNN: per-instance scores + labels + 256x256 soft masks (the top
+  RAW_MAX_INSTANCES above RAW_MIN_SCORE; torchvision's own floor is 0.05).
+
+Probabilities are quantized to uint8 (step 1/255) and the arrays go into a
+zlib-compressed .npz. A threshold applied to the stored map can therefore differ
+from the original by at most one quantization step at the boundary. Instance
+scores are kept as float32, so score thresholds are exact.
+"""
+import io
+import os
+
+import numpy as np
+
+
+RAW_OUTPUTS_ENABLED = os.environ.get("RAW_OUTPUTS", "1") == "1"
+RAW_MAX_INSTANCES = int(os.environ.get("RAW_MAX_INSTANCES", "20"))
+RAW_MIN_SCORE = 0.05
+
+KIND_PROB_MAP = "prob_map"
+KIND_INSTANCES = "instances"
+FORMAT = "npz-u8"
+
+
+def quantize(p: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(np.asarray(p, dtype=np.float32) * 255.0), 0, 255).astype(np.uint8)
+
+def dequantize(q: np.ndarray) -> np.ndarray:
+    return q.astype(np.float32) * (1.0 / 255.0)
+
+def _pack(**arrays) -> bytes:
+    buf = io.BytesIO()
+    np.savez_compressed(buf, **arrays)
+    return buf.getvalue()
+
+def _unpack(blob: bytes) -> dict:
+    with np.load(io.BytesIO(blob), allow_pickle=False) as npz:
+        return {k: npz[k] for k in npz.files}
+
+
+def encode_prob_map(probs_small: np.ndarray) -> dict:
+    """HxW float probabilities -> {"kind", "format", "shape", "blob"}."""
+    return {
+        "kind": KIND_PROB_MAP,
+        "format": FORMAT,
+        "shape": list(probs_small.shape),
+        "blob": _pack(probs=quantize(probs_small)),
+    }
+
+def encode_instances(scores: np.ndarray, labels: np.ndarray, masks_small: np.ndarray) -> dict:
+    """scores [N], labels [N], soft masks [N,H,W] -> {"kind", "format", "shape", "blob"}."""
+    order = np.argsort(-scores, kind="stable")
+    order = order[scores[order] >= RAW_MIN_SCORE][:RAW_MAX_INSTANCES]
+    masks = masks_small[order]
+    return {
+        "kind": KIND_INSTANCES,
+        "format": FORMAT,
+        "shape": list(masks.shape),
+        "blob": _pack(
+            scores=scores[order].astype(np.float32),
+            labels=labels[order].astype(np.int16),
+            masks=quantize(masks),
+        ),
+    }
+
+def decode(raw: dict) -> dict:
+    """Stored raw output -> {"kind", "probs"} or {"kind", "scores", "labels", "masks"} (float32 probabilities)."""
+    if raw.get("format") != FORMAT:
+        raise ValueError(f"Unsupported raw output format '{raw.get('format')}'")
+    arrays = _unpack(bytes(raw["blob"]))
+    if raw["kind"] == KIND_PROB_MAP:
+        return {"kind": KIND_PROB_MAP, "probs": dequantize(arrays["probs"])}
+    if raw["kind"] == KIND_INSTANCES:
+        return {"kind": KIND_INSTANCES, "scores": arrays["scores"], "labels": arrays["labels"].astype(np.int64),
+                "masks": dequantize(arrays["masks"])}
+    raise ValueError(f"Unknown raw output kind '{raw['kind']}'")
@@ -0,0 +1,8 @@
+# result_schema.py
+"""
+Version of the result dict (bump on incompatible changes) and the result keys
+the API role needs. Kept apart from inference.py / raw_outputs.py so the API role
+can build ETags and store scans without importing the ML stack or numpy.
+"""
+RESULT_SCHEMA_VERSION = 2
+RAW_OUTPUT_KEY = "raw_output"   # result dict key predictors put the encoded raw output under (see raw_outputs.py)
@@ -0,0 +1,119 @@
+# role_startup.py
+"""
+Import / startup cost per process role, each measured in fresh interpreters.
+
+    python role_startup.py                        # api, all, inference; 5 runs each
+    python role_startup.py --roles api --runs 10 --out startup.json
+
+- api:       `import main` with APP_ROLE=api (must not load torch / cv2 / ultralytics)
+- all:       `import main` with APP_ROLE=all (in-process inference: full ML stack)
+- inference: `import pipeline` as the pool workers do, plus loading every model
+             whose weights are present (load_ms per model)
+
+Running servers report the same numbers (import_ms, startup_ms, ml_stack_loaded)
+on /healthz and as polyp_process_startup_seconds.
+"""
+import argparse
+import importlib
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+
+ROLES = ("api", "all", "inference")
+HEAVY_MODULES = ("torch", "torchvision", "cv2", "ultralytics", "segmentation_models_pytorch")
+
+# import-time settings main.py / s3.py require; nothing connects at import
+PROBE_ENV = {
+    "MONGODB_URI": "mongodb://127.0.0.1:27017",
+    "AWS_ACCESS_KEY_ID": "probe",
+    "AWS_SECRET_ACCESS_KEY": "probe",
+    "AWS_BUCKET_NAME": "probe",
+    "INFERENCE_POOL_AUTHKEY": "probe",
+}
+
+
+def probe(role: str) -> dict:
+    """Runs inside the fresh interpreter."""
+    t0 = time.perf_counter()
+    out = {"role": role}
+    if role == "inference":
+        importlib.import_module("pipeline")
+        import inference
+        out["import_ms"] = (time.perf_counter() - t0) * 1000.0
+        out["load_ms"] = {}
+        for name, entry in inference.AVAILABLE_MODELS.items():
+            if entry.get("weights") and os.path.exists(entry["weights"]):
+                t1 = time.perf_counter()
+                inference._ensure_loaded(name)
+                out["load_ms"][name] = (time.perf_counter() - t1) * 1000.0
+    else:
+        importlib.import_module("main")
+        out["import_ms"] = (time.perf_counter() - t0) * 1000.0
+    out["ml_stack_loaded"] = [m for m in HEAVY_MODULES if m in sys.modules]
+    out["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0   # KB on Linux
+    return out
+
+
+def measure(role: str, runs: int):
+    samples = []
+    for _ in range(runs):
+        env = {**PROBE_ENV, **os.environ, "APP_ROLE": role}
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--probe", role], env=env,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+        wall_ms = (time.perf_counter() - t0) * 1000.0
+        if proc.returncode != 0:
+            return {"role": role, "error": proc.stderr.strip().splitlines()[-1:] or ["failed"]}
+        sample = json.loads(proc.stdout.strip().splitlines()[-1])
+        sample["process_ms"] = wall_ms   # interpreter start + import + exit
+        samples.append(sample)
+
+    def stats(key):
+        vals = [s[key] for s in samples]
+        return {"median": statistics.median(vals), "min": min(vals), "max": max(vals)}
+
+    return {
+        "role": role,
+        "runs": runs,
+        "import_ms": stats("import_ms"),
+        "process_ms": stats("process_ms"),
+        "max_rss_mb": stats("max_rss_mb"),
+        "ml_stack_loaded": samples[-1]["ml_stack_loaded"],
+        **({"load_ms": samples[-1]["load_ms"]} if "load_ms" in samples[-1] else {}),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Import/startup time and memory per process role")
+    ap.add_argument("--roles", nargs="*", default=list(ROLES), choices=ROLES)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--probe", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.probe:
+        print(json.dumps(probe(args.probe)))
+        return 0
+
+    report = {r: measure(r, args.runs) for r in args.roles}
+    for r, st in report.items():
+        if "error" in st:
+            print(f"{r:<10} failed: {st['error']}")
+            continue
+        print(f"{r:<10} import={st['import_ms']['median']:8.0f} ms  process={st['process_ms']['median']:8.0f} ms  "
+              f"rss={st['max_rss_mb']['median']:7.0f} MB  ml_stack={st['ml_stack_loaded'] or '-'}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    api = report.get("api")
+    # the API role must stay free of the ML stack
+    return 1 if api and api.get("ml_stack_loaded") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,155 @@
-import boto3
 import os
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 load_dotenv()
 
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
-    aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
-)
-
+# read at import so a missing setting still fails at startup; the client itself
+# is built on first use (importing boto3 + creating it is most of an API-role import)
+AWS_ACCESS_KEY_ID = os.environ["AWS_ACCESS_KEY_ID"]
+AWS_SECRET_ACCESS_KEY = os.environ["AWS_SECRET_ACCESS_KEY"]
 BUCKET_NAME = os.environ["AWS_BUCKET_NAME"]
 
+# Objects are private by default and read through presigned GET URLs.
+# S3_PUBLIC_READ=1 restores the old public-read ACL + plain URLs.
+S3_PUBLIC_READ = os.environ.get("S3_PUBLIC_READ", "0") == "1"
+PRESIGNED_GET_TTL = int(os.environ.get("S3_PRESIGNED_GET_TTL", "3600"))
+PRESIGNED_REFRESH_MARGIN = 300   # re-sign when less than this many seconds remain
+PRESIGNED_POST_TTL = 600
+UPLOAD_MAX_BYTES = 25 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+URL_CACHE_MAX = int(os.environ.get("S3_URL_CACHE_MAX", "20000"))
+
+# key -> url signed in the current url_window (LRU, emptied when the window changes)
+_url_cache = OrderedDict()
+_url_cache_window = None
+_url_cache_lock = threading.Lock()
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def client():
+    """The boto3 S3 client (thread-safe; created once, on first use)."""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                import boto3
+                _s3_client = boto3.client(
+                    "s3",
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                )
+    return _s3_client
+
+
+def public_url(filename):
+    return f"https://{BUCKET_NAME}.s3.amazonaws.com/{filename}"
+
+def key_from_url(url):
+    prefix = public_url("")
+    if url and url.startswith(prefix):
+        return url[len(prefix):]
+    return None
+
+
 def generate_presigned_url(filename, expiration=3600):
-    return s3_client.generate_presigned_url(
+    return client().generate_presigned_url(
         "get_object",
         Params={"Bucket": BUCKET_NAME, "Key": filename},
         ExpiresIn=expiration
     )
 
+def url_window(now=None):
+    """
+    (index, seconds left) of the current presigned-URL window. URLs are re-signed
+    only when the window changes, so responses embedding them are stable within
+    one; a URL signed during a window stays valid PRESIGNED_REFRESH_MARGIN past it.
+    """
+    span = PRESIGNED_GET_TTL - PRESIGNED_REFRESH_MARGIN
+    now = time.time() if now is None else now
+    return int(now // span), span - (now % span)
+
+def presigned_get_url(filename):
+    """Presigned GET, reused for the whole url_window() (stable URLs also let browsers cache)."""
+    global _url_cache_window
+    window, _ = url_window()
+    with _url_cache_lock:
+        if window != _url_cache_window:
+            # URLs from earlier windows are never served again
+            _url_cache.clear()
+            _url_cache_window = window
+        url = _url_cache.get(filename)
+        if url is not None:
+            _url_cache.move_to_end(filename)
+            return url
+    url = generate_presigned_url(filename, expiration=PRESIGNED_GET_TTL)
+    with _url_cache_lock:
+        if window == _url_cache_window:
+            _url_cache[filename] = url
+            while len(_url_cache) > URL_CACHE_MAX:
+                _url_cache.popitem(last=False)
+    return url
+
+def object_url(filename):
+    """URL a browser can load for this key."""
+    return public_url(filename) if S3_PUBLIC_READ else presigned_get_url(filename)
+
+
+def generate_presigned_post(filename, content_type, max_bytes=UPLOAD_MAX_BYTES, expiration=PRESIGNED_POST_TTL):
+    """
+    Browser-direct upload form: POST `fields` + the file (last) to `url`.
+    The bucket needs a CORS rule allowing POST from the frontend origin.
+    """
+    fields = {"Content-Type": content_type}
+    conditions = [
+        {"Content-Type": content_type},
+        ["content-length-range", 1, max_bytes],
+    ]
+    if S3_PUBLIC_READ:
+        fields["acl"] = "public-read"
+        conditions.append({"acl": "public-read"})
+    return client().generate_presigned_post(
+        BUCKET_NAME,
+        filename,
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=expiration,
+    )
+
+def get_object_bytes(filename, max_bytes=UPLOAD_MAX_BYTES):
+    """Stream an object into memory in chunks; refuses objects over max_bytes."""
+    obj = client().get_object(Bucket=BUCKET_NAME, Key=filename)
+    if obj.get("ContentLength", 0) > max_bytes:
+        obj["Body"].close()
+        raise ValueError(f"Object too large: {obj['ContentLength']} bytes")
+    buf = bytearray()
+    for chunk in obj["Body"].iter_chunks(DOWNLOAD_CHUNK_BYTES):
+        buf.extend(chunk)
+    return bytes(buf)
+
 
 def upload_to_s3(file_obj, filename):
-    s3_client.upload_fileobj(
+    extra = {"ContentType": "image/jpeg"}
+    if S3_PUBLIC_READ:
+        extra["ACL"] = "public-read"
+    client().upload_fileobj(
         file_obj,
         BUCKET_NAME,
         filename,
-        ExtraArgs={"ContentType": "image/jpeg", "ACL": "public-read"}
+        ExtraArgs=extra
     )
-    url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{filename}"
+    url = public_url(filename)
     return url
+
+
+def delete_by_url(url):
+    key = key_from_url(url)
+    if key is None:
+        raise ValueError(f"Not an object URL of bucket {BUCKET_NAME}: {url}")
+    client().delete_object(Bucket=BUCKET_NAME, Key=key)
+    with _url_cache_lock:
+        _url_cache.pop(key, None)
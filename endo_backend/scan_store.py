@@ -0,0 +1,206 @@
+# scan_store.py
+"""
+Scan storage split into a light and a heavy part.
+
+`scans` keeps everything the lists and dashboards read (patient fields, URLs,
+result.schema / result_meta / result.summary). The heavy part of `result`
+(detections with polygons, per-member results) goes to:
+
+- inline in the scan doc when it is tiny (e.g. no detections),
+- `scan_details` (same _id as the scan) up to DETAILS_GRIDFS_BYTES,
+- GridFS bucket `scan_details_fs` (file _id = scan _id) above that.
+
+`scan.details = {"store": ..., "bytes": ...}` says where it lives. Scans written
+before the split have no `details` and still carry the full result inline.
+
+Split scans also keep the whole result as pre-compressed JSON (http_responses.precompress):
+`result_blob` in their scan_details row, or as the GridFS file itself, so
+/history/{id} and /history/{id}/result are served without serializing or
+compressing the result (http_responses.splice).
+"""
+import asyncio
+
+import bson
+from bson import Binary, ObjectId
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ReplaceOne
+
+import http_responses
+from result_schema import RAW_OUTPUT_KEY
+
+
+HEAVY_RESULT_FIELDS = ("detections", "members")
+DETAILS_INLINE_BYTES = 1024               # below this the split isn't worth a second read
+DETAILS_GRIDFS_BYTES = 4 * 1024 * 1024    # well under Mongo's 16 MB document limit
+
+STORE_INLINE = "inline"
+STORE_COLLECTION = "collection"
+STORE_GRIDFS = "gridfs"
+_BLOB_FIELDS = {"result_blob": 0, "result_encoding": 0}
+
+
+def split_result(result: dict):
+    """-> (light result for `scans`, heavy fields dict)."""
+    light = {k: v for k, v in result.items() if k not in HEAVY_RESULT_FIELDS}
+    heavy = {k: result[k] for k in HEAVY_RESULT_FIELDS if k in result}
+    return light, heavy
+
+
+class ScanStore:
+    def __init__(self, db, scans_name: str = "scans", details_name: str = "scan_details",
+                 gridfs_bucket: str = "scan_details_fs", raw_name: str = "scan_raw"):
+        self.scans = db[scans_name]
+        self.details = db[details_name]
+        self.raw = db[raw_name]
+        self._db = db
+        self._gridfs_bucket = gridfs_bucket
+        self._fs = None
+
+    @property
+    def fs(self):
+        # created on first use: only oversized results need it (and mongomock has no GridFS)
+        if self._fs is None:
+            self._fs = AsyncIOMotorGridFSBucket(self._db, bucket_name=self._gridfs_bucket)
+        return self._fs
+
+    # ---- writes ----
+
+    def prepare(self, doc: dict):
+        """
+        Give `doc` an _id and split its result in place -> pending heavy write
+        (None when it stays inline). Used by insert_many and the migration.
+        """
+        doc.setdefault("_id", ObjectId())
+        result = doc.get("result") or {}
+        light, heavy = split_result(result)
+        raw = bson.encode(heavy)
+        if len(raw) < DETAILS_INLINE_BYTES:
+            doc["details"] = {"store": STORE_INLINE, "bytes": len(raw)}
+            return None
+        blob, encoding = http_responses.precompress(http_responses.dumps(result))
+        doc["result"] = light
+        if len(raw) < DETAILS_GRIDFS_BYTES:
+            doc["details"] = {"store": STORE_COLLECTION, "bytes": len(raw)}
+            return {"_id": doc["_id"], "user_id": doc.get("user_id"), **heavy,
+                    "result_blob": Binary(blob), "result_encoding": encoding}
+        doc["details"] = {"store": STORE_GRIDFS, "bytes": len(raw)}
+        return {"_id": doc["_id"], "gridfs": blob, "encoding": encoding}
+
+    async def write_details(self, pending, replace: bool = False):
+        """Write prepare() output; `replace` overwrites leftovers of an interrupted migration."""
+        rows = [p for p in pending if p is not None and "gridfs" not in p]
+        if rows and replace:
+            await self.details.bulk_write([ReplaceOne({"_id": r["_id"]}, r, upsert=True) for r in rows], ordered=False)
+        elif rows:
+            await self.details.insert_many(rows, ordered=False)
+        for p in pending:
+            if p is None or "gridfs" not in p:
+                continue
+            if replace:
+                try:
+                    await self.fs.delete(p["_id"])
+                except NoFile:
+                    pass
+            await self.fs.upload_from_stream_with_id(p["_id"], f"{p['_id']}.json", p["gridfs"],
+                                                     metadata={"encoding": p["encoding"]})
+
+    def prepare_raw(self, doc: dict):
+        """Move doc[RAW_OUTPUT_KEY] (encoded raw output) into a scan_raw row, leaving a marker."""
+        raw = doc.pop(RAW_OUTPUT_KEY, None)
+        if not raw:
+            return None
+        doc.setdefault("_id", ObjectId())
+        blob = bytes(raw["blob"])
+        doc[RAW_OUTPUT_KEY] = {"kind": raw["kind"], "format": raw["format"], "shape": raw["shape"], "bytes": len(blob)}
+        return {"_id": doc["_id"], "user_id": doc.get("user_id"), "model": doc.get("model_used"),
+                **doc[RAW_OUTPUT_KEY], "blob": Binary(blob)}
+
+    async def insert_many(self, docs):
+        """Batch insert of new scans; details are written first so a scan never points at nothing."""
+        # serialization + write-time compression: off the event loop
+        pending = await asyncio.to_thread(lambda: [self.prepare(d) for d in docs])
+        raw_rows = [r for r in (self.prepare_raw(d) for d in docs) if r is not None]
+        await self.write_details(pending)
+        if raw_rows:
+            await self.raw.insert_many(raw_rows, ordered=False)
+        await self.scans.insert_many(docs)
+        return [d["_id"] for d in docs]
+
+    # ---- reads ----
+
+    async def load_details(self, doc: dict) -> dict:
+        """Heavy fields of one scan ({} when they are already inline)."""
+        store = (doc.get("details") or {}).get("store", STORE_INLINE)
+        if store == STORE_COLLECTION:
+            row = await self.details.find_one({"_id": doc["_id"]}, {"_id": 0, "user_id": 0, **_BLOB_FIELDS})
+            return row or {}
+        if store == STORE_GRIDFS:
+            blob, encoding = await self.load_result_blob(doc)
+            if blob is None:
+                return {}
+            _, heavy = split_result(http_responses.loads(http_responses.decompress(blob, encoding)))
+            return heavy
+        return {}
+
+    async def load_result_blob(self, doc: dict):
+        """Pre-compressed full result JSON -> (bytes, encoding), or (None, None) for inline/legacy scans."""
+        store = (doc.get("details") or {}).get("store", STORE_INLINE)
+        if store == STORE_COLLECTION:
+            row = await self.details.find_one({"_id": doc["_id"]}, {"result_blob": 1, "result_encoding": 1})
+            if row and row.get("result_blob"):
+                return bytes(row["result_blob"]), row["result_encoding"]
+        elif store == STORE_GRIDFS:
+            try:
+                stream = await self.fs.open_download_stream(doc["_id"])
+            except NoFile:
+                return None, None
+            return await stream.read(), (stream.metadata or {}).get("encoding", http_responses.GZIP)
+        return None, None
+
+    async def load_raw(self, doc: dict):
+        """Stored raw output row ({"kind", "format", "shape", "blob", ...}) or None."""
+        if not doc.get(RAW_OUTPUT_KEY):
+            return None
+        return await self.raw.find_one({"_id": doc["_id"]})
+
+    async def attach_details(self, doc: dict) -> dict:
+        """Merge the heavy part back into doc["result"] (detail endpoints)."""
+        heavy = await self.load_details(doc)
+        if heavy:
+            doc.setdefault("result", {}).update(heavy)
+        return doc
+
+    async def attach_details_many(self, docs):
+        """Same for a list of scans, one $in query for the collection-stored ones."""
+        ids = [d["_id"] for d in docs if (d.get("details") or {}).get("store") == STORE_COLLECTION]
+        rows = {}
+        if ids:
+            async for row in self.details.find({"_id": {"$in": ids}}, {"user_id": 0, **_BLOB_FIELDS}):
+                rows[row.pop("_id")] = row
+        for d in docs:
+            if d["_id"] in rows:
+                d.setdefault("result", {}).update(rows[d["_id"]])
+            elif (d.get("details") or {}).get("store") == STORE_GRIDFS:
+                await self.attach_details(d)
+        return docs
+
+    # ---- deletes ----
+
+    async def delete_details(self, docs):
+        """Remove the heavy parts of scans being deleted (docs need _id + details)."""
+        ids = [d["_id"] for d in docs if (d.get("details") or {}).get("store") == STORE_COLLECTION]
+        if ids:
+            await self.details.delete_many({"_id": {"$in": ids}})
+        for d in docs:
+            if (d.get("details") or {}).get("store") == STORE_GRIDFS:
+                try:
+                    await self.fs.delete(d["_id"])
+                except NoFile:
+                    pass
+
+    async def delete_raw(self, docs):
+        """Remove stored raw outputs of scans being deleted (docs need _id)."""
+        ids = [d["_id"] for d in docs]
+        if ids:
+            await self.raw.delete_many({"_id": {"$in": ids}})
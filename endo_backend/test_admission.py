@@ -0,0 +1,129 @@
+# test_admission.py
+"""Scheduler tests for admission.py (pure asyncio, no app):  python -m pytest test_admission.py"""
+import asyncio
+
+import pytest
+
+import admission
+from admission import AdmissionController, AdmissionRejected
+
+
+def make_controller(**kw):
+    args = {"max_requests": 8, "max_per_user": 2, "limits": "m=1", "enabled": True}
+    return AdmissionController(**{**args, **kw})
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def _run_frames(ctl, frames):
+    """
+    Hold the only slot of lane "m", queue `frames` [(label, ticket)] in that
+    order, release, and return the order in which they got the slot.
+    """
+    order = []
+    holder = ctl.admit("m", "holder", 1)
+    release = asyncio.Event()
+
+    async def hold():
+        async with holder.slot():
+            await release.wait()
+
+    async def frame(label, ticket):
+        async with ticket.slot():
+            order.append(label)
+
+    blocker = asyncio.create_task(hold())
+    await _settle()
+    tasks = []
+    for label, ticket in frames:
+        tasks.append(asyncio.create_task(frame(label, ticket)))
+        await _settle()
+    release.set()
+    await asyncio.gather(blocker, *tasks)
+    return order
+
+
+def test_ticket_released_when_request_fails():
+    ctl = make_controller(max_per_user=1)
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            with ctl.admit("m", "u1", 2):
+                raise RuntimeError("e.g. a 403 or a failed frame")
+    assert ctl.admitted == 0
+    assert "u1" not in ctl.active
+    with ctl.admit("m", "u1", 1):
+        assert ctl.active["u1"] == 1
+
+def test_user_and_process_limits():
+    ctl = make_controller(max_requests=3, max_per_user=2)
+    t1, t2 = ctl.admit("m", "u1", 1), ctl.admit("m", "u1", 1)
+    with pytest.raises(AdmissionRejected) as e:
+        ctl.admit("m", "u1", 1)
+    assert e.value.reason == admission.REJECT_USER and e.value.retry_after >= 1
+    t3 = ctl.admit("m", "u2", 1)
+    with pytest.raises(AdmissionRejected) as e:
+        ctl.admit("m", "u3", 1)
+    assert e.value.reason == admission.REJECT_BUSY
+    for t in (t1, t2, t3):
+        t.__exit__(None, None, None)
+    assert ctl.admitted == 0 and not ctl.active
+
+def test_round_robin_across_users():
+    ctl = make_controller()
+    a, b = ctl.admit("m", "a", 3), ctl.admit("m", "b", 2)
+    order = asyncio.run(_run_frames(ctl, [("a1", a), ("a2", a), ("a3", a), ("b1", b), ("b2", b)]))
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+    lane = ctl.lane("m")
+    assert lane.running == 0 and lane.queued == 0
+
+def test_interactive_first_within_burst(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_INTERACTIVE_BURST", 2)
+    ctl = make_controller(max_per_user=4)
+    bulk = ctl.admit("m", "bulk", 10)
+    inter = [ctl.admit("m", f"i{n}", 1) for n in range(3)]
+    frames = [("b1", bulk), ("b2", bulk)] + [(f"i{n}", t) for n, t in enumerate(inter)]
+    order = asyncio.run(_run_frames(ctl, frames))
+    # two interactive frames, then bulk gets its turn, then the last interactive one
+    assert order == ["i0", "i1", "b1", "i2", "b2"]
+
+def test_cancelled_waiter_frees_its_place():
+    ctl = make_controller()
+    t = ctl.admit("m", "u1", 2)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def hold():
+            async with t.slot():
+                await release.wait()
+
+        async def wait_frame():
+            async with t.slot():
+                pass
+
+        blocker = asyncio.create_task(hold())
+        await _settle()
+        waiter = asyncio.create_task(wait_frame())
+        await _settle()
+        assert ctl.lane("m").queued == 1
+        waiter.cancel()
+        await _settle()
+        release.set()
+        await blocker
+
+    asyncio.run(scenario())
+    lane = ctl.lane("m")
+    assert lane.running == 0 and lane.queued == 0 and not lane.waiting[admission.BULK]
+
+def test_disabled_admits_everything():
+    ctl = make_controller(enabled=False, max_requests=1, max_per_user=1)
+    tickets = [ctl.admit("m", "u1", 1) for _ in range(3)]
+
+    async def run():
+        for t in tickets:
+            async with t.slot():
+                pass
+
+    asyncio.run(run())
+    assert ctl.admitted == 3
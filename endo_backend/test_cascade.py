@@ -0,0 +1,42 @@
+# test_cascade.py
+"""Escalation rule of the "auto" cascade (no models loaded):  python -m pytest test_cascade.py"""
+import pytest
+
+from inference import cascade_decision
+
+
+BAND = (0.25, 0.60)
+
+def fast(*confs):
+    return {"detections": [{"detection_id": i, "confidence": c} for i, c in enumerate(confs)]}
+
+
+def test_no_detections_is_accepted_negative():
+    assert cascade_decision(fast(), band=BAND) is None
+    assert cascade_decision(fast(), want_masks=True, band=BAND) is None
+    assert cascade_decision({}, band=BAND) is None
+
+@pytest.mark.parametrize("conf", [0.25, 0.4, 0.5999])
+def test_uncertain_band_escalates(conf):
+    assert cascade_decision(fast(conf), band=BAND) == "uncertain"
+
+@pytest.mark.parametrize("conf", [0.1, 0.2499])
+def test_below_band_is_negative(conf):
+    assert cascade_decision(fast(conf), band=BAND) is None
+
+def test_confident_positive_kept_unless_masks_wanted():
+    assert cascade_decision(fast(0.6), band=BAND) is None
+    assert cascade_decision(fast(0.9), want_masks=False, band=BAND) is None
+    assert cascade_decision(fast(0.6), want_masks=True, band=BAND) == "masks"
+
+def test_uncertain_wins_over_masks():
+    # one confident and one uncertain detection: the reason is the uncertainty
+    assert cascade_decision(fast(0.95, 0.3), want_masks=True, band=BAND) == "uncertain"
+    assert cascade_decision(fast(0.95, 0.3), band=BAND) == "uncertain"
+
+def test_missing_confidence_counts_as_zero():
+    assert cascade_decision({"detections": [{"confidence": None}, {}]}, want_masks=True, band=BAND) is None
+
+def test_band_is_caller_defined():
+    assert cascade_decision(fast(0.7), band=(0.5, 0.8)) == "uncertain"
+    assert cascade_decision(fast(0.3), band=(0.5, 0.8)) is None
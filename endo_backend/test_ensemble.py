@@ -0,0 +1,115 @@
+# test_ensemble.py
+"""Ensemble fusion (weighted box fusion + mask vote, no models loaded):  python -m pytest test_ensemble.py"""
+import pytest
+
+from inference import TASK_DETECTION, TASK_SEG_SEMANTIC, fuse_member_results, weighted_box_fusion
+
+
+def box_det(xyxy, conf):
+    return {"confidence": conf, "bbox_xyxy": list(xyxy)}
+
+def mask_det(xyxy, conf):
+    """Segmenter-style detection: a rectangular polygon, no bbox."""
+    x1, y1, x2, y2 = xyxy
+    return {"confidence": conf, "mask_polygons": [[x1, y1, x2, y1, x2, y2, x1, y2]]}
+
+def member(task, *dets):
+    return {"result_meta": {"task": task}, "detections": list(dets)}
+
+
+# ---- weighted_box_fusion ----
+
+def test_overlapping_boxes_fuse_to_weighted_mean():
+    fused = weighted_box_fusion({
+        "a": [([0, 0, 10, 10], 0.9)],
+        "b": [([2, 0, 12, 10], 0.3)],
+    }, weights={})
+    assert len(fused) == 1
+    box, conf, members = fused[0]
+    # x1 = (0.9 * 0 + 0.3 * 2) / 1.2
+    assert box == pytest.approx([0.5, 0.0, 10.5, 10.0])
+    assert conf == pytest.approx((0.9 + 0.3) / 2)
+    assert members == ["a", "b"]
+
+def test_single_member_lesion_is_down_weighted():
+    fused = weighted_box_fusion({
+        "a": [([0, 0, 10, 10], 0.8)],
+        "b": [([50, 50, 60, 60], 0.8)],
+        "c": [],
+    }, weights={})
+    assert len(fused) == 2
+    assert all(conf == pytest.approx(0.8 / 3) for _, conf, _ in fused)
+    assert sorted(m for _, _, ms in fused for m in ms) == ["a", "b"]
+
+def test_weights_scale_confidence_and_position():
+    fused = weighted_box_fusion({
+        "a": [([0, 0, 10, 10], 0.5)],
+        "b": [([2, 0, 12, 10], 0.5)],
+    }, weights={"a": 3.0, "b": 1.0})
+    (box, conf, _), = fused
+    assert box[0] == pytest.approx(0.5)
+    assert conf == pytest.approx((0.5 * 3.0 + 0.5 * 1.0) / 4.0)
+
+def test_same_member_counts_once_per_cluster():
+    # two overlapping boxes from one member must not add up past that member's best
+    fused = weighted_box_fusion({"a": [([0, 0, 10, 10], 0.6), ([1, 0, 11, 10], 0.4)], "b": []}, weights={})
+    (_, conf, members), = fused
+    assert conf == pytest.approx(0.6 / 2)
+    assert members == ["a"]
+
+def test_iou_threshold_and_order():
+    boxes = {"a": [([0, 0, 10, 10], 0.9)], "b": [([5, 0, 15, 10], 0.2)]}   # IoU 1/3
+    assert len(weighted_box_fusion(boxes, weights={}, iou_thr=0.5)) == 2
+    assert len(weighted_box_fusion(boxes, weights={}, iou_thr=0.3)) == 1
+    confs = [conf for _, conf, _ in weighted_box_fusion(boxes, weights={}, iou_thr=0.5)]
+    assert confs == sorted(confs, reverse=True)
+
+
+# ---- fuse_member_results ----
+
+def test_fuse_boxes_only_has_no_mask():
+    dets, mask = fuse_member_results({
+        "yolo_a": member(TASK_DETECTION, box_det([10, 10, 30, 30], 0.9)),
+        "yolo_b": member(TASK_DETECTION, box_det([11, 10, 31, 30], 0.7)),
+    }, img_w=64, img_h=48)
+    assert mask is None
+    assert len(dets) == 1
+    d = dets[0]
+    assert d["members"] == ["yolo_a", "yolo_b"]
+    assert d["bbox_xywh"][2:] == pytest.approx([20.0, 20.0])
+    assert d["bbox_xyxy_norm"] is not None
+    assert "mask_polygons" not in d
+
+def test_mask_vote_keeps_pixels_most_members_agree_on():
+    dets, mask = fuse_member_results({
+        "seg_a": member(TASK_SEG_SEMANTIC, mask_det([0, 0, 20, 20], 0.9)),
+        "seg_b": member(TASK_SEG_SEMANTIC, mask_det([0, 0, 20, 20], 0.8)),
+        "seg_c": member(TASK_SEG_SEMANTIC, mask_det([40, 20, 60, 40], 0.7)),
+    }, img_w=64, img_h=48, weights={})
+    assert mask.shape == (48, 64)
+    assert mask[10, 10] == 1            # 2 of 3 members
+    assert mask[30, 50] == 0            # 1 of 3 members
+    by_members = {tuple(d["members"]): d for d in dets}
+    agreed = by_members[("seg_a", "seg_b")]
+    assert agreed["mask_area_px"] == int(mask[:20, :20].sum())   # voted pixels inside the fused box
+    assert agreed["mask_polygons"]
+    # the lone lesion keeps its box but has no voted mask inside it
+    assert "mask_polygons" not in by_members[("seg_c",)]
+
+def test_mask_vote_uses_weights():
+    results = {
+        "seg_a": member(TASK_SEG_SEMANTIC, mask_det([0, 0, 20, 20], 0.9)),
+        "seg_b": member(TASK_SEG_SEMANTIC),
+        "seg_c": member(TASK_SEG_SEMANTIC),
+    }
+    _, mask = fuse_member_results(results, img_w=64, img_h=48)
+    assert mask.sum() == 0
+    _, mask = fuse_member_results(results, img_w=64, img_h=48, weights={"seg_a": 2.0})
+    assert mask[10, 10] == 1
+
+def test_detection_members_do_not_vote_on_masks():
+    _, mask = fuse_member_results({
+        "yolo": member(TASK_DETECTION, box_det([0, 0, 20, 20], 0.9)),
+        "seg": member(TASK_SEG_SEMANTIC, mask_det([0, 0, 20, 20], 0.9)),
+    }, img_w=64, img_h=48)
+    assert mask[10, 10] == 1
@@ -0,0 +1,77 @@
+# test_http_responses.py
+"""Splice tests for http_responses.py (no app, no Mongo):  python -m pytest test_http_responses.py"""
+import gzip
+import zlib
+
+import pytest
+
+import http_responses
+from http_responses import GZIP, ZSTD
+
+
+RESULT = {
+    "schema": 2,
+    "result_meta": {"task": "seg_semantic", "thresholds": {"prob": 0.5}},
+    "detections": [
+        {"detection_id": i, "confidence": 0.5 + i / 100.0, "mask_polygons": [[float(j) for j in range(40)]]}
+        for i in range(30)
+    ],
+    "summary": {"num_detections": 30, "time_ms": {"inference": 12.5}},
+}
+ENVELOPE = {"_id": "65f0c0ffee0000000000abcd", "patient_name": "Zoë", "model_name": "unetpp"}
+
+
+def _splice_parts(result, envelope, precompress_encoding):
+    """As main.py does for /history/{id}: (prefix, blob, suffix) and the JSON it must decode to."""
+    prefix = http_responses.dumps(envelope)[:-1] + b',"result":'
+    blob = http_responses._gzip_spliceable(http_responses.dumps(result), http_responses.PRECOMPRESS_LEVELS[GZIP]) \
+        if precompress_encoding == GZIP else \
+        http_responses.compress(http_responses.dumps(result), ZSTD, http_responses.PRECOMPRESS_LEVELS[ZSTD])
+    return prefix, blob, b"}", http_responses.dumps({**envelope, "result": result})
+
+def _gunzip_single_member(data: bytes) -> bytes:
+    """Decode exactly one gzip member; fails on a bad CRC/length or trailing members."""
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    out = d.decompress(data) + d.flush()
+    assert d.eof and d.unused_data == b""
+    return out
+
+
+def test_gzip_splice_round_trip():
+    prefix, blob, suffix, expected = _splice_parts(RESULT, ENVELOPE, GZIP)
+    body = http_responses.splice(prefix, blob, suffix, GZIP)
+    assert body is not None
+    assert _gunzip_single_member(body) == expected
+    assert gzip.decompress(body) == expected
+    assert http_responses.loads(gzip.decompress(body)) == {**ENVELOPE, "result": RESULT}
+
+@pytest.mark.parametrize("level", [1, 6, 9])
+def test_gzip_splice_any_level(level):
+    prefix, blob, suffix, expected = _splice_parts(RESULT, ENVELOPE, GZIP)
+    assert _gunzip_single_member(http_responses.splice(prefix, blob, suffix, GZIP, level)) == expected
+
+def test_gzip_splice_empty_result():
+    prefix, blob, suffix, expected = _splice_parts({}, ENVELOPE, GZIP)
+    assert _gunzip_single_member(http_responses.splice(prefix, blob, suffix, GZIP)) == expected
+
+def test_crc32_combine_matches_zlib():
+    a, b = b"x" * 1000, bytes(range(256)) * 7
+    assert http_responses._crc32_combine(zlib.crc32(a), zlib.crc32(b), len(b)) == zlib.crc32(a + b)
+    assert http_responses._crc32_combine(zlib.crc32(a), zlib.crc32(b""), 0) == zlib.crc32(a)
+
+@pytest.mark.skipif(not http_responses.available_encodings()[ZSTD], reason="zstandard not installed")
+def test_zstd_splice_round_trip():
+    prefix, blob, suffix, expected = _splice_parts(RESULT, ENVELOPE, ZSTD)
+    body = http_responses.splice(prefix, blob, suffix, ZSTD)
+    assert body is not None
+    # a multi-frame stream: read across frames, as clients do
+    with http_responses.zstandard.ZstdDecompressor().stream_reader(body, read_across_frames=True) as reader:
+        assert reader.read() == expected
+
+def test_splice_unspliceable_blobs_fall_back():
+    prefix, blob, suffix, _ = _splice_parts(RESULT, ENVELOPE, GZIP)
+    # a gzip blob written before _gzip_spliceable (plain gzip.compress, mtime header + final block)
+    old_blob = gzip.compress(http_responses.dumps(RESULT), mtime=0)
+    assert http_responses.splice(prefix, old_blob, suffix, GZIP) is None
+    assert http_responses.splice(prefix, blob, suffix, "br") is None
+    assert http_responses.splice(prefix, blob, suffix, "identity") is None
@@ -0,0 +1,99 @@
+# test_raw_outputs.py
+"""Raw segmenter outputs: encode/decode and re-thresholding (no models loaded):  python -m pytest test_raw_outputs.py"""
+import numpy as np
+import pytest
+
+import raw_outputs
+from inference import decode_maskrcnn, decode_unet, rethreshold
+
+
+STEP = 1.0 / 255.0
+
+def prob_map(h=64, w=64):
+    """Two blobs of different strength on a noisy background."""
+    rng = np.random.default_rng(0)
+    p = rng.uniform(0.0, 0.2, size=(h, w)).astype(np.float32)
+    p[8:24, 8:24] = 0.9
+    p[40:56, 36:60] = 0.45
+    return p
+
+def instances(n=3, h=32, w=32):
+    rng = np.random.default_rng(1)
+    scores = np.array([0.3, 0.95, 0.02, 0.7][:n], dtype=np.float32)
+    labels = np.ones(n, dtype=np.int64)
+    masks = rng.uniform(0.0, 1.0, size=(n, h, w)).astype(np.float32)
+    return scores, labels, masks
+
+
+def test_prob_map_round_trip_within_one_step():
+    p = prob_map()
+    raw = raw_outputs.encode_prob_map(p)
+    assert raw["kind"] == raw_outputs.KIND_PROB_MAP and raw["shape"] == [64, 64]
+    out = raw_outputs.decode(raw)
+    assert out["probs"].dtype == np.float32
+    assert np.abs(out["probs"] - p).max() <= STEP / 2 + 1e-6
+
+def test_instances_sorted_filtered_and_exact_scores():
+    scores, labels, masks = instances(4)
+    out = raw_outputs.decode(raw_outputs.encode_instances(scores, labels, masks))
+    # descending score, below RAW_MIN_SCORE dropped
+    assert out["scores"].tolist() == pytest.approx([0.95, 0.7, 0.3])
+    assert out["scores"].dtype == np.float32
+    np.testing.assert_array_equal(out["scores"], scores[[1, 3, 0]])
+    assert out["labels"].tolist() == [1, 1, 1]
+    assert np.abs(out["masks"] - masks[[1, 3, 0]]).max() <= STEP / 2 + 1e-6
+
+def test_instances_capped(monkeypatch):
+    monkeypatch.setattr(raw_outputs, "RAW_MAX_INSTANCES", 2)
+    scores, labels, masks = instances(4)
+    raw = raw_outputs.encode_instances(scores, labels, masks)
+    assert raw["shape"] == [2, 32, 32]
+    assert raw_outputs.decode(raw)["scores"].tolist() == pytest.approx([0.95, 0.7])
+
+def test_decode_rejects_unknown_format_and_kind():
+    raw = raw_outputs.encode_prob_map(prob_map())
+    with pytest.raises(ValueError):
+        raw_outputs.decode({**raw, "format": "npz-f16"})
+    with pytest.raises(ValueError):
+        raw_outputs.decode({**raw, "kind": "heatmap"})
+
+def test_blob_survives_bytes_copy():
+    # Mongo hands the blob back as bson Binary / bytes
+    raw = raw_outputs.encode_prob_map(prob_map())
+    out = raw_outputs.decode({**raw, "blob": bytearray(raw["blob"])})
+    assert out["probs"].shape == (64, 64)
+
+
+@pytest.mark.parametrize("threshold", [0.3, 0.5, 0.8])
+def test_rethreshold_prob_map_matches_fresh_decode(threshold):
+    p = prob_map()
+    W, H = 128, 96
+    raw = raw_outputs.decode(raw_outputs.encode_prob_map(p))
+    result, mask = rethreshold(raw, W, H, threshold)
+    fresh_dets, fresh_mask = decode_unet(p, W, H, threshold)
+    assert result["result_meta"] == {"task": "segmentation_semantic", "thresholds": {"prob": threshold},
+                                     "rethresholded": True}
+    assert len(result["detections"]) == len(fresh_dets)
+    assert result["summary"]["num_detections"] == len(fresh_dets)
+    # quantization only moves pixels that sit within one step of the threshold
+    assert np.count_nonzero(mask != fresh_mask) <= 0.01 * mask.size
+    for d, f in zip(result["detections"], fresh_dets):
+        assert d["confidence"] == pytest.approx(f["confidence"], abs=STEP)
+
+def test_rethreshold_prob_map_lower_threshold_finds_more():
+    raw = raw_outputs.decode(raw_outputs.encode_prob_map(prob_map()))
+    strong, _ = rethreshold(raw, 64, 64, 0.6)
+    both, _ = rethreshold(raw, 64, 64, 0.4)
+    assert len(strong["detections"]) == 1
+    assert len(both["detections"]) == 2
+
+@pytest.mark.parametrize("threshold", [0.05, 0.5, 0.8])
+def test_rethreshold_instances_score_threshold_is_exact(threshold):
+    scores, labels, masks = instances(4)
+    raw = raw_outputs.decode(raw_outputs.encode_instances(scores, labels, masks))
+    result, mask = rethreshold(raw, 64, 64, threshold, mask_threshold=0.5)
+    fresh_dets, _ = decode_maskrcnn(scores, labels, masks, 64, 64, threshold, 0.5)
+    assert [d["confidence"] for d in result["detections"]] == [d["confidence"] for d in sorted(
+        fresh_dets, key=lambda d: -d["confidence"])]
+    assert result["result_meta"]["thresholds"] == {"score": threshold, "mask": 0.5}
+    assert mask.shape == (64, 64)
@@ -7,7 +7,7 @@ import { useEffect, useMemo, useRef } from "react";
 
 export const navItems = [
   { label: "step1", value: "1. Navigate to diagnosis page", img: step1, tip: "Go to Diagnostic to start a new case." },
-  { label: "step2", value: "2. Upload applicable images",   img: step2, tip: "Add clear endoscopic frames (max 10)." },
+  { label: "step2", value: "2. Upload applicable images",   img: step2, tip: "Add clear endoscopic frames." },
   { label: "step3", value: "3. Run the diagnosis",           img: step3, tip: "Pick a method and start the scan." },
   { label: "step4", value: "4. Check the results and options", img: step4, tip: "Compare views and review each polyp." },
   { label: "step5", value: "5. Browse through saved results",  img: step5, tip: "Open History to revisit past cases." },
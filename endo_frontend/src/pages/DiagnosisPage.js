@@ -16,7 +16,7 @@ export default function DiagnosisPage() {
   const [loading, setLoading] = useState(false);
 
   const handleFileChange = (e) => {
-    const selectedFiles = Array.from(e.target.files).slice(0, 10);
+    const selectedFiles = Array.from(e.target.files);
     setFiles(selectedFiles);
     setUploadResults([]);
     setPreviewUrls(selectedFiles.map((file) => URL.createObjectURL(file)));
@@ -27,26 +27,48 @@ export default function DiagnosisPage() {
       setMessage("Please select at least one file.");
       return;
     }
-    const formData = new FormData();
-    files.forEach((file) => formData.append("files", file));
-    formData.append("patient_name", patientName);
-    formData.append("patient_id", patientId);
-    formData.append("notes", notes);
-    formData.append("model_name", model);
-
     setMessage("Uploading & scanning…");
     setUploadResults([]);
     setLoading(true);
 
+    let results = [];
     try {
-      const res = await API.post("/upload", formData, {
-        headers: { "Content-Type": "multipart/form-data" },
+      // 1) ask the API for presigned S3 POST forms
+      const presign = await API.post("/upload/presign", {
+        files: files.map((f) => ({ filename: f.name, content_type: f.type || "image/jpeg" })),
       });
-      setUploadResults(res.data.results || []);
-      setMessage(res.data.message || "Done.");
+      const uploads = presign.data.uploads || [];
+      const batchSize = presign.data.max_files || uploads.length;
+
+      // 2) send the images straight to S3 (no auth header, no API bandwidth)
+      await Promise.all(
+        uploads.map(async ({ url, fields }, i) => {
+          const form = new FormData();
+          Object.entries(fields).forEach(([k, v]) => form.append(k, v));
+          form.append("file", files[i]);
+          const r = await fetch(url, { method: "POST", body: form });
+          if (!r.ok) throw new Error(`S3 upload failed (${r.status})`);
+        })
+      );
+
+      // 3) let the backend pull the objects and run inference, max_files per call
+      for (let start = 0; start < uploads.length; start += batchSize) {
+        const res = await API.post("/upload/finalize", {
+          keys: uploads.slice(start, start + batchSize).map((u) => u.key),
+          patient_name: patientName,
+          patient_id: patientId,
+          notes,
+          model_name: model,
+        });
+        results = results.concat(res.data.results || []);
+        setUploadResults(results);
+        setMessage(`Scanned ${results.length} of ${uploads.length}…`);
+      }
+      setMessage(`${results.length} files uploaded and scanned successfully with ${model} model.`);
     } catch (error) {
       console.error(error);
-      setMessage(error?.response?.data?.detail || "Upload failed.");
+      const detail = error?.response?.data?.detail || error?.message || "Upload failed.";
+      setMessage(results.length ? `${detail} (${results.length} files were scanned before the error)` : detail);
     } finally {
       setLoading(false);
     }
@@ -71,11 +93,13 @@ export default function DiagnosisPage() {
               <option value="unet">U-Net (segmentation)</option>
               <option value="unetpp">U-Net++ (segmentation)</option>
               <option value="maskrcnn">Mask R-CNN (segmentation)</option>
+              <option value="ensemble">Ensemble (YOLO 9t + YOLO 11n + U-Net++, fused)</option>
+              <option value="auto">Auto (YOLO 11n, U-Net++ only when uncertain)</option>
             </select>
           </div>
 
           <div className="mb-4">
-            <label className="block mb-1 font-semibold">Select Images (max 10)</label>
+            <label className="block mb-1 font-semibold">Select Images</label>
             <input
               type="file"
               onChange={handleFileChange}
@@ -219,7 +219,7 @@ export default function HomePage() {
                 step2: {
                 title: "2. Upload applicable images",
                 lead:
-                    "Add clear endoscopic frames (max 10 per run) for the best results.",
+                    "Add clear endoscopic frames for the best results.",
                 bullets: [
                     "Supported formats: JPG, PNG. Recommended ≥ 640×480.",
                     "Use frames in-focus with minimal motion blur when possible.",